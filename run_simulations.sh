@@ -1,7 +1,9 @@
 #!/bin/bash
 
+# runs the sybil poisoning sweep for seeds 1..$1 on all cores, any further
+# arguments are passed on to the sweep (e.g. --workers, --backend). The hash
+# seed is fixed so the results of a seed are the same in every run.
+
 cd simulator
 
-for i in $(seq 1 $1); do
-  python3 . $i
-done
+PYTHONHASHSEED=${PYTHONHASHSEED:-0} python3 sweep.py --seeds $1 "${@:2}"
@@ -6,44 +6,13 @@ from utils import int_to_bytes
 from simulator import SimulatedNode
 from node import Root, NodeId, compute_node_score
 from attack import SybilAttack, DefunctSubTreeAttack, BalancingAttack, EclipseAttack
+from graphs import NUM_NODES_RANDOM, DEGREE, construct_acyclic_graph, graph_init
+from results import ResultSink
 import numpy as np
 import os
 import json
 import sys
 
-# TODO: change this to not be a global variable
-GRAPH_JSON_FILE = "./data/random_graph.json"
-NUM_NODES_RANDOM = 10000
-DEGREE = 50
-# mimics a rated list tree without any cycles.
-
-
-def construct_acyclic_graph(degree: int = 5) -> rx.PyGraph:
-    G = rx.PyGraph()
-
-    current_node_count = 1
-    G.add_node(0)
-
-    for i in range(degree):
-        G.add_node(current_node_count)
-        G.add_edge(0, current_node_count, None)
-        level_1 = current_node_count
-        current_node_count += 1
-
-        for i in range(degree):
-            G.add_node(current_node_count)
-            G.add_edge(level_1, current_node_count, None)
-            level_2 = current_node_count
-            current_node_count += 1
-
-            for i in range(degree):
-                G.add_node(current_node_count)
-                G.add_edge(level_2, current_node_count, None)
-                current_node_count += 1
-
-    return G
-
-
 def acyclic_graph_defunct_subtree_test(querying_strategy="high"):
     logging.info("\nAcyclic Graph Defunct Sub Tree Attack:\n")
     # construct an acyclic subtree
@@ -97,8 +66,8 @@ def random_graph_defunct_subtree_test(querying_strategy="high"):
     return sim_node.print_report(report)
 
 
-def sybil_poisoning_test(graph):
-    sim_node = SimulatedNode(graph=graph)
+def sybil_poisoning_test(graph, sink: ResultSink = None):
+    sim_node = SimulatedNode(graph=graph, sink=sink)
 
     block_root = Root(int_to_bytes(0))
 
@@ -106,6 +75,7 @@ def sybil_poisoning_test(graph):
         logging.info(f"\n\nSybil Attack: Rate {rate}\n")
         sybil_attack = SybilAttack(graph=graph, sybil_rate=rate)
         sim_node.load_attack(sybil_attack)
+        sim_node.run_info["rate"] = rate
         for threshold in np.arange(0.9, 0.0, -0.1):
             for strategy in ["high", "low", "random"]:
                 sim_node.refresh_scores()
@@ -199,30 +169,7 @@ def balancing_attack(graph, querying_strategy="high"):
 #         return graph
 
 
-def graph_init():
-    if os.path.isfile(GRAPH_JSON_FILE):
-        logging.info("loading graph from json file")
-        graph = rx.from_node_link_json_file(GRAPH_JSON_FILE, node_attrs=de_node_data)
-    else:
-        logging.info("graph not found generating graph")
-        graph = rx.undirected_gnp_random_graph(
-            NUM_NODES_RANDOM, DEGREE / NUM_NODES_RANDOM
-        )
-        rx.node_link_json(graph, path=GRAPH_JSON_FILE, node_attrs=ser_node_data)
-    return graph
-
-
-def de_node_data(data):
-    return int(data["value"])
-
-
-def ser_node_data(data):
-    mydict = {}
-    mydict["value"] = str(data)
-    return mydict
-
-
-def main():
+def main(sink: ResultSink = None):
     graph = graph_init()
 
     start_time = time.time()
@@ -233,7 +180,7 @@ def main():
     # acyclic_graph_defunct_subtree_test()
     # random_graph_defunct_subtree_test()
 
-    sybil_poisoning_test(graph)
+    sybil_poisoning_test(graph, sink)
 
     # eclipse_attack_test(0.5)
 
@@ -245,6 +192,7 @@ def main():
 if __name__ == "__main__":
     run_num = sys.argv[1]
     filename = "./data/log_file_" + str(run_num) + ".log"
+    results = "./data/results_" + str(run_num)
 
     print(filename)
 
@@ -255,4 +203,5 @@ if __name__ == "__main__":
         format="%(levelname)s - %(message)s",
     )
 
-    main()
+    with ResultSink(results) as sink:
+        main(sink)
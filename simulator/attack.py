@@ -1,72 +1,175 @@
 import rustworkx as rx
-from node import MAX_TREE_DEPTH
+import numpy as np
+import copy
+from typing import Dict, Sequence, Tuple
+from node import DATA_COLUMN_SIDECAR_SUBNET_COUNT, MAX_TREE_DEPTH
 import random
 import logging 
 
+from graphs import CSRGraph
+import seeding
+
 
 class NodeBehaviour:
+    # static behaviours answer every vertex the same way no matter which
+    # requests came before, so answers can be evaluated ahead of the requests
+    is_static = True
+
     def should_respond(self, node_vertice: int) -> bool:
         raise NotImplementedError("Override and implement")
 
+    def should_respond_batch(self, node_vertices: np.ndarray) -> np.ndarray:
+        # answers for a batch of requests, in request order
+        return np.array(
+            [self.should_respond(int(vertice)) for vertice in node_vertices],
+            dtype=bool,
+        )
+
+    def should_respond_requests(
+        self, node_vertices: np.ndarray, sample_ids: np.ndarray, block_root
+    ) -> np.ndarray:
+        # answers for a batch of requests of one block root, in request order.
+        # Behaviours that are not static override this, the others only look
+        # at the vertices.
+        return self.should_respond_batch(node_vertices)
+
+    def should_respond_request(self, node_vertice: int, sample_id: int, block_root) -> bool:
+        if self.is_static:
+            return self.should_respond(node_vertice)
+        return bool(
+            self.should_respond_requests(
+                np.array([node_vertice], dtype=np.int64),
+                np.array([sample_id], dtype=np.int64),
+                block_root,
+            )[0]
+        )
+
+    def reset(self):
+        # forget the requests seen so far, static behaviours have no state
+        pass
+
+
+def neighbor_pairs(graph, vertices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # (vertex, peer) for every edge at the given vertices, sorted by both.
+    # CSR graphs are gathered from their arrays, other graphs one neighbour
+    # list per vertex.
+    vertices = np.asarray(vertices, dtype=np.int64)
+    if isinstance(graph, CSRGraph):
+        counts = graph.indptr[vertices + 1] - graph.indptr[vertices]
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        peers = graph.indices[np.repeat(graph.indptr[vertices], counts) + offsets].astype(np.int64)
+        sources = np.repeat(vertices, counts)
+        extra = [(vertex, peer) for vertex in vertices.tolist() for peer in graph.extra.get(vertex, ())]
+    else:
+        lists = [graph.neighbors(vertex) for vertex in vertices.tolist()]
+        peers = np.fromiter((peer for peers in lists for peer in peers), dtype=np.int64)
+        sources = np.repeat(vertices, [len(peers) for peers in lists])
+        extra = []
+
+    if extra:
+        extra = np.array(extra, dtype=np.int64)
+        sources = np.concatenate((sources, extra[:, 0]))
+        peers = np.concatenate((peers, extra[:, 1]))
+
+    order = np.argsort(sources * (int(peers.max(initial=0)) + 1) + peers)
+    return sources[order], peers[order]
+
 
 class AttackVec(NodeBehaviour):
-    def __init__(self, graph: rx.PyGraph, num_attack_nodes: int = 0):
+    """
+    The malicious vertices are kept as a boolean mask over the vertex
+    indices (vertices beyond it are honest), answers are looked up in it.
+    """
+
+    def __init__(self, graph: rx.PyGraph, num_attack_nodes: int = 0, seed: int = None):
         super().__init__()
         self.graph = graph
         self.num_attack_nodes = num_attack_nodes
+        self.seed = seed
+        self.malicious_mask = np.zeros(0, dtype=bool)
+        self.malicious_nodes = set()
+
+    def random_stream(self, *key: int) -> np.random.Generator:
+        # a seeded attack draws from the run's attack stream, so setting it up
+        # again picks the same nodes. Without a seed the stream is seeded from
+        # the global random module, runs after random.seed() stay repeatable.
+        if self.seed is None:
+            return np.random.default_rng(random.getrandbits(64))
+        return seeding.generator(self.seed, "attack", *key)
+
+    def mark_malicious(self, vertices: np.ndarray):
+        vertices = np.asarray(vertices, dtype=np.int64)
+        mask = np.zeros(int(vertices.max(initial=-1)) + 1, dtype=bool)
+        mask[vertices] = True
+        self.malicious_mask = mask
+        self.malicious_nodes = set(np.flatnonzero(mask).tolist())
+        self.num_attack_nodes = len(self.malicious_nodes)
 
     def setup_attack(self):
         raise NotImplementedError("Override and implement")
 
+    def should_respond(self, node_vertice: int) -> bool:
+        return node_vertice >= len(self.malicious_mask) or not self.malicious_mask[node_vertice]
+
+    def should_respond_batch(self, node_vertices: np.ndarray) -> np.ndarray:
+        node_vertices = np.asarray(node_vertices, dtype=np.int64)
+        inside = node_vertices < len(self.malicious_mask)
+        answers = np.ones(len(node_vertices), dtype=bool)
+        answers[inside] = ~self.malicious_mask[node_vertices[inside]]
+        return answers
+
     def get_malicious_nodes(self):
-        raise NotImplementedError("Override and implement")
+        return self.malicious_nodes
 
 
 class SybilAttack(AttackVec):
-    def __init__(self, graph: rx.PyGraph, sybil_rate: float):
-        super().__init__(graph)
+    def __init__(self, graph: rx.PyGraph, sybil_rate: float, seed: int = None):
+        super().__init__(graph, seed=seed)
         self.num_attack_nodes = int(graph.num_nodes() * sybil_rate)
-        self.malicious_nodes = set()
 
     def setup_attack(self):
-        all_nodes = list(self.graph.nodes())
-        sybil_nodes = random.sample(all_nodes, self.num_attack_nodes)
-        self.malicious_nodes.update(sybil_nodes)
+        rng = self.random_stream()
+        all_nodes = np.asarray(self.graph.node_indices(), dtype=np.int64)
+        sybil_nodes = all_nodes[rng.choice(len(all_nodes), size=self.num_attack_nodes, replace=False)]
+        self.mark_malicious(sybil_nodes)
 
         # we go an extra step to create random connections with more peers
-        # this might prove useful with the provided graph is not random
-        for sybil in sybil_nodes:
-            neighbors = random.sample(all_nodes, random.randint(1, 5))
-            for neighbor in neighbors:
-                if not self.graph.has_edge(sybil, neighbor):
-                    self.graph.add_edge(sybil, neighbor, None)
-
-        # print(f"Sybil nodes {self.malicious_nodes}")
-
-    def should_respond(self, node_vertice: int) -> bool:
-        return node_vertice not in self.malicious_nodes
-
-    def get_malicious_nodes(self):
-        return self.malicious_nodes
+        # this might prove useful with the provided graph is not random.
+        # Every sybil draws 1-5 peers, repeated draws, self loops and
+        # existing edges are dropped and the rest is added in one batch.
+        counts = rng.integers(1, 6, size=len(sybil_nodes))
+        sources = np.repeat(sybil_nodes, counts)
+        targets = all_nodes[rng.integers(len(all_nodes), size=len(sources))]
+        keep = sources != targets
+
+        sources, targets = sources[keep], targets[keep]
+
+        # an edge exists if the target is a peer of the sybil, the sorted
+        # (sybil, peer) keys are searched for every draw
+        key_base = int(all_nodes.max(initial=0)) + 1
+        vertices, peers = neighbor_pairs(self.graph, sybil_nodes)
+        existing = vertices * key_base + peers
+        drawn = sources * key_base + targets
+        position = np.searchsorted(existing, drawn).clip(max=max(len(existing) - 1, 0))
+        if len(existing):
+            new = existing[position] != drawn
+            sources, targets = sources[new], targets[new]
+
+        # the same link drawn twice, possibly from both of its ends
+        keys = np.unique(np.minimum(sources, targets) * key_base + np.maximum(sources, targets))
+        low, high = np.divmod(keys, key_base)
+        self.graph.add_edges_from_no_data(list(zip(low.tolist(), high.tolist())))
 
 
 class EclipseAttack(AttackVec):
     def __init__(self, graph: rx.PyGraph, compromised_node: int, eclipse_rate: int):
         super().__init__(graph)
-        self.malicious_nodes = set()
         self.compromised_node = compromised_node
         # TODO: Use the rate to measure the amount of nodes required to eclipse a node
         self.eclipse_rate = eclipse_rate
 
     def setup_attack(self):
-        self.malicious_nodes = set(self.graph.neighbors(self.compromised_node))
-        self.num_attack_nodes = len(self.malicious_nodes)
-
-    def should_respond(self, node_vertice: int) -> bool:
-        return node_vertice not in self.malicious_nodes
-
-    def get_malicious_nodes(self):
-        return self.malicious_nodes
+        self.mark_malicious(self.graph.neighbors(self.compromised_node))
 
 
 class BalancingAttack(AttackVec):
@@ -75,61 +178,255 @@ class BalancingAttack(AttackVec):
     with malicious nodes and bringing their score down
     """
 
-    def __init__(self, graph: rx.PyGraph, root_node: int):
-        super().__init__(graph)
+    def __init__(self, graph: rx.PyGraph, root_node: int, seed: int = None):
+        super().__init__(graph, seed=seed)
         self.root_node = root_node
-        self.malicious_nodes = set()
 
-    def recursively_add_children(self, parent, node, factor, depth=0):
-        if depth == MAX_TREE_DEPTH:
-            return
-        depth += 1
-        neighbours = self.graph.neighbors(node)
-        for peer in random.sample(list(neighbours), int(len(neighbours) * factor)):
-            if peer != parent:
-                self.malicious_nodes.add(peer)
-                self.recursively_add_children(node, peer, factor, depth)
+    def poison_subtree(self, rng: np.random.Generator, node: int, factor: float) -> np.ndarray:
+        # depth limited bfs from node, every vertex of a level passes the
+        # attack on to a random factor of its peers that were not reached yet
+        visited = np.array([node], dtype=np.int64)
+        frontier = visited
+        poisoned = []
+        for _ in range(MAX_TREE_DEPTH):
+            sources, peers = neighbor_pairs(self.graph, frontier)
+            if len(peers) == 0:
+                break
+
+            # a random order within the peers of every vertex, the first
+            # int(degree * factor) of them are picked
+            starts = np.flatnonzero(np.r_[True, sources[1:] != sources[:-1]])
+            degrees = np.diff(np.r_[starts, len(sources)])
+            segment = np.repeat(np.arange(len(starts)), degrees)
+            order = np.lexsort((rng.random(len(peers)), segment))
+            rank = np.arange(len(peers)) - np.repeat(starts, degrees)
+            picked = peers[order][rank < (degrees * factor).astype(np.int64)[segment]]
+
+            frontier = np.setdiff1d(picked, visited)
+            visited = np.union1d(visited, frontier)
+            poisoned.append(frontier)
+
+        return np.concatenate(poisoned) if poisoned else np.empty(0, dtype=np.int64)
 
     def setup_attack(self):
-        honest_node = random.choice(self.graph.neighbors(self.root_node))
+        rng = self.random_stream()
+        root_neighbours = sorted(self.graph.neighbors(self.root_node))
+        honest_node = root_neighbours[rng.integers(len(root_neighbours))]
         # we try to poison one of the honest subtree
-        self.recursively_add_children(None, honest_node, 0.3)
+        self.mark_malicious(self.poison_subtree(rng, honest_node, 0.3))
 
-        malicious_subtree_root = random.choice(self.graph.neighbors(self.root_node))
+        malicious_subtree_root = root_neighbours[rng.integers(len(root_neighbours))]
         # offline an entire subtree bringing the global confidence score down
-        # self.recursively_add_children(None, malicious_subtree_root,1)
-        self.num_attack_nodes = len(self.malicious_nodes)
+        # self.poison_subtree(rng, malicious_subtree_root, 1)
         logging.debug(f"malicious nodes={self.num_attack_nodes}")
 
-    def should_respond(self, node_vertice: int) -> bool:
-        return node_vertice not in self.malicious_nodes
-
-    def get_malicious_nodes(self):
-        return self.malicious_nodes
-
 
 class DefunctSubTreeAttack(AttackVec):
     def __init__(self, graph: rx.PyGraph, defunct_sub_root: int, parent_sub_root: int):
         super().__init__(graph)
         self.parent_sub_root = parent_sub_root
         self.defunct_sub_root = defunct_sub_root
-        self.malicious_nodes = set()
 
-    def recursively_add_children(self, parent, node, depth=0):
-        if depth == MAX_TREE_DEPTH:
-            return
+    def setup_attack(self):
+        # every vertex within MAX_TREE_DEPTH - 1 hops of the defunct root,
+        # without going back to its parent on the first hop. A depth limited
+        # bfs that visits each vertex once.
+        visited = np.array([self.defunct_sub_root], dtype=np.int64)
+        frontier = visited
+        for depth in range(1, MAX_TREE_DEPTH):
+            _, peers = neighbor_pairs(self.graph, frontier)
+            if depth == 1:
+                peers = peers[peers != self.parent_sub_root]
+            frontier = np.setdiff1d(peers, visited)
+            visited = np.union1d(visited, frontier)
+
+        self.mark_malicious(visited[visited != self.defunct_sub_root])
+
+
+class FixedAttack(AttackVec):
+    """
+    Attack with a precomputed set of malicious vertices, given as a boolean
+    mask over the graph vertices. Used to share one attack between the rated
+    lists of many nodes.
+    """
+
+    def __init__(self, graph: rx.PyGraph, malicious_mask: np.ndarray):
+        super().__init__(graph, int(malicious_mask.sum()))
+        self.malicious_mask = malicious_mask
+        self.malicious_nodes = set(np.flatnonzero(malicious_mask).tolist())
+
+    def setup_attack(self):
+        # the malicious vertices (and any edges they added) are already set up
+        pass
+
+
+def occurrence_rank(values: np.ndarray) -> np.ndarray:
+    # 0 for the first occurrence of a value, 1 for the second and so on
+    order = np.argsort(values, kind="stable")
+    ordered = values[order]
+    positions = np.arange(len(values))
+    starts = np.r_[True, ordered[1:] != ordered[:-1]] if len(values) else np.empty(0, dtype=bool)
+    rank = np.empty(len(values), dtype=np.int64)
+    rank[order] = positions - np.maximum.accumulate(np.where(starts, positions, 0))
+    return rank
+
 
-        for peer in self.graph.neighbors(node):
-            if peer != parent:
-                self.malicious_nodes.add(peer)
-                self.recursively_add_children(node, peer, depth + 1)
+class AdaptiveAttack(AttackVec):
+    """
+    Malicious vertices whose answers depend on the requests they get. The
+    vertices are chosen by a static attack (e.g. a SybilAttack) and honest
+    vertices always answer, subclasses decide the answers of the malicious
+    ones request by request from their state.
+    """
+
+    is_static = False
+
+    def __init__(self, attack: AttackVec, seed: int = None):
+        super().__init__(attack.graph, seed=seed)
+        self.attack = attack
 
     def setup_attack(self):
-        self.recursively_add_children(self.parent_sub_root, self.defunct_sub_root, 1)
+        self.attack.setup_attack()
+        self.malicious_mask = self.attack.malicious_mask
+        self.malicious_nodes = self.attack.get_malicious_nodes()
         self.num_attack_nodes = len(self.malicious_nodes)
+        self.vertices = np.flatnonzero(self.malicious_mask)
+        self.reset()
+
+    def fork(self) -> "AdaptiveAttack":
+        # shares the graph and the malicious vertices but not the state
+        branch = copy.copy(self)
+        branch.__dict__.update(copy.deepcopy(self.state()))
+        return branch
+
+    def state(self) -> Dict:
+        # the attributes that change with the requests
+        return {}
+
+    def malicious_answers(
+        self, node_vertices: np.ndarray, sample_ids: np.ndarray, block_root
+    ) -> np.ndarray:
+        raise NotImplementedError("Override and implement")
 
-    def should_respond(self, node_vertice: int) -> bool:
-        return node_vertice not in self.malicious_nodes
+    def should_respond_requests(
+        self, node_vertices: np.ndarray, sample_ids: np.ndarray, block_root
+    ) -> np.ndarray:
+        node_vertices = np.asarray(node_vertices, dtype=np.int64)
+        answers = self.should_respond_batch(node_vertices)
+        malicious = np.flatnonzero(~answers)
+        if len(malicious):
+            answers[malicious] = self.malicious_answers(
+                node_vertices[malicious], np.asarray(sample_ids)[malicious], block_root
+            )
+        return answers
 
-    def get_malicious_nodes(self):
-        return self.malicious_nodes
+
+class ProbabilisticAttack(AdaptiveAttack):
+    # every request to a malicious vertex is answered with probability p
+
+    def __init__(self, attack: AttackVec, p: float = 0.5, seed: int = None):
+        if not 0 <= p <= 1:
+            raise ValueError("p must be a probability")
+        super().__init__(attack, seed=seed)
+        self.p = p
+
+    def reset(self):
+        self.rng = self.random_stream(1)
+
+    def state(self) -> Dict:
+        return {"rng": self.rng}
+
+    def malicious_answers(self, node_vertices, sample_ids, block_root) -> np.ndarray:
+        return self.rng.random(len(node_vertices)) < self.p
+
+
+class ThresholdAttack(AdaptiveAttack):
+    """
+    Malicious vertices withhold whenever their score stays at or above the
+    threshold afterwards and answer otherwise, so they keep passing the
+    filter while answering as little as they can. A vertex only knows the
+    requests it got itself, its score is its own ratio of replied to
+    requested samples of the block.
+    """
+
+    def __init__(self, attack: AttackVec, threshold: float = 0.9, seed: int = None):
+        super().__init__(attack, seed=seed)
+        self.threshold = threshold
+
+    def reset(self):
+        # block root -> (requested, replied) per malicious vertex
+        self.counts: Dict = {}
+
+    def state(self) -> Dict:
+        return {"counts": self.counts}
+
+    def malicious_answers(self, node_vertices, sample_ids, block_root) -> np.ndarray:
+        counts = self.counts.get(block_root)
+        if counts is None:
+            counts = np.zeros((2, len(self.vertices)), dtype=np.int32)
+            self.counts[block_root] = counts
+        requested, replied = counts
+
+        index = np.searchsorted(self.vertices, node_vertices)
+        answers = np.empty(len(node_vertices), dtype=bool)
+        # a vertex requested several times in a batch answers them in order,
+        # one round per repetition
+        rank = occurrence_rank(index)
+        for repetition in range(int(rank.max(initial=-1)) + 1):
+            batch = np.flatnonzero(rank == repetition)
+            nodes = index[batch]
+            answer = replied[nodes] < self.threshold * (requested[nodes] + 1)
+            requested[nodes] += 1
+            replied[nodes] += answer
+            answers[batch] = answer
+        return answers
+
+
+class ColludingColumnAttack(AdaptiveAttack):
+    """
+    The malicious vertices collude to withhold a set of target columns and
+    answer the others to keep their scores up. The withholding starts once
+    they got warmup requests between them, until then they answer all
+    requests and build up their scores.
+    """
+
+    def __init__(
+        self,
+        attack: AttackVec,
+        target_columns: Sequence[int] = None,
+        num_columns: int = 1,
+        warmup: int = 0,
+        seed: int = None,
+    ):
+        super().__init__(attack, seed=seed)
+        self.target_columns = target_columns
+        self.num_columns = num_columns
+        self.warmup = warmup
+
+    def setup_attack(self):
+        super().setup_attack()
+        if self.target_columns is None:
+            rng = self.random_stream(1)
+            self.target_columns = rng.choice(
+                DATA_COLUMN_SIDECAR_SUBNET_COUNT, size=self.num_columns, replace=False
+            )
+        self.targets = np.zeros(DATA_COLUMN_SIDECAR_SUBNET_COUNT, dtype=bool)
+        self.targets[np.asarray(self.target_columns, dtype=np.int64)] = True
+
+    def reset(self):
+        self.requests = 0
+
+    def state(self) -> Dict:
+        return {"requests": self.requests}
+
+    def malicious_answers(self, node_vertices, sample_ids, block_root) -> np.ndarray:
+        seen = self.requests + np.arange(len(node_vertices))
+        self.requests += len(node_vertices)
+        return ~((seen >= self.warmup) & self.targets[np.asarray(sample_ids, dtype=np.int64)])
+
+
+ADAPTIVE_ATTACKS = {
+    "probabilistic": ProbabilisticAttack,
+    "threshold": ThresholdAttack,
+    "colluding": ColludingColumnAttack,
+}
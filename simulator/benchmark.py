@@ -0,0 +1,315 @@
+import argparse
+import contextlib
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from dataclasses import dataclass, asdict
+from typing import Callable, Dict, List, Sequence
+import numpy as np
+import rustworkx as rx
+
+import indexed_node
+import matrix_scores
+import node as rl_node
+from attack import SybilAttack
+from custody import CustodyTable, compute_custody_columns
+from graphs import construct_acyclic_graph, graph_init
+from node import DATA_COLUMN_SIDECAR_SUBNET_COUNT, NodeId, Root, get_custody_columns
+from simulator import SimulatedNode
+from utils import int_to_bytes
+
+# Benchmarks of the rated list spec functions and of the simulator around
+# them. Every case (graph, size, degree, tree depth, backend) times each
+# benchmark a few times and the results are stored as json, so a change to
+# node.py or to the simulator can be compared against a stored baseline.
+
+BENCHMARK_OUTPUT_FILE = "./data/benchmark.json"
+BENCHMARKS = (
+    "construct_tree",
+    "compute_node_score",
+    "filter_nodes",
+    "filter_columns",
+    "matrix_scores",
+    "on_request_score_update",
+    "on_response_score_update",
+    "get_custody_columns",
+    "query_samples",
+)
+
+
+@dataclass(frozen=True)
+class BenchmarkCase:
+    graph: str
+    num_nodes: int
+    degree: int
+    depth: int
+    backend: str
+
+    @property
+    def name(self) -> str:
+        return f"{self.graph}-n{self.num_nodes}-d{self.degree}-t{self.depth}-{self.backend}"
+
+
+@contextlib.contextmanager
+def tree_depth(depth: int):
+    # MAX_TREE_DEPTH is imported by name into the simulator modules, all the
+    # copies are set for the duration of a case
+    default = rl_node.MAX_TREE_DEPTH
+    modules = [
+        module
+        for module in list(sys.modules.values())
+        if getattr(module, "MAX_TREE_DEPTH", None) == default
+    ]
+    for module in modules:
+        module.MAX_TREE_DEPTH = depth
+    try:
+        yield
+    finally:
+        for module in modules:
+            module.MAX_TREE_DEPTH = default
+
+
+def make_graph(kind: str, num_nodes: int, degree: int, seed: int) -> rx.PyGraph:
+    if kind == "acyclic":
+        return construct_acyclic_graph(degree)
+    if kind == "gnp":
+        return graph_init(num_nodes, degree, seed).copy()
+    raise ValueError(f"unknown graph kind {kind}")
+
+
+def measure(run: Callable[[], None], repeats: int, setup: Callable[[], None] = None) -> List[float]:
+    timings = []
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start_time = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start_time)
+    return timings
+
+
+def run_case(case: BenchmarkCase, repeats: int = 3, ops: int = 1000, seed: int = 1) -> List[Dict]:
+    rng = random.Random(seed)
+    graph = make_graph(case.graph, case.num_nodes, case.degree, seed)
+    custody = CustodyTable.for_graph(graph) if case.backend == "indexed" else None
+    block_root = Root(int_to_bytes(0))
+    results = []
+
+    def record(benchmark: str, timings: List[float], count: int = 1):
+        results.append(
+            {
+                "case": case.name,
+                **asdict(case),
+                "graph_nodes": graph.num_nodes(),
+                "benchmark": benchmark,
+                "ops": count,
+                "median": statistics.median(timings),
+                "min": min(timings),
+                "per_op": statistics.median(timings) / count,
+                "repeats": len(timings),
+            }
+        )
+
+    with tree_depth(case.depth):
+        # the acyclic graph is built around vertex 0
+        root = 0 if case.graph == "acyclic" else rng.choice(graph.node_indices())
+
+        def construct():
+            return SimulatedNode(
+                graph=graph, binding_vertex=root, seed=seed, backend=case.backend, custody=custody
+            )
+
+        record("construct_tree", measure(construct, repeats))
+
+        sim_node = construct()
+        sim_node.load_attack(SybilAttack(graph=graph.copy(), sybil_rate=0.3, seed=seed))
+        rl = sim_node.rl
+        dht = sim_node.dht
+
+        if case.backend == "indexed":
+            keys = [i for i, present in enumerate(dht.present) if present and i != dht.own_id]
+        else:
+            keys = [key for key in dht.nodes if key != dht.own_id]
+        picks = [rng.choice(keys) for _ in range(ops)]
+        samples = [rng.randrange(DATA_COLUMN_SIDECAR_SUBNET_COUNT) for _ in range(ops)]
+
+        def request_updates():
+            for key, sample in zip(picks, samples):
+                rl.on_request_score_update(dht, block_root, key, sample)
+
+        def response_updates():
+            for key, sample in zip(picks, samples):
+                rl.on_response_score_update(dht, block_root, key, sample)
+
+        record("on_request_score_update", measure(request_updates, repeats, sim_node.refresh_scores), ops)
+        # responses follow the requests of the same nodes
+        record("on_response_score_update", measure(response_updates, repeats, request_updates), ops)
+
+        node_picks = picks[: max(1, ops // 10)]
+        record(
+            "compute_node_score",
+            measure(lambda: [rl.compute_node_score(dht, block_root, key) for key in node_picks], repeats),
+            len(node_picks),
+        )
+        record(
+            "filter_nodes",
+            measure(
+                lambda: [
+                    rl.filter_nodes(dht, block_root, sample, 0.9)
+                    for sample in range(DATA_COLUMN_SIDECAR_SUBNET_COUNT)
+                    if sample in dht.sample_mapping
+                ],
+                repeats,
+            ),
+            DATA_COLUMN_SIDECAR_SUBNET_COUNT,
+        )
+
+        if case.backend == "indexed":
+            record(
+                "filter_columns",
+                measure(
+                    lambda: indexed_node.filter_columns(
+                        dht, block_root, range(DATA_COLUMN_SIDECAR_SUBNET_COUNT), 0.9
+                    ),
+                    repeats,
+                ),
+                DATA_COLUMN_SIDECAR_SUBNET_COUNT,
+            )
+            record("matrix_scores", measure(lambda: matrix_scores.node_scores(dht, block_root), repeats))
+
+        vertices = [sim_node.to_vertex(key) for key in picks]
+        if case.backend == "indexed":
+            record(
+                "get_custody_columns",
+                measure(lambda: compute_custody_columns(vertices), repeats),
+                ops,
+            )
+        else:
+            node_ids = [NodeId(int_to_bytes(vertex)) for vertex in vertices]
+            record(
+                "get_custody_columns",
+                measure(lambda: [get_custody_columns(node_id) for node_id in node_ids], repeats),
+                ops,
+            )
+
+        record(
+            "query_samples",
+            measure(lambda: sim_node.query_samples(block_root, "high"), repeats, sim_node.refresh_scores),
+        )
+
+    return results
+
+
+def benchmark_cases(
+    graphs: Sequence[str],
+    sizes: Sequence[int],
+    degrees: Sequence[int],
+    depths: Sequence[int],
+    backends: Sequence[str],
+) -> List[BenchmarkCase]:
+    cases = []
+    for graph in graphs:
+        for num_nodes in sizes:
+            # the acyclic graph has 1 + d + d^2 + d^3 nodes, its degree
+            # follows from the size
+            if graph == "acyclic":
+                degrees_of_size = [max(1, round(num_nodes ** (1 / 3)))]
+            else:
+                degrees_of_size = degrees
+            for degree in degrees_of_size:
+                for depth in depths:
+                    for backend in backends:
+                        cases.append(BenchmarkCase(graph, num_nodes, degree, depth, backend))
+    return cases
+
+
+def compare(results: List[Dict], baseline: List[Dict], tolerance: float = 1.2) -> List[Dict]:
+    # ratio of the median time to the baseline for every benchmark both runs
+    # have, regressions are the ones slower than tolerance times the baseline
+    previous = {(r["case"], r["benchmark"]): r for r in baseline}
+    comparison = []
+    for result in results:
+        base = previous.get((result["case"], result["benchmark"]))
+        if base is None:
+            continue
+        ratio = result["median"] / base["median"] if base["median"] > 0 else float("inf")
+        comparison.append(
+            {
+                "case": result["case"],
+                "benchmark": result["benchmark"],
+                "baseline": base["median"],
+                "median": result["median"],
+                "ratio": ratio,
+                "regression": ratio > tolerance,
+            }
+        )
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmarks of the rated list spec functions")
+    parser.add_argument("--graphs", nargs="+", default=["acyclic", "gnp"], choices=["acyclic", "gnp"])
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1000, 10000])
+    parser.add_argument("--degrees", nargs="+", type=int, default=[50])
+    parser.add_argument("--depths", nargs="+", type=int, default=[rl_node.MAX_TREE_DEPTH])
+    parser.add_argument("--backends", nargs="+", default=["spec", "indexed"], choices=["spec", "indexed"])
+    parser.add_argument("--only", nargs="+", default=None, choices=BENCHMARKS, help="benchmarks to report")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--ops", type=int, default=1000, help="calls per benchmark of a single function")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default=BENCHMARK_OUTPUT_FILE)
+    parser.add_argument("--baseline", default=None, help="json results to compare against")
+    parser.add_argument("--tolerance", type=float, default=1.2)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(message)s")
+
+    results = []
+    for case in benchmark_cases(args.graphs, args.sizes, args.degrees, args.depths, args.backends):
+        logging.info(f"running {case.name}")
+        for result in run_case(case, args.repeats, args.ops, args.seed):
+            if args.only is None or result["benchmark"] in args.only:
+                results.append(result)
+                logging.info(
+                    f"  {result['benchmark']}: median={result['median']:.6f}s per_op={result['per_op']:.3e}s"
+                )
+
+    output = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "rustworkx": rx.__version__,
+            "machine": platform.machine(),
+            "max_tree_depth": rl_node.MAX_TREE_DEPTH,
+            "max_children": rl_node.MAX_CHILDREN,
+        },
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as file:
+        json.dump(output, file, indent=2)
+    logging.info(f"wrote {len(results)} results to {args.output}")
+
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)["results"]
+
+        comparison = compare(results, baseline, args.tolerance)
+        for item in comparison:
+            flag = "REGRESSION" if item["regression"] else ""
+            logging.info(
+                f"{item['case']} {item['benchmark']}: {item['baseline']:.6f}s -> {item['median']:.6f}s "
+                f"({item['ratio']:.2f}x) {flag}"
+            )
+        if any(item["regression"] for item in comparison):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+import argparse
+import logging
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Set, Tuple
+import numpy as np
+import rustworkx as rx
+
+from graphs import graph_init, NUM_NODES_RANDOM, DEGREE
+from node import MAX_TREE_DEPTH
+from results import ResultSink
+import seeding
+from simulator import SimulatedNode
+
+# Churn: graph edges and nodes come and go over simulated time and the rated
+# list tree is maintained incrementally. Only the nodes whose peers changed
+# (and the nodes that move in or out of the queried levels) are asked for
+# their peers again, instead of constructing the tree from scratch.
+
+CHURN_OUTPUT_FILE = "./data/churn_results"
+CHURN_EVENTS = ("add_edge", "remove_edge", "add_node", "remove_node")
+
+
+@dataclass
+class ChurnEvent:
+    time: float
+    kind: str
+    # nodes asked for their peers, and nodes entering and leaving the tree
+    requeried: int
+    entered: int
+    exited: int
+    update_time: float
+
+
+def queried_distances(graph: rx.PyGraph, root: int) -> Dict[int, int]:
+    # _construct_tree asks every node within MAX_TREE_DEPTH - 1 hops of the
+    # root for its peers, whatever order the peers come in
+    distances = {root: 0}
+    frontier = [root]
+    for distance in range(1, MAX_TREE_DEPTH):
+        next_frontier = []
+        for vertex in frontier:
+            for peer in graph.neighbors(vertex):
+                if peer not in distances:
+                    distances[peer] = distance
+                    next_frontier.append(peer)
+        frontier = next_frontier
+    return distances
+
+
+class ChurnEngine:
+    def __init__(self, sim_node: SimulatedNode, seed: int = None):
+        self.sim_node = sim_node
+        self.graph = sim_node.graph
+        self.root = sim_node.to_vertex(sim_node.dht.own_id)
+        self.rng = random.Random(None if seed is None else seeding.derive_seed(seed, "churn"))
+        self.now = 0.0
+        self.distances = queried_distances(self.graph, self.root)
+        self.events: List[ChurnEvent] = []
+
+    # graph changes, each followed by an incremental update of the tree
+
+    def add_edge(self, u: int, v: int) -> ChurnEvent:
+        if u == v or self.graph.has_edge(u, v):
+            return self.update("add_edge", [])
+        self.graph.add_edge(u, v, None)
+        return self.update("add_edge", [u, v])
+
+    def remove_edge(self, u: int, v: int) -> ChurnEvent:
+        if not self.graph.has_edge(u, v):
+            return self.update("remove_edge", [])
+        self.graph.remove_edge(u, v)
+        return self.update("remove_edge", [u, v])
+
+    def add_node(self, peers: Iterable[int]) -> Tuple[int, ChurnEvent]:
+        vertex = self.graph.add_node(None)
+        # like the graph files, the payload of a vertex is its index
+        self.graph[vertex] = vertex
+        peers = set(peers) - {vertex}
+        for peer in peers:
+            self.graph.add_edge(vertex, peer, None)
+        return vertex, self.update("add_node", [vertex, *peers])
+
+    def remove_node(self, vertex: int) -> ChurnEvent:
+        if vertex == self.root:
+            raise ValueError("the root of the rated list can not leave")
+        peers = list(self.graph.neighbors(vertex))
+        self.graph.remove_node(vertex)
+        return self.update("remove_node", [vertex, *peers])
+
+    def update(self, kind: str, changed: Iterable[int]) -> ChurnEvent:
+        start_time = time.perf_counter()
+        sim_node = self.sim_node
+
+        old_distances = self.distances
+        distances = queried_distances(self.graph, self.root)
+        changed = set(changed)
+
+        # nodes that start being queried or whose peers changed are asked
+        # again closest first, so their parents are linked before them
+        requery = [v for v in distances if v in changed or v not in old_distances]
+        requery.sort(key=distances.get)
+        # nodes that are no longer queried drop their children, deepest first
+        dropped = [v for v in old_distances if v not in distances]
+        dropped.sort(key=old_distances.get, reverse=True)
+
+        requeried = len(requery) + len(dropped)
+        entered: Set = set()
+        exited: Set = set()
+        relinking = False
+
+        while requery or dropped:
+            before: Dict = {}
+            for vertex in requery:
+                key = sim_node.to_key(vertex)
+                self._remember_children(key, before)
+                if not relinking:
+                    for peer in self.graph.neighbors(vertex):
+                        peer_key = sim_node.to_key(peer)
+                        if not sim_node.in_tree(peer_key):
+                            entered.add(peer_key)
+                sim_node.get_peers(key)
+
+            for vertex in dropped:
+                key = sim_node.to_key(vertex)
+                if not sim_node.in_tree(key):
+                    # removed as a child already, its links are cleaned up below
+                    continue
+                self._remember_children(key, before)
+                sim_node.rl.on_get_peers_response(sim_node.dht, key, [])
+
+            removed = self._remove_unlinked(before)
+            exited.update(removed)
+
+            # a node does not link to peers that are its parents. Peers of a
+            # node that is no longer queried lost the link from it and link to
+            # it instead. A node that was asked before a closer peer can lose
+            # its last parent while still within reach, its closer peers are
+            # asked again to link it (then the node itself if it is queried).
+            requery = set()
+            for vertex in dropped:
+                if self.graph.has_node(vertex):
+                    requery.update(
+                        peer for peer in self.graph.neighbors(vertex) if peer in distances
+                    )
+            for key in removed:
+                vertex = sim_node.to_vertex(key)
+                if not self.graph.has_node(vertex):
+                    continue
+                distance = distances.get(vertex, MAX_TREE_DEPTH)
+                closer = [
+                    peer
+                    for peer in self.graph.neighbors(vertex)
+                    if distances.get(peer, MAX_TREE_DEPTH) < distance
+                ]
+                requery.update(closer)
+                if closer and vertex in distances:
+                    requery.add(vertex)
+            requery = sorted(requery, key=distances.get)
+            dropped = []
+            requeried += len(requery)
+            relinking = True
+
+        self.distances = distances
+        sim_node.tree_changed()
+        entered = [key for key in entered if sim_node.in_tree(key)]
+        exited = [key for key in exited if not sim_node.in_tree(key)]
+
+        event = ChurnEvent(
+            self.now,
+            kind,
+            requeried,
+            len(entered),
+            len(exited),
+            time.perf_counter() - start_time,
+        )
+        self.events.append(event)
+        return event
+
+    def _remember_children(self, key, before: Dict):
+        # children of a node and of each of its children before the update,
+        # a removed child may be deleted together with its links
+        if not self.sim_node.in_tree(key):
+            before.setdefault(key, None)
+            return
+        for node in [key, *self.sim_node.children(key)]:
+            if node not in before:
+                before[node] = (
+                    set(self.sim_node.children(node)) if self.sim_node.in_tree(node) else None
+                )
+
+    def _remove_unlinked(self, before: Dict) -> List:
+        # the spec deletes a node once it has no parents left, but keeps it as
+        # a parent of its own children. Those links are dropped here (and the
+        # nodes that end up without parents removed in turn), then the samples
+        # of every node that left the tree are removed from the sample mapping.
+        sim_node = self.sim_node
+        own_id = sim_node.dht.own_id
+        queue = deque(before)
+
+        while queue:
+            node = queue.popleft()
+            old_children = before[node]
+            if not old_children:
+                continue
+            current = set(sim_node.children(node)) if sim_node.in_tree(node) else set()
+
+            for child in old_children - current:
+                if not sim_node.in_tree(child):
+                    continue
+                sim_node.parents(child).discard(node)
+                if not sim_node.parents(child) and child != own_id:
+                    before[child] = (before.get(child) or set()) | set(sim_node.children(child))
+                    self._delete(child)
+                    queue.append(child)
+
+        exited = [
+            node
+            for node, old_children in before.items()
+            if old_children is not None and not sim_node.in_tree(node)
+        ]
+        for node in exited:
+            sim_node.rl.remove_samples_on_exit(sim_node.dht, node)
+        return exited
+
+    def _delete(self, key):
+        dht = self.sim_node.dht
+        if self.sim_node.backend == "indexed":
+            dht.present[key] = False
+            dht.children[key].clear()
+            dht.adjacency = None
+        else:
+            del dht.nodes[key]
+
+    def run(
+        self,
+        duration: float,
+        rate: float = 1.0,
+        weights: Tuple[float, ...] = (1.0, 1.0, 0.1, 0.1),
+        degree: int = None,
+        sink: ResultSink = None,
+    ) -> List[ChurnEvent]:
+        # poisson arrivals of random events over duration seconds of simulated
+        # time, joining nodes connect to degree random peers
+        degree = degree or max(1, round(2 * self.graph.num_edges() / self.graph.num_nodes()))
+        events = []
+        end = self.now + duration
+
+        while True:
+            self.now += self.rng.expovariate(rate)
+            if self.now > end:
+                self.now = end
+                break
+
+            kind = self.rng.choices(CHURN_EVENTS, weights)[0]
+            vertices = list(self.graph.node_indices())
+            if kind == "add_edge":
+                event = self.add_edge(*self.rng.sample(vertices, 2))
+            elif kind == "remove_edge":
+                u, v = self.graph.get_edge_endpoints_by_index(
+                    self.rng.choice(self.graph.edge_indices())
+                )
+                event = self.remove_edge(u, v)
+            elif kind == "add_node":
+                _, event = self.add_node(self.rng.sample(vertices, degree))
+            else:
+                vertex = self.rng.choice(vertices)
+                if vertex == self.root:
+                    continue
+                event = self.remove_node(vertex)
+
+            events.append(event)
+            if sink is not None:
+                sink.write(vars(event))
+
+        return events
+
+
+def tree_links(sim_node: SimulatedNode, directed: bool = True) -> Tuple[Set[int], Set]:
+    # the vertices and the (parent, child) links of the tree. Which side of a
+    # link between two queried nodes is the parent depends on which one was
+    # asked first, undirected links are the same for any order.
+    if sim_node.backend == "indexed":
+        keys = [i for i, present in enumerate(sim_node.dht.present) if present]
+    else:
+        keys = list(sim_node.dht.nodes)
+
+    vertices = set(sim_node.to_vertex(key) for key in keys)
+    links = set(
+        (sim_node.to_vertex(parent), sim_node.to_vertex(key))
+        for key in keys
+        for parent in sim_node.parents(key)
+    )
+    if not directed:
+        links = set(frozenset(link) for link in links)
+    return vertices, links
+
+
+def check_consistency(sim_node: SimulatedNode) -> List[str]:
+    # problems with the tree and the sample mapping, empty if consistent
+    problems = []
+    vertices, links = tree_links(sim_node)
+
+    for parent, child in links:
+        if parent not in vertices:
+            problems.append(f"{child} has parent {parent} which is not in the tree")
+        elif sim_node.to_key(child) not in sim_node.children(sim_node.to_key(parent)):
+            problems.append(f"{parent} is a parent of {child} but not the other way round")
+
+    mapping = {}
+    for sample, nodes in sim_node.dht.sample_mapping.items():
+        for node in nodes:
+            mapping.setdefault(sim_node.to_vertex(node), set()).add(int(sample))
+
+    for vertex in set(mapping) - vertices:
+        problems.append(f"{vertex} left the tree but still serves samples")
+    for vertex in vertices:
+        key = sim_node.to_key(vertex)
+        if sim_node.parents(key) and vertex not in mapping:
+            problems.append(f"{vertex} is in the tree but serves no samples")
+
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="incremental rated list maintenance under churn")
+    parser.add_argument("--duration", type=float, default=600.0, help="simulated seconds")
+    parser.add_argument("--rate", type=float, default=1.0, help="events per simulated second")
+    parser.add_argument("--backend", default="indexed", choices=["spec", "indexed"])
+    parser.add_argument("--nodes", type=int, default=NUM_NODES_RANDOM)
+    parser.add_argument("--degree", type=int, default=DEGREE)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verify", action="store_true", help="compare with a rebuilt tree at the end")
+    parser.add_argument("--output", default=CHURN_OUTPUT_FILE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(message)s")
+
+    graph = graph_init(args.nodes, args.degree).copy()
+
+    start_time = time.time()
+    sim_node = SimulatedNode(graph=graph, seed=args.seed, backend=args.backend)
+    build_time = time.time() - start_time
+
+    engine = ChurnEngine(sim_node, seed=args.seed)
+    with ResultSink(args.output) as sink:
+        events = engine.run(args.duration, args.rate, sink=sink)
+
+    update_times = np.array([event.update_time for event in events])
+    logging.info(f"constructing the tree took {build_time}s")
+    logging.info(
+        f"{len(events)} events, update mean={update_times.mean()}s "
+        f"p99={np.percentile(update_times, 99)}s max={update_times.max()}s"
+    )
+
+    problems = check_consistency(sim_node)
+    logging.info(f"consistency problems: {len(problems)}")
+    for problem in problems[:10]:
+        logging.info(problem)
+
+    if args.verify:
+        rebuilt = SimulatedNode(
+            graph=graph,
+            binding_vertex=engine.root,
+            seed=args.seed,
+            backend=args.backend,
+        )
+        matches = tree_links(sim_node, directed=False) == tree_links(rebuilt, directed=False)
+        logging.info(f"matches a rebuilt tree: {matches}")
+
+
+if __name__ == "__main__":
+    main()
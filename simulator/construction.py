@@ -0,0 +1,105 @@
+import argparse
+import logging
+import time
+from typing import Dict
+import rustworkx as rx
+
+from attack import SybilAttack
+from custody import CustodyTable
+from graphs import graph_init, NUM_NODES_RANDOM, DEGREE
+from node import Root
+from results import ResultSink
+from simulator import SimulatedNode
+from utils import int_to_bytes
+
+# Eager against lazy tree construction. The eager tree asks every node within
+# MAX_TREE_DEPTH - 1 hops for its peers before the first sample is queried,
+# the lazy tree only the root and expands further while query_samples lacks
+# candidates for a sample. Both are timed from the start of the construction.
+
+CONSTRUCTION_OUTPUT_FILE = "./data/construction_results"
+
+
+def compare_construction(
+    graph: rx.PyGraph,
+    construction: str,
+    rate: float = 0.3,
+    strategy: str = "high",
+    threshold: float = 0.9,
+    backend: str = "indexed",
+    min_candidates: int = 4,
+    custody: CustodyTable = None,
+    seed: int = 1,
+) -> Dict:
+    start_time = time.time()
+    sim_node = SimulatedNode(
+        graph=graph,
+        seed=seed,
+        backend=backend,
+        custody=custody,
+        construction=construction,
+        min_candidates=min_candidates,
+    )
+    construction_time = time.time() - start_time
+    tree_calls = sim_node.get_peers_calls
+
+    sim_node.load_attack(SybilAttack(graph=graph.copy(), sybil_rate=rate, seed=seed))
+    sim_node.run_info = {"rate": rate, "seed": seed}
+    report = sim_node.query_samples(Root(int_to_bytes(0)), strategy, threshold=threshold)
+
+    record = sim_node.metric_record(report)
+    record["construction"] = construction
+    record["construction_time"] = construction_time
+    record["time_to_first_sample"] = construction_time + report.get(
+        "first_sample_time", float("inf")
+    )
+    record["total_time"] = construction_time + report["wall_time"]
+    record["construction_get_peers"] = tree_calls
+    record["get_peers"] = sim_node.get_peers_calls
+    record["tree_nodes"] = sim_node.tree_size()
+    return record
+
+
+def main():
+    parser = argparse.ArgumentParser(description="eager against lazy tree construction")
+    parser.add_argument("--rate", type=float, default=0.3)
+    parser.add_argument("--threshold", type=float, default=0.9)
+    parser.add_argument("--strategy", default="high")
+    parser.add_argument("--backend", default="indexed", choices=["spec", "indexed"])
+    parser.add_argument("--min-candidates", type=int, default=4)
+    parser.add_argument("--nodes", type=int, default=NUM_NODES_RANDOM)
+    parser.add_argument("--degree", type=int, default=DEGREE)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default=CONSTRUCTION_OUTPUT_FILE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(message)s")
+
+    graph = graph_init(args.nodes, args.degree)
+    custody = CustodyTable.for_graph(graph) if args.backend == "indexed" else None
+
+    with ResultSink(args.output) as sink:
+        for construction in ("eager", "lazy"):
+            record = compare_construction(
+                graph,
+                construction,
+                rate=args.rate,
+                strategy=args.strategy,
+                threshold=args.threshold,
+                backend=args.backend,
+                min_candidates=args.min_candidates,
+                custody=custody,
+                seed=args.seed,
+            )
+            sink.write(record)
+            logging.info(
+                f"{construction}: construction={record['construction_time']:.3f}s "
+                f"first sample={record['time_to_first_sample']:.3f}s "
+                f"total={record['total_time']:.3f}s get_peers={record['get_peers']} "
+                f"tree nodes={record['tree_nodes']} samples={record['obtained_samples']} "
+                f"requests={record['requests']}"
+            )
+
+
+if __name__ == "__main__":
+    main()
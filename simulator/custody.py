@@ -0,0 +1,128 @@
+from typing import Sequence, List
+from hashlib import sha256
+import numpy as np
+
+from node import (
+    DATA_COLUMN_SIDECAR_SUBNET_COUNT,
+    NUMBER_OF_COLUMNS,
+    MIN_CUSTODY_COUNT,
+    NodeId,
+    get_custody_columns,
+)
+from utils import ENDIANNESS, int_to_bytes
+
+UINT256_MAX = 2**256 - 1
+
+
+def _next_id(current_id: int) -> int:
+    # same arithmetic as get_custody_columns: wrap to 0 at UINT256_MAX and
+    # then increment
+    if current_id == UINT256_MAX:
+        current_id = 0
+    return current_id + 1
+
+
+def _subnets(ids: Sequence[int]) -> np.ndarray:
+    # bytes_to_uint64(hash(uint_to_bytes(uint256(id)))[0:8]) % SUBNET_COUNT for
+    # many ids at once, without the ssz wrappers
+    digests = b"".join(
+        [sha256(id.to_bytes(32, ENDIANNESS)).digest()[0:8] for id in ids]
+    )
+    return np.frombuffer(digests, dtype="<u8") % np.uint64(
+        int(DATA_COLUMN_SIDECAR_SUBNET_COUNT)
+    )
+
+
+def compute_custody_columns(
+    node_ids: Sequence[int], custody_subnet_count: int = MIN_CUSTODY_COUNT
+) -> np.ndarray:
+    # get_custody_columns for a batch of (integer) node ids. Returns a
+    # (len(node_ids), custody_subnet_count * columns_per_subnet) array with
+    # the sorted columns of every node in its row.
+    custody_subnet_count = int(custody_subnet_count)
+    assert custody_subnet_count <= DATA_COLUMN_SIDECAR_SUBNET_COUNT
+
+    # candidate ids id, id + 1, ... of consecutive node ids overlap, so each
+    # distinct id is hashed once
+    candidates = []
+    for node_id in node_ids:
+        current_id = node_id
+        for _ in range(custody_subnet_count):
+            candidates.append(current_id)
+            current_id = _next_id(current_id)
+
+    unique_ids = list(dict.fromkeys(candidates))
+    position = {id: i for i, id in enumerate(unique_ids)}
+    subnet_of_id = _subnets(unique_ids)
+    subnet_ids = subnet_of_id[[position[id] for id in candidates]].reshape(
+        len(node_ids), custody_subnet_count
+    )
+    subnet_ids.sort(axis=1)
+
+    # rows with a repeated subnet need more candidates, resolve them one by
+    # one exactly like the spec loop does
+    repeated = np.flatnonzero((np.diff(subnet_ids, axis=1) == 0).any(axis=1))
+    for row in repeated.tolist():
+        subnet_ids[row] = _resolve_subnets(node_ids[row], custody_subnet_count)
+
+    columns_per_subnet = int(NUMBER_OF_COLUMNS) // int(DATA_COLUMN_SIDECAR_SUBNET_COUNT)
+    columns = np.concatenate(
+        [
+            int(DATA_COLUMN_SIDECAR_SUBNET_COUNT) * i + subnet_ids
+            for i in range(columns_per_subnet)
+        ],
+        axis=1,
+    )
+    columns.sort(axis=1)
+    return columns.astype(np.uint16)
+
+
+def _resolve_subnets(node_id: int, custody_subnet_count: int) -> List[int]:
+    subnet_ids: List[int] = []
+    current_id = node_id
+
+    while len(subnet_ids) < custody_subnet_count:
+        subnet_id = int(_subnets([current_id])[0])
+        if subnet_id not in subnet_ids:
+            subnet_ids.append(subnet_id)
+        current_id = _next_id(current_id)
+
+    return sorted(subnet_ids)
+
+
+class CustodyTable:
+    """
+    Custody columns of every vertex of a graph, computed once in a batch and
+    kept as a (num_nodes, columns) uint16 array indexed by vertex
+    """
+
+    def __init__(self, columns: np.ndarray, custody_subnet_count: int = MIN_CUSTODY_COUNT):
+        self.columns = columns
+        self.custody_subnet_count = custody_subnet_count
+
+    @classmethod
+    def for_vertices(cls, num_nodes: int, custody_subnet_count: int = MIN_CUSTODY_COUNT):
+        return cls(
+            compute_custody_columns(range(num_nodes), custody_subnet_count),
+            custody_subnet_count,
+        )
+
+    @classmethod
+    def for_graph(cls, graph, custody_subnet_count: int = MIN_CUSTODY_COUNT):
+        num_nodes = max(graph.node_indices(), default=-1) + 1
+        return cls.for_vertices(num_nodes, custody_subnet_count)
+
+    def __len__(self):
+        return len(self.columns)
+
+    def get(self, vertex: int) -> List[int]:
+        if vertex < len(self.columns):
+            return self.columns[vertex].tolist()
+
+        # vertices added after the table was built fall back to the spec
+        return [
+            int(id)
+            for id in get_custody_columns(
+                NodeId(int_to_bytes(vertex)), self.custody_subnet_count
+            )
+        ]
@@ -0,0 +1,368 @@
+import rustworkx as rx
+import numpy as np
+import logging
+import json
+import os
+import shutil
+from hashlib import sha256
+from typing import Iterable, Iterator, List, Tuple
+
+# TODO: change this to not be a global variable
+GRAPH_JSON_FILE = "./data/random_graph.json"
+GRAPH_CACHE_DIR = "./data/graphs"
+GRAPH_MAGIC = b"RLGRAPH1"
+NUM_NODES_RANDOM = 10000
+DEGREE = 50
+# graphs generated without a seed are still the same in every process
+DEFAULT_GRAPH_SEED = 0
+
+# mimics a rated list tree without any cycles.
+
+
+def construct_acyclic_graph(degree: int = 5) -> rx.PyGraph:
+    G = rx.PyGraph()
+
+    current_node_count = 1
+    G.add_node(0)
+
+    for i in range(degree):
+        G.add_node(current_node_count)
+        G.add_edge(0, current_node_count, None)
+        level_1 = current_node_count
+        current_node_count += 1
+
+        for i in range(degree):
+            G.add_node(current_node_count)
+            G.add_edge(level_1, current_node_count, None)
+            level_2 = current_node_count
+            current_node_count += 1
+
+            for i in range(degree):
+                G.add_node(current_node_count)
+                G.add_edge(level_2, current_node_count, None)
+                current_node_count += 1
+
+    return G
+
+
+def edge_array(graph: rx.PyGraph) -> np.ndarray:
+    # canonical (num_edges, 2) edge list, smaller endpoint first and sorted
+    edges = np.array(graph.edge_list(), dtype=np.int64).reshape(-1, 2)
+    edges.sort(axis=1)
+    return edges[np.lexsort((edges[:, 1], edges[:, 0]))]
+
+
+def average_degree(graph: rx.PyGraph) -> float:
+    # every edge adds to the degree of both of its ends
+    return 2 * graph.num_edges() / graph.num_nodes()
+
+
+def edge_tuples(edges: np.ndarray) -> List[Tuple[int, int]]:
+    # rustworkx only takes edges as python tuples. Viewed as one (u, v)
+    # record per row, numpy builds them straight from the (memory mapped)
+    # array without intermediate lists.
+    edges = np.ascontiguousarray(edges, dtype="<i8")
+    return edges.view([("u", "<i8"), ("v", "<i8")]).ravel().tolist()
+
+
+def graph_hash(graph: rx.PyGraph) -> str:
+    # content hash over the vertex count and the canonical edge list
+    # graphs loaded from the binary cache carry their hash, as long as no
+    # edges were added since (e.g. by a sybil attack)
+    header = graph.attrs
+    if (
+        isinstance(header, dict)
+        and "hash" in header
+        and header["num_nodes"] == graph.num_nodes()
+        and header["num_edges"] == graph.num_edges()
+    ):
+        return header["hash"]
+    return _content_hash(graph.num_nodes(), edge_array(graph))
+
+
+def _content_hash(num_nodes: int, edges: np.ndarray) -> str:
+    digest = sha256(num_nodes.to_bytes(8, "little"))
+    digest.update(np.ascontiguousarray(edges, dtype="<i8").tobytes())
+    return digest.hexdigest()
+
+
+def graph_cache_path(num_nodes: int, degree: int, seed: int = None, kind: str = "gnp") -> str:
+    return os.path.join(GRAPH_CACHE_DIR, f"{kind}_n{num_nodes}_d{degree}_s{seed}.rlg")
+
+
+def _write_header(file, header: dict):
+    # magic, header length and json header padded to 64 bytes
+    header_bytes = json.dumps(header).encode()
+    offset = len(GRAPH_MAGIC) + 8 + len(header_bytes)
+    header_bytes += b" " * (-offset % 64)
+
+    file.write(GRAPH_MAGIC)
+    file.write(len(header_bytes).to_bytes(8, "little"))
+    file.write(header_bytes)
+
+
+def save_graph(graph: rx.PyGraph, path: str, degree: int = None, seed: int = None):
+    # binary graph file: magic, header length, json header (generation
+    # parameters and content hash) padded to 64 bytes, raw int64 edge list
+    edges = edge_array(graph)
+    header = {
+        "num_nodes": graph.num_nodes(),
+        "num_edges": len(edges),
+        "degree": degree,
+        "seed": seed,
+        "hash": _content_hash(graph.num_nodes(), edges),
+    }
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    # write to a temporary file first so parallel runs never read half a graph
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as file:
+        _write_header(file, header)
+        file.write(edges.astype("<i8").tobytes())
+    os.replace(tmp_path, path)
+
+
+def save_edge_stream(
+    path: str,
+    num_nodes: int,
+    chunks: Iterable[np.ndarray],
+    degree: int = None,
+    seed: int = None,
+):
+    # save_graph for an edge list that arrives in canonical order, chunk by
+    # chunk, without ever holding all of it in memory. The edges go to a
+    # scratch file first since the header needs their count and hash.
+    digest = sha256(num_nodes.to_bytes(8, "little"))
+    num_edges = 0
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    edges_path = f"{path}.{os.getpid()}.edges.tmp"
+    with open(edges_path, "wb") as file:
+        for chunk in chunks:
+            data = np.ascontiguousarray(chunk, dtype="<i8").tobytes()
+            digest.update(data)
+            file.write(data)
+            num_edges += len(chunk)
+
+    header = {
+        "num_nodes": num_nodes,
+        "num_edges": num_edges,
+        "degree": degree,
+        "seed": seed,
+        "hash": digest.hexdigest(),
+    }
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as file, open(edges_path, "rb") as edges:
+        _write_header(file, header)
+        shutil.copyfileobj(edges, file, 1 << 24)
+    os.remove(edges_path)
+    os.replace(tmp_path, path)
+
+
+def stream_gnp_edges(
+    num_nodes: int, degree: int, seed: int = None, chunk_rows: int = 65536
+) -> Iterator[np.ndarray]:
+    # edges of a G(n, degree / n) graph in canonical order, a block of rows at
+    # a time. Row i draws its binomial number of neighbours above i; the rare
+    # repeated draws are dropped, so the graph is G(n, p) up to O(degree^2 / n)
+    # missing edges per node.
+    rng = np.random.default_rng(DEFAULT_GRAPH_SEED if seed is None else seed)
+    p = degree / num_nodes
+
+    for start in range(0, num_nodes, chunk_rows):
+        rows = np.arange(start, min(start + chunk_rows, num_nodes), dtype=np.int64)
+        above = num_nodes - 1 - rows
+        counts = rng.binomial(above, p)
+        sources = np.repeat(rows, counts)
+        targets = sources + 1 + (rng.random(len(sources)) * np.repeat(above, counts)).astype(np.int64)
+
+        keys = np.unique(sources * num_nodes + targets)
+        yield np.stack([keys // num_nodes, keys % num_nodes], axis=1)
+
+
+def load_edges(path: str, verify: bool = False):
+    # header and memory mapped edge list of a binary graph file
+    with open(path, "rb") as file:
+        if file.read(len(GRAPH_MAGIC)) != GRAPH_MAGIC:
+            raise ValueError(f"{path} is not a binary graph file")
+        header_length = int.from_bytes(file.read(8), "little")
+        header = json.loads(file.read(header_length))
+
+    edges = np.memmap(
+        path,
+        dtype="<i8",
+        mode="r",
+        offset=len(GRAPH_MAGIC) + 8 + header_length,
+        shape=(header["num_edges"], 2),
+    )
+
+    if verify and _content_hash(header["num_nodes"], edges) != header["hash"]:
+        raise ValueError(f"content hash mismatch for {path}")
+
+    return header, edges
+
+
+def load_graph(path: str, verify: bool = False) -> rx.PyGraph:
+    header, edges = load_edges(path, verify)
+
+    graph = rx.PyGraph(attrs=header)
+    # vertex payloads are the vertex indices, like de_node_data produces
+    graph.add_nodes_from(range(header["num_nodes"]))
+    graph.add_edges_from_no_data(edge_tuples(edges))
+    return graph
+
+
+class CSRGraph:
+    """
+    Read only graph over CSR adjacency arrays (int32 neighbour lists) with
+    the parts of the rustworkx PyGraph interface the simulator uses. Made
+    for graphs too large for a PyGraph; edges added afterwards (by an
+    attack) are kept in a small overlay.
+    """
+
+    def __init__(self, indptr: np.ndarray, indices: np.ndarray, attrs: dict = None):
+        self.indptr = indptr
+        self.indices = indices
+        self.attrs = attrs
+        self.extra: dict = {}
+        self.num_extra_edges = 0
+
+    @classmethod
+    def from_edges(cls, num_nodes: int, edges: np.ndarray, attrs: dict = None, chunk_size: int = 1 << 22):
+        # counting sort over (memory mapped) edges, one chunk at a time: the
+        # first pass counts the degrees, the second fills the neighbour lists
+        degrees = np.zeros(num_nodes, dtype=np.int64)
+        for start in range(0, len(edges), chunk_size):
+            chunk = np.asarray(edges[start : start + chunk_size])
+            degrees += np.bincount(chunk.ravel(), minlength=num_nodes)
+
+        indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+        np.cumsum(degrees, out=indptr[1:])
+        indices = np.empty(indptr[-1], dtype=np.int32)
+        fill = indptr[:-1].copy()
+
+        for start in range(0, len(edges), chunk_size):
+            chunk = np.asarray(edges[start : start + chunk_size])
+            sources = np.concatenate([chunk[:, 0], chunk[:, 1]])
+            targets = np.concatenate([chunk[:, 1], chunk[:, 0]])
+            order = np.argsort(sources, kind="stable")
+            sources = sources[order]
+            # position of every edge within the run of its source vertex
+            rank = np.arange(len(sources)) - np.searchsorted(sources, sources)
+            indices[fill[sources] + rank] = targets[order]
+            fill += np.bincount(sources, minlength=num_nodes)
+
+        return cls(indptr, indices, attrs)
+
+    def num_nodes(self) -> int:
+        return len(self.indptr) - 1
+
+    def num_edges(self) -> int:
+        return len(self.indices) // 2 + self.num_extra_edges
+
+    def node_indices(self) -> range:
+        return range(self.num_nodes())
+
+    def nodes(self) -> range:
+        # vertex payloads are the vertex indices
+        return range(self.num_nodes())
+
+    def __getitem__(self, vertex: int) -> int:
+        return vertex
+
+    def has_node(self, vertex: int) -> bool:
+        return 0 <= vertex < self.num_nodes()
+
+    def neighbors(self, vertex: int) -> List[int]:
+        peers = self.indices[self.indptr[vertex] : self.indptr[vertex + 1]].tolist()
+        return peers + self.extra[vertex] if vertex in self.extra else peers
+
+    def degree(self, vertex: int) -> int:
+        return int(self.indptr[vertex + 1] - self.indptr[vertex]) + len(self.extra.get(vertex, ()))
+
+    def has_edge(self, u: int, v: int) -> bool:
+        peers = self.indices[self.indptr[u] : self.indptr[u + 1]]
+        return bool((peers == v).any()) or v in self.extra.get(u, ())
+
+    def add_edge(self, u: int, v: int, data=None):
+        self.extra.setdefault(u, []).append(v)
+        self.extra.setdefault(v, []).append(u)
+        self.num_extra_edges += 1
+
+    def add_edges_from_no_data(self, edges: List):
+        for u, v in edges:
+            self.add_edge(u, v)
+
+    def edge_list(self) -> List:
+        sources = np.repeat(np.arange(self.num_nodes()), np.diff(self.indptr))
+        below = sources < self.indices
+        edges = list(zip(sources[below].tolist(), self.indices[below].tolist()))
+        edges += [(u, v) for u, peers in self.extra.items() for v in peers if u < v]
+        return edges
+
+    def copy(self) -> "CSRGraph":
+        # the arrays are shared, only the overlay is copied
+        graph = CSRGraph(self.indptr, self.indices, self.attrs)
+        graph.extra = {vertex: list(peers) for vertex, peers in self.extra.items()}
+        graph.num_extra_edges = self.num_extra_edges
+        return graph
+
+
+def load_csr_graph(path: str, verify: bool = False) -> CSRGraph:
+    header, edges = load_edges(path, verify)
+    return CSRGraph.from_edges(header["num_nodes"], edges, attrs=header)
+
+
+def large_graph_init(num_nodes: int, degree: int = DEGREE, seed: int = None) -> CSRGraph:
+    # G(n, p) graph of any size, generated straight to the binary cache and
+    # loaded as a CSRGraph
+    cache_path = graph_cache_path(num_nodes, degree, seed, kind="stream")
+
+    if not os.path.isfile(cache_path):
+        logging.info("graph not found streaming a new graph to disk")
+        save_edge_stream(
+            cache_path,
+            num_nodes,
+            stream_gnp_edges(num_nodes, degree, seed),
+            degree,
+            seed,
+        )
+
+    logging.info("loading graph from binary cache")
+    return load_csr_graph(cache_path)
+
+
+def graph_init(num_nodes: int = NUM_NODES_RANDOM, degree: int = DEGREE, seed: int = None):
+    cache_path = graph_cache_path(num_nodes, degree, seed)
+
+    if os.path.isfile(cache_path):
+        logging.info("loading graph from binary cache")
+        return load_graph(cache_path)
+
+    if (
+        seed is None
+        and (num_nodes, degree) == (NUM_NODES_RANDOM, DEGREE)
+        and os.path.isfile(GRAPH_JSON_FILE)
+    ):
+        # convert the old json graph once, later runs use the binary cache
+        logging.info("loading graph from json file")
+        graph = rx.from_node_link_json_file(GRAPH_JSON_FILE, node_attrs=de_node_data)
+    else:
+        logging.info("graph not found generating graph")
+        graph = rx.undirected_gnp_random_graph(
+            num_nodes, degree / num_nodes, seed=DEFAULT_GRAPH_SEED if seed is None else seed
+        )
+
+    save_graph(graph, cache_path, degree, seed)
+    return load_graph(cache_path)
+
+
+def de_node_data(data):
+    return int(data["value"])
+
+
+def ser_node_data(data):
+    mydict = {}
+    mydict["value"] = str(data)
+    return mydict
@@ -0,0 +1,742 @@
+from typing import Dict, Tuple, Set, Sequence, List, Optional, Union
+from dataclasses import dataclass, field
+import numpy as np
+
+from node import (
+    MAX_TREE_DEPTH,
+    NodeId,
+    SampleId,
+    Root,
+    get_custody_columns,
+)
+from utils import int_to_bytes
+from custody import CustodyTable
+import instrument
+
+# Array backed counterpart of the spec functions in node.py. Node ids are
+# interned to dense integer indices (by their integer value, which is the graph
+# vertex in the simulator) so lookups hash small ints instead of Bytes32 views.
+# The functions below mirror the spec functions one to one and take/return
+# dense indices wherever the spec takes/returns a NodeId.
+
+NodeIndex = int
+
+
+@dataclass
+class CSRAdjacency:
+    parent_indptr: np.ndarray
+    parent_indices: np.ndarray
+    child_indptr: np.ndarray
+    child_indices: np.ndarray
+
+    @classmethod
+    def from_sets(cls, parents: List[Set[NodeIndex]], children: List[Set[NodeIndex]]):
+        parent_indptr, parent_indices = _to_csr(parents)
+        child_indptr, child_indices = _to_csr(children)
+        return cls(parent_indptr, parent_indices, child_indptr, child_indices)
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.parent_indptr) - 1
+
+    def __post_init__(self):
+        # plain list views for the scalar walks, indexing numpy arrays element
+        # by element from python is slower than the set based spec
+        self._parent_ptr = self.parent_indptr.tolist()
+        self._parent_idx = self.parent_indices.tolist()
+        self._child_ptr = self.child_indptr.tolist()
+        self._child_idx = self.child_indices.tolist()
+        # ancestor closures only depend on the adjacency, so they live (and
+        # are invalidated) together with it
+        self.closures: Dict[NodeIndex, np.ndarray] = {}
+        self.ancestor_index: Optional["AncestorIndex"] = None
+
+    def parents(self, node: NodeIndex) -> List[NodeIndex]:
+        return self._parent_idx[self._parent_ptr[node] : self._parent_ptr[node + 1]]
+
+    def children(self, node: NodeIndex) -> List[NodeIndex]:
+        return self._child_idx[self._child_ptr[node] : self._child_ptr[node + 1]]
+
+
+def _to_csr(adjacency: List[Set[NodeIndex]]) -> Tuple[np.ndarray, np.ndarray]:
+    indptr = np.zeros(len(adjacency) + 1, dtype=np.int64)
+    np.cumsum([len(links) for links in adjacency], out=indptr[1:])
+
+    indices = np.empty(indptr[-1], dtype=np.int64)
+    for node, links in enumerate(adjacency):
+        indices[indptr[node] : indptr[node + 1]] = sorted(links)
+
+    return indptr, indices
+
+
+@dataclass
+class IndexedScoreKeeper:
+    descendants_contacted: Dict[NodeIndex, Set[Tuple[NodeIndex, SampleId]]]
+    descendants_replied: Dict[NodeIndex, Set[Tuple[NodeIndex, SampleId]]]
+
+
+@dataclass
+class CountingScoreKeeper:
+    # number of distinct (node, sample) pairs contacted/replied below each
+    # ancestor, indexed by dense node index. Deduplication happens once per
+    # pair in `requested`/`responded` instead of in a set per ancestor.
+    # version is bumped on every change, views derived from the keeper
+    # compare it to tell if they are stale.
+    descendants_contacted: np.ndarray
+    descendants_replied: np.ndarray
+    requested: Set[Tuple[NodeIndex, SampleId]]
+    responded: Set[Tuple[NodeIndex, SampleId]]
+    version: int = 0
+
+    @classmethod
+    def empty(cls, num_nodes: int):
+        return cls(
+            np.zeros(num_nodes, dtype=np.int64),
+            np.zeros(num_nodes, dtype=np.int64),
+            set(),
+            set(),
+        )
+
+    def ensure_size(self, num_nodes: int):
+        # nodes can be interned after the keeper was created
+        if len(self.descendants_contacted) < num_nodes:
+            grow = num_nodes - len(self.descendants_contacted)
+            self.descendants_contacted = np.concatenate(
+                (self.descendants_contacted, np.zeros(grow, dtype=np.int64))
+            )
+            self.descendants_replied = np.concatenate(
+                (self.descendants_replied, np.zeros(grow, dtype=np.int64))
+            )
+            self.version += 1
+
+
+SCORE_MODES = ("sets", "counts")
+
+
+@dataclass
+class ScoreCache:
+    # scores of every node for one block root. path_scores[k] is the best
+    # descendant score of a level 1 node reachable within k parent hops, so
+    # node_scores (the last row, with the own node at 1.0) equals
+    # compute_node_score for every node.
+    adjacency: CSRAdjacency
+    score_keeper: object
+    descendant_scores: np.ndarray
+    path_scores: np.ndarray
+    node_scores: np.ndarray
+    # ancestors whose descendant score changed since the last refresh
+    dirty: List[np.ndarray] = field(default_factory=list)
+
+
+@dataclass
+class IndexedRatedListData:
+    own_id: NodeIndex
+    node_ids: List[int]
+    index: Dict[int, NodeIndex]
+    children: List[Set[NodeIndex]]
+    parents: List[Set[NodeIndex]]
+    # equivalent of `node_id in rated_list_data.nodes` in the spec
+    present: List[bool]
+    sample_mapping: Dict[SampleId, Set[NodeIndex]]
+    scores: Dict[Root, Union[IndexedScoreKeeper, "CountingScoreKeeper"]]
+    adjacency: Optional[CSRAdjacency] = None
+    # "sets" keeps the spec's per ancestor sets, "counts" only keeps counters
+    score_mode: str = "sets"
+    score_caches: Dict[Root, ScoreCache] = field(default_factory=dict)
+    # precomputed custody columns by node id, get_custody_columns otherwise
+    custody: Optional[CustodyTable] = None
+
+    @classmethod
+    def for_root(cls, own_node_id: int, score_mode: str = "sets", custody: CustodyTable = None):
+        if score_mode not in SCORE_MODES:
+            raise ValueError(f"unknown score mode {score_mode}")
+
+        data = cls(0, [], {}, [], [], [], {}, {}, score_mode=score_mode, custody=custody)
+        data.own_id = data.intern(own_node_id)
+        data.present[data.own_id] = True
+        return data
+
+    def intern(self, node_id: int) -> NodeIndex:
+        idx = self.index.get(node_id)
+        if idx is None:
+            idx = len(self.node_ids)
+            self.index[node_id] = idx
+            self.node_ids.append(node_id)
+            self.children.append(set())
+            self.parents.append(set())
+            self.present.append(False)
+            self.adjacency = None
+        return idx
+
+    def to_node_id(self, node: NodeIndex) -> NodeId:
+        return NodeId(int_to_bytes(self.node_ids[node]))
+
+    def custody_columns(self, node: NodeIndex) -> List[int]:
+        if self.custody is not None:
+            return self.custody.get(self.node_ids[node])
+        return [int(id) for id in get_custody_columns(self.to_node_id(node))]
+
+    def freeze(self) -> CSRAdjacency:
+        # the sets stay authoritative while the tree is mutated, the CSR
+        # arrays are rebuilt lazily the first time they are read afterwards
+        if self.adjacency is None:
+            self.adjacency = CSRAdjacency.from_sets(self.parents, self.children)
+        return self.adjacency
+
+    def new_score_keeper(self):
+        if self.score_mode == "counts":
+            return CountingScoreKeeper.empty(len(self.node_ids))
+        return IndexedScoreKeeper({}, {})
+
+
+def compute_descendant_score(rated_list_data: IndexedRatedListData,
+                             block_root: Root,
+                             node_id: NodeIndex) -> float:
+    if block_root not in rated_list_data.scores:
+        return 1.0
+
+    score_keeper = rated_list_data.scores[block_root]
+
+    if isinstance(score_keeper, CountingScoreKeeper):
+        if node_id >= len(score_keeper.descendants_contacted):
+            return 1.0
+
+        contacted = int(score_keeper.descendants_contacted[node_id])
+        if contacted == 0:
+            return 1.0
+
+        replied = int(score_keeper.descendants_replied[node_id])
+        if replied == 0:
+            return 0
+
+        return replied / contacted
+
+    if node_id not in score_keeper.descendants_contacted:
+        return 1.0
+
+    if node_id not in score_keeper.descendants_replied:
+        return 0
+
+    return len(score_keeper.descendants_replied[node_id]) / len(score_keeper.descendants_contacted[node_id]) if len(score_keeper.descendants_contacted[node_id]) > 0 else 0
+
+
+def compute_node_score(rated_list_data: IndexedRatedListData,
+                       block_root: Root,
+                       node_id: NodeIndex) -> float:
+    if node_id == rated_list_data.own_id:
+        return 1.0
+
+    own_id = rated_list_data.own_id
+    adjacency = rated_list_data.freeze()
+    score = compute_descendant_score(rated_list_data, block_root, node_id)
+
+    cur_path_scores: Dict[NodeIndex, float] = {node_id: score}
+    touched_nodes = set()
+
+    best_score = 0.0
+
+    depth = 1
+    while cur_path_scores and depth <= MAX_TREE_DEPTH:
+        new_path_scores: Dict[NodeIndex, float] = {}
+        for node, score in cur_path_scores.items():
+            touched_nodes.add(node)
+            for parent in adjacency.parents(node):
+                if parent == own_id:
+                    best_score = max(best_score, score)
+                else:
+                    par_score = compute_descendant_score(rated_list_data, block_root, parent)
+                    if (
+                        parent not in new_path_scores
+                        or new_path_scores[parent] < par_score
+                    ) and parent not in touched_nodes:
+                        new_path_scores[parent] = par_score
+        depth += 1
+        cur_path_scores = new_path_scores
+
+    return best_score
+
+
+def _max_over_parents(adjacency: CSRAdjacency, values: np.ndarray) -> np.ndarray:
+    best = np.zeros(adjacency.num_nodes)
+    rows = np.flatnonzero(np.diff(adjacency.parent_indptr))
+    if len(rows) > 0:
+        best[rows] = np.maximum.reduceat(
+            values[adjacency.parent_indices], adjacency.parent_indptr[rows]
+        )
+    return best
+
+
+def _descendant_scores(rated_list_data: IndexedRatedListData,
+                       block_root: Root,
+                       nodes: np.ndarray) -> np.ndarray:
+    score_keeper = rated_list_data.scores.get(block_root)
+    if score_keeper is None:
+        return np.ones(len(nodes))
+
+    if isinstance(score_keeper, CountingScoreKeeper):
+        score_keeper.ensure_size(len(rated_list_data.node_ids))
+        contacted = score_keeper.descendants_contacted[nodes]
+        replied = score_keeper.descendants_replied[nodes]
+        return np.divide(replied, contacted, out=np.ones(len(nodes)), where=contacted > 0)
+
+    return np.array(
+        [compute_descendant_score(rated_list_data, block_root, node) for node in nodes.tolist()],
+        dtype=np.float64,
+    )
+
+
+def _propagate_path_scores(rated_list_data: IndexedRatedListData, cache: ScoreCache):
+    # one top down pass per tree level: a node's best path is either its own
+    # score (if it is a child of the own node) or the best path of a parent.
+    # Paths never continue through the own node, like in compute_node_score.
+    adjacency = cache.adjacency
+    own_id = rated_list_data.own_id
+
+    level_1 = adjacency.child_indices[adjacency.child_indptr[own_id] : adjacency.child_indptr[own_id + 1]]
+    cache.path_scores[0] = 0.0
+    cache.path_scores[0][level_1] = cache.descendant_scores[level_1]
+    cache.path_scores[0][own_id] = 0.0
+
+    for depth in range(1, MAX_TREE_DEPTH):
+        np.maximum(
+            cache.path_scores[0],
+            _max_over_parents(adjacency, cache.path_scores[depth - 1]),
+            out=cache.path_scores[depth],
+        )
+        cache.path_scores[depth][own_id] = 0.0
+
+    cache.node_scores = cache.path_scores[MAX_TREE_DEPTH - 1].copy()
+    cache.node_scores[own_id] = 1.0
+
+
+def compute_node_scores(rated_list_data: IndexedRatedListData, block_root: Root) -> np.ndarray:
+    # batched compute_node_score for all nodes, cached per block root. Only the
+    # descendant scores of ancestors touched by score updates are recomputed.
+    adjacency = rated_list_data.freeze()
+    score_keeper = rated_list_data.scores.get(block_root)
+    cache = rated_list_data.score_caches.get(block_root)
+
+    if (
+        cache is None
+        or cache.adjacency is not adjacency
+        or cache.score_keeper is not score_keeper
+    ):
+        num_nodes = adjacency.num_nodes
+        cache = ScoreCache(
+            adjacency,
+            score_keeper,
+            _descendant_scores(rated_list_data, block_root, np.arange(num_nodes)),
+            np.zeros((MAX_TREE_DEPTH, num_nodes)),
+            np.zeros(num_nodes),
+        )
+        rated_list_data.score_caches[block_root] = cache
+        _propagate_path_scores(rated_list_data, cache)
+        instrument.count("score_cache_rebuilds")
+        instrument.count("score_computations", num_nodes)
+    elif cache.dirty:
+        dirty = np.unique(np.concatenate(cache.dirty))
+        cache.dirty = []
+        cache.descendant_scores[dirty] = _descendant_scores(rated_list_data, block_root, dirty)
+        _propagate_path_scores(rated_list_data, cache)
+        instrument.count("score_cache_updates")
+        instrument.count("score_computations", len(dirty))
+    else:
+        instrument.count("score_cache_hits")
+
+    return cache.node_scores
+
+
+def _invalidate_scores(rated_list_data: IndexedRatedListData, block_root: Root, ancestors: np.ndarray):
+    cache = rated_list_data.score_caches.get(block_root)
+    if cache is not None:
+        cache.dirty.append(ancestors)
+
+
+def on_get_peers_response(rated_list_data: IndexedRatedListData, node_id: NodeIndex, peers: Sequence[NodeIndex]):
+    parents = rated_list_data.parents
+    children = rated_list_data.children
+    present = rated_list_data.present
+
+    rated_list_data.adjacency = None
+    present[node_id] = True
+
+    for peer_id in peers:
+        present[peer_id] = True
+
+        if peer_id in parents[node_id]:
+            continue
+
+        parents[peer_id].add(node_id)
+        children[node_id].add(peer_id)
+
+    peer_set = set(peers)
+    remove_children = [child_id for child_id in children[node_id] if child_id not in peer_set]
+
+    for child_id in remove_children:
+        children[node_id].remove(child_id)
+        parents[child_id].remove(node_id)
+
+        if len(parents[child_id]) == 0:
+            # the spec deletes the record outright, here the links of the
+            # removed child are dropped as well so the adjacency stays symmetric
+            present[child_id] = False
+            for grand_child in children[child_id]:
+                parents[grand_child].discard(child_id)
+            children[child_id].clear()
+
+
+def _ancestor_walk(rated_list_data: IndexedRatedListData, node_id: NodeIndex) -> Set[NodeIndex]:
+    instrument.count("ancestor_walks")
+    adjacency = rated_list_data.freeze()
+    cur_ancestors = set(adjacency.parents(node_id))
+    touched_nodes = set()
+
+    while cur_ancestors:
+        new_ancestors = set()
+        for ancestor in cur_ancestors:
+            if ancestor in touched_nodes:
+                continue
+
+            touched_nodes.add(ancestor)
+            new_ancestors.update(adjacency.parents(ancestor))
+        cur_ancestors = new_ancestors
+
+    return touched_nodes
+
+
+def ancestor_closure(rated_list_data: IndexedRatedListData, node_id: NodeIndex) -> np.ndarray:
+    # every node the spec's score update walks visit for node_id, computed
+    # once per node for the lifetime of the current adjacency
+    adjacency = rated_list_data.freeze()
+    closure = adjacency.closures.get(node_id)
+    if closure is None:
+        closure = np.fromiter(_ancestor_walk(rated_list_data, node_id), dtype=np.int64)
+        closure.sort()
+        adjacency.closures[node_id] = closure
+    else:
+        instrument.count("closure_cache_hits")
+    return closure
+
+
+# bound on the bools of one batch of breadth first closures
+CLOSURE_BATCH_CELLS = 1 << 26
+
+
+def _ancestor_visits(adjacency: CSRAdjacency, nodes: np.ndarray) -> np.ndarray:
+    # breadth first ancestor closures of several nodes at once, row i of the
+    # result marks the ancestors of nodes[i]. Every round extends the newest
+    # (node, ancestor) pairs by the parents of their ancestor.
+    num_nodes = adjacency.num_nodes
+    counts = np.diff(adjacency.parent_indptr)
+    visited = np.zeros((len(nodes), num_nodes), dtype=bool)
+    sources, ancestors = np.arange(len(nodes)), np.asarray(nodes, dtype=np.int64)
+
+    while len(sources) > 0:
+        parent_counts = counts[ancestors]
+        offsets = np.arange(parent_counts.sum()) - np.repeat(
+            np.cumsum(parent_counts) - parent_counts, parent_counts
+        )
+        parents = adjacency.parent_indices[
+            np.repeat(adjacency.parent_indptr[ancestors], parent_counts) + offsets
+        ]
+        sources = np.repeat(sources, parent_counts)
+        new = ~visited[sources, parents]
+        sources, ancestors = sources[new], parents[new]
+        # a pair can be reached twice within the same round
+        visited[sources, ancestors] = True
+
+        keys = np.unique(sources * num_nodes + ancestors)
+        sources, ancestors = np.divmod(keys, num_nodes)
+
+    return visited
+
+
+@dataclass
+class AncestorIndex:
+    """
+    Ancestor bitsets of every node of a tree. Bit a of row n is set if a is
+    in the ancestor closure of n (as walked by the score updates), so
+    ancestor queries are a single bit lookup and the subtrees below any set
+    of nodes are one column gather. Takes num_nodes^2 / 8 bytes.
+    """
+
+    bits: np.ndarray
+
+    @classmethod
+    def from_adjacency(cls, adjacency: CSRAdjacency):
+        num_nodes = adjacency.num_nodes
+        bits = np.zeros((num_nodes, (num_nodes + 7) // 8), dtype=np.uint8)
+        batch = max(1, CLOSURE_BATCH_CELLS // max(1, num_nodes))
+        for start in range(0, num_nodes, batch):
+            nodes = np.arange(start, min(start + batch, num_nodes))
+            bits[nodes] = np.packbits(_ancestor_visits(adjacency, nodes), axis=1, bitorder="little")
+        return cls(bits)
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.bits)
+
+    def is_ancestor(self, node: NodeIndex, ancestor: NodeIndex) -> bool:
+        return bool((self.bits[node, ancestor >> 3] >> (ancestor & 7)) & 1)
+
+    def ancestors(self, node: NodeIndex) -> np.ndarray:
+        row = np.unpackbits(self.bits[node], count=self.num_nodes, bitorder="little")
+        return np.flatnonzero(row)
+
+    def subtree_mask(self, roots: Sequence[NodeIndex]) -> np.ndarray:
+        # the given nodes and all of their descendants
+        roots = np.asarray(roots, dtype=np.int64)
+        mask = np.zeros(self.num_nodes, dtype=bool)
+        if len(roots) > 0:
+            columns = (self.bits[:, roots >> 3] >> (roots & 7).astype(np.uint8)) & 1
+            mask = columns.any(axis=1)
+            mask[roots] = True
+        return mask
+
+
+def ancestor_index(rated_list_data: IndexedRatedListData) -> AncestorIndex:
+    # built on first use and kept with the adjacency, like ancestor_closure
+    adjacency = rated_list_data.freeze()
+    if adjacency.ancestor_index is None:
+        adjacency.ancestor_index = AncestorIndex.from_adjacency(adjacency)
+    return adjacency.ancestor_index
+
+
+def on_request_score_update(rated_list_data: IndexedRatedListData,
+                            block_root: Root,
+                            node_id: NodeIndex,
+                            sample_id: SampleId):
+    if block_root not in rated_list_data.scores:
+        rated_list_data.scores[block_root] = rated_list_data.new_score_keeper()
+
+    score_keeper = rated_list_data.scores[block_root]
+    request = (node_id, sample_id)
+    ancestors = ancestor_closure(rated_list_data, node_id)
+
+    if isinstance(score_keeper, CountingScoreKeeper):
+        if request in score_keeper.requested:
+            return
+
+        score_keeper.requested.add(request)
+        score_keeper.ensure_size(len(rated_list_data.node_ids))
+        score_keeper.descendants_contacted[ancestors] += 1
+        score_keeper.version += 1
+        _invalidate_scores(rated_list_data, block_root, ancestors)
+        return
+
+    contacted = score_keeper.descendants_contacted
+    _invalidate_scores(rated_list_data, block_root, ancestors)
+
+    for ancestor in ancestors.tolist():
+        if ancestor not in contacted:
+            contacted[ancestor] = set()
+
+        contacted[ancestor].add(request)
+
+
+def on_response_score_update(rated_list_data: IndexedRatedListData,
+                             block_root: Root,
+                             node_id: NodeIndex,
+                             sample_id: SampleId):
+    score_keeper = rated_list_data.scores[block_root]
+    response = (node_id, sample_id)
+    ancestors = ancestor_closure(rated_list_data, node_id)
+
+    if isinstance(score_keeper, CountingScoreKeeper):
+        if response in score_keeper.responded:
+            return
+
+        score_keeper.responded.add(response)
+        score_keeper.ensure_size(len(rated_list_data.node_ids))
+        score_keeper.descendants_replied[ancestors] += 1
+        score_keeper.version += 1
+        _invalidate_scores(rated_list_data, block_root, ancestors)
+        return
+
+    replied = score_keeper.descendants_replied
+    _invalidate_scores(rated_list_data, block_root, ancestors)
+
+    for ancestor in ancestors.tolist():
+        if ancestor not in replied:
+            replied[ancestor] = set()
+
+        replied[ancestor].add(response)
+
+
+def _bulk_score_update(rated_list_data: IndexedRatedListData,
+                       block_root: Root,
+                       node_ids: Sequence[NodeIndex],
+                       sample_ids: Sequence[SampleId],
+                       replied: bool):
+    score_keeper = rated_list_data.scores[block_root]
+    seen = score_keeper.responded if replied else score_keeper.requested
+
+    closures = []
+    for pair in zip(node_ids, sample_ids):
+        if pair in seen:
+            continue
+        seen.add(pair)
+        closures.append(ancestor_closure(rated_list_data, pair[0]))
+
+    if closures:
+        # ensure_size may replace the counter arrays
+        score_keeper.ensure_size(len(rated_list_data.node_ids))
+        counts = score_keeper.descendants_replied if replied else score_keeper.descendants_contacted
+        ancestors = np.concatenate(closures)
+        counts += np.bincount(ancestors, minlength=len(counts))
+        score_keeper.version += 1
+        _invalidate_scores(rated_list_data, block_root, ancestors)
+
+
+def on_request_score_updates(rated_list_data: IndexedRatedListData,
+                             block_root: Root,
+                             node_ids: Sequence[NodeIndex],
+                             sample_ids: Sequence[SampleId]):
+    # on_request_score_update for a batch of requests, the counters of all
+    # requests are applied in a single scatter add
+    if block_root not in rated_list_data.scores:
+        rated_list_data.scores[block_root] = rated_list_data.new_score_keeper()
+
+    if not isinstance(rated_list_data.scores[block_root], CountingScoreKeeper):
+        for node_id, sample_id in zip(node_ids, sample_ids):
+            on_request_score_update(rated_list_data, block_root, node_id, sample_id)
+        return
+
+    _bulk_score_update(rated_list_data, block_root, node_ids, sample_ids, replied=False)
+
+
+def on_response_score_updates(rated_list_data: IndexedRatedListData,
+                              block_root: Root,
+                              node_ids: Sequence[NodeIndex],
+                              sample_ids: Sequence[SampleId]):
+    if not isinstance(rated_list_data.scores[block_root], CountingScoreKeeper):
+        for node_id, sample_id in zip(node_ids, sample_ids):
+            on_response_score_update(rated_list_data, block_root, node_id, sample_id)
+        return
+
+    _bulk_score_update(rated_list_data, block_root, node_ids, sample_ids, replied=True)
+
+
+def add_samples_on_entry(rated_list_data: IndexedRatedListData, node_id: NodeIndex):
+    sample_ids = rated_list_data.custody_columns(node_id)
+    for id in sample_ids:
+        if id not in rated_list_data.sample_mapping:
+            rated_list_data.sample_mapping[id] = set()
+
+        rated_list_data.sample_mapping[id].add(node_id)
+
+
+def remove_samples_on_exit(rated_list_data: IndexedRatedListData, node_id: NodeIndex):
+    sample_ids = rated_list_data.custody_columns(node_id)
+
+    for id in sample_ids:
+        if id not in rated_list_data.sample_mapping:
+            continue
+
+        rated_list_data.sample_mapping[id].remove(node_id)
+
+
+def filter_nodes(rated_list_data: IndexedRatedListData, block_root: Root, sample_id: SampleId, threshold: float = 0.9) -> Set[Tuple[NodeIndex, float]]:
+    node_scores = compute_node_scores(rated_list_data, block_root).tolist()
+    adjacency = rated_list_data.freeze()
+    scores = {}
+    filter_score = threshold
+    filtered_nodes = set()
+
+    for i in range(2):
+        evicted_nodes = set()
+        for node_id in rated_list_data.sample_mapping[sample_id]:
+            if node_id not in scores:
+                scores[node_id] = node_scores[node_id]
+
+            if scores[node_id] >= filter_score and node_id not in evicted_nodes:
+                filtered_nodes.add((node_id, scores[node_id]))
+            else:
+                evicted_nodes.add(node_id)
+                evicted_nodes.update(adjacency.children(node_id))
+
+        if len(filtered_nodes) > 0:
+            break
+
+        filter_score = (
+            sum([score for _, score in scores.items()]) / len(scores) - 0.1
+        )
+    return filtered_nodes
+
+
+def _column_evictions(entries: np.ndarray, parent_entries: np.ndarray, child_entries: np.ndarray,
+                      low: np.ndarray) -> np.ndarray:
+    # an entry is evicted if its score is too low or if a parent in the same
+    # column was evicted earlier in the iteration order. Eviction travels at
+    # most one tree level per round.
+    evicted = low.copy()
+    while True:
+        inherited = np.zeros(len(entries), dtype=bool)
+        inherited[child_entries[evicted[parent_entries]]] = True
+        updated = evicted | inherited
+        if np.array_equal(updated, evicted):
+            return evicted
+        evicted = updated
+
+
+def filter_columns(rated_list_data: IndexedRatedListData,
+                   block_root: Root,
+                   sample_ids: Sequence[SampleId],
+                   threshold: float = 0.9) -> Dict[SampleId, Set[Tuple[NodeIndex, float]]]:
+    # filter_nodes for many samples in one vectorized pass over the flattened
+    # (column, node) entries of the sample mapping. Each column keeps the set
+    # iteration order of filter_nodes, so a child is only evicted along with
+    # a parent the loop visits before it, and the results are identical.
+    node_scores = compute_node_scores(rated_list_data, block_root)
+    adjacency = rated_list_data.freeze()
+    num_nodes = adjacency.num_nodes
+
+    columns = [sample for sample in sample_ids if rated_list_data.sample_mapping.get(sample)]
+    filtered = {sample: set() for sample in sample_ids if sample in rated_list_data.sample_mapping}
+    if not columns:
+        return filtered
+
+    members = [np.fromiter(rated_list_data.sample_mapping[sample], dtype=np.int64) for sample in columns]
+    sizes = np.array([len(nodes) for nodes in members])
+    column = np.repeat(np.arange(len(columns)), sizes)
+    nodes = np.concatenate(members)
+    position = np.arange(len(nodes)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    scores = node_scores[nodes]
+
+    # (parent entry, child entry) pairs of tree links within a column where
+    # the parent comes first
+    counts = np.diff(adjacency.parent_indptr)[nodes]
+    child_entries = np.repeat(np.arange(len(nodes)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    parents = adjacency.parent_indices[np.repeat(adjacency.parent_indptr[nodes], counts) + offsets]
+
+    keys = column * num_nodes + nodes
+    order = np.argsort(keys)
+    parent_keys = column[child_entries] * num_nodes + parents
+    found = np.minimum(np.searchsorted(keys, parent_keys, sorter=order), len(keys) - 1)
+    parent_entries = order[found]
+    linked = (keys[parent_entries] == parent_keys) & (position[parent_entries] < position[child_entries])
+    parent_entries = parent_entries[linked]
+    child_entries = child_entries[linked]
+
+    evicted = _column_evictions(nodes, parent_entries, child_entries, scores < threshold)
+    kept = ~evicted
+
+    # columns without any filtered node are filtered again with their mean
+    # score lowered by 0.1, like the second round of filter_nodes
+    kept_per_column = np.bincount(column, weights=kept, minlength=len(columns))
+    retry = kept_per_column == 0
+    if retry.any():
+        # summed in iteration order, like filter_nodes
+        starts = np.cumsum(sizes) - sizes
+        score_list = scores.tolist()
+        means = np.zeros(len(columns))
+        for c in np.flatnonzero(retry).tolist():
+            means[c] = sum(score_list[starts[c] : starts[c] + sizes[c]]) / sizes[c]
+        retried = _column_evictions(nodes, parent_entries, child_entries, scores < (means - 0.1)[column])
+        kept = np.where(retry[column], ~retried, kept)
+
+    column_list, node_list, score_list = column.tolist(), nodes.tolist(), scores.tolist()
+    for entry in np.flatnonzero(kept).tolist():
+        filtered[columns[column_list[entry]]].add((node_list[entry], score_list[entry]))
+    return filtered
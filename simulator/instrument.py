@@ -0,0 +1,212 @@
+import argparse
+import contextlib
+import functools
+import json
+import time
+from collections import Counter
+from typing import Dict, List, Sequence, Tuple
+
+# Opt-in instrumentation: named counters and nested wall clock phases. While
+# no profile is active count() and phase() do nothing, so the hot paths only
+# pay for a global lookup. Profiles are written as json or as collapsed
+# stacks ("phase;sub phase <microseconds>") for flame graph tools.
+
+_active: "Profile" = None
+_no_phase = contextlib.nullcontext()
+_wrapped: List[Tuple[object, str, object]] = []
+
+# spec functions timed as phases while profiling, and the counters each call
+# of the generated spec functions adds to
+SPEC_FUNCTIONS = (
+    "on_get_peers_response",
+    "add_samples_on_entry",
+    "remove_samples_on_exit",
+    "on_request_score_update",
+    "on_response_score_update",
+    "compute_descendant_score",
+    "compute_node_score",
+    "compute_node_scores",
+    "filter_nodes",
+    "get_custody_columns",
+)
+SPEC_COUNTERS = {
+    # every score update of the spec walks all ancestors of the node
+    "on_request_score_update": "ancestor_walks",
+    "on_response_score_update": "ancestor_walks",
+    "compute_node_score": "score_computations",
+    "compute_descendant_score": "descendant_score_computations",
+}
+
+
+class Profile:
+    def __init__(self):
+        self.counters: Counter = Counter()
+        # per stack of phase names, total seconds and number of entries
+        self.seconds: Counter = Counter()
+        self.calls: Counter = Counter()
+        self._stack: List[str] = []
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] += n
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        self._stack.append(name)
+        stack = tuple(self._stack)
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[stack] += time.perf_counter() - start_time
+            self.calls[stack] += 1
+            self._stack.pop()
+
+    def merge(self, other: "Profile"):
+        self.counters.update(other.counters)
+        self.seconds.update(other.seconds)
+        self.calls.update(other.calls)
+
+    def take(self) -> "Profile":
+        # everything recorded so far, the profile starts over afterwards
+        taken = Profile()
+        taken.merge(self)
+        self.counters.clear()
+        self.seconds.clear()
+        self.calls.clear()
+        return taken
+
+    def self_seconds(self) -> Dict[Tuple[str, ...], float]:
+        # time spent in a phase outside of its sub phases
+        own = dict(self.seconds)
+        for stack, seconds in self.seconds.items():
+            if len(stack) > 1 and stack[:-1] in own:
+                own[stack[:-1]] -= seconds
+        return own
+
+    def to_json(self) -> Dict:
+        return {
+            "counters": dict(self.counters),
+            "phases": {
+                ";".join(stack): {"seconds": seconds, "calls": self.calls[stack]}
+                for stack, seconds in sorted(self.seconds.items())
+            },
+        }
+
+    @classmethod
+    def from_json(cls, data: Dict) -> "Profile":
+        profile = cls()
+        profile.counters.update(data["counters"])
+        for stack, phase in data["phases"].items():
+            profile.seconds[tuple(stack.split(";"))] = phase["seconds"]
+            profile.calls[tuple(stack.split(";"))] = phase["calls"]
+        return profile
+
+    def collapsed(self) -> List[str]:
+        return [
+            f"{';'.join(stack)} {max(0, round(seconds * 1e6))}"
+            for stack, seconds in sorted(self.self_seconds().items())
+        ]
+
+    def dump(self, path: str):
+        # json for .json paths, collapsed stacks otherwise
+        with open(path, "w") as file:
+            if path.endswith(".json"):
+                json.dump(self.to_json(), file, indent=2)
+            else:
+                file.write("\n".join(self.collapsed()) + "\n")
+
+    def summary(self, top: int = 20) -> List[str]:
+        lines = [f"{name}: {value}" for name, value in sorted(self.counters.items())]
+        phases = sorted(self.seconds.items(), key=lambda item: item[1], reverse=True)
+        for stack, seconds in phases[:top]:
+            lines.append(f"{';'.join(stack)}: {seconds:.6f}s in {self.calls[stack]} calls")
+        return lines
+
+
+def active() -> Profile:
+    return _active
+
+
+def count(name: str, n: int = 1):
+    if _active is not None:
+        _active.counters[name] += n
+
+
+def phase(name: str):
+    if _active is None:
+        return _no_phase
+    return _active.phase(name)
+
+
+def timed(name: str, counter: str = None):
+    # decorator timing every call of a function as a phase while profiling
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _active is None:
+                return function(*args, **kwargs)
+            if counter is not None:
+                _active.counters[counter] += 1
+            with _active.phase(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def enable(modules: Sequence = ()) -> Profile:
+    # starts profiling (or returns the running profile) and times the spec
+    # functions of the given rated list modules. node.py is generated from
+    # the spec, so its functions are wrapped instead of edited; calls between
+    # spec functions go through the module globals and are wrapped as well.
+    global _active
+    if _active is None:
+        _active = Profile()
+
+    wrapped_modules = set(id(module) for module, _, _ in _wrapped)
+    for module in modules:
+        if id(module) in wrapped_modules:
+            continue
+        # only the generated spec counts its ancestor walks per call, the
+        # indexed backend counts actual walks itself
+        counters = SPEC_COUNTERS if module.__name__ == "node" else {}
+        for name in SPEC_FUNCTIONS:
+            function = getattr(module, name, None)
+            if function is None:
+                continue
+            _wrapped.append((module, name, function))
+            setattr(module, name, timed(name, counters.get(name))(function))
+
+    return _active
+
+
+def disable() -> Profile:
+    # stops profiling, restores the spec functions and returns the profile
+    global _active
+    profile, _active = _active, None
+    while _wrapped:
+        module, name, function = _wrapped.pop()
+        setattr(module, name, function)
+    return profile
+
+
+def main():
+    parser = argparse.ArgumentParser(description="summarise or convert a json profile")
+    parser.add_argument("profile", help="json profile written by --profile")
+    parser.add_argument("--collapsed", default=None, help="also write collapsed stacks here")
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+
+    with open(args.profile) as file:
+        profile = Profile.from_json(json.load(file))
+
+    for line in profile.summary(args.top):
+        print(line)
+
+    if args.collapsed is not None:
+        profile.dump(args.collapsed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import argparse
+import logging
+import resource
+import time
+
+from attack import SybilAttack
+from custody import CustodyTable
+from graphs import large_graph_init, DEGREE
+from node import Root
+from results import ResultSink
+from simulator import SimulatedNode
+from utils import int_to_bytes
+
+# Sampling on 100k - 1M node networks. The graph is generated straight to
+# disk and loaded as int32 CSR arrays instead of a PyGraph, the rated list
+# uses the indexed backend with counting score keepers, and the custody
+# columns of all vertices are one uint16 table. Peak RSS is logged after
+# every stage.
+
+LARGE_OUTPUT_FILE = "./data/large_results"
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kB on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def log_stage(stage: str, start_time: float):
+    logging.info(f"{stage}: {time.time()-start_time:.2f}s, peak rss={peak_rss_mb():.0f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="rated list sampling on large networks")
+    parser.add_argument("--nodes", type=int, default=1000000)
+    parser.add_argument("--degree", type=int, default=DEGREE)
+    parser.add_argument("--graph-seed", type=int, default=1)
+    parser.add_argument("--rate", type=float, default=0.3)
+    parser.add_argument("--threshold", type=float, default=0.9)
+    parser.add_argument("--strategy", default="high")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default=LARGE_OUTPUT_FILE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(message)s")
+
+    start_time = time.time()
+    graph = large_graph_init(args.nodes, args.degree, args.graph_seed)
+    log_stage(f"graph with {graph.num_nodes()} nodes and {graph.num_edges()} edges", start_time)
+
+    start_time = time.time()
+    custody = CustodyTable.for_graph(graph)
+    log_stage("custody table", start_time)
+
+    start_time = time.time()
+    sim_node = SimulatedNode(
+        graph=graph,
+        seed=args.seed,
+        backend="indexed",
+        score_mode="counts",
+        custody=custody,
+    )
+    log_stage(f"rated list with {len(sim_node.dht.node_ids)} nodes", start_time)
+
+    start_time = time.time()
+    sim_node.load_attack(SybilAttack(graph=graph, sybil_rate=args.rate, seed=args.seed))
+    sim_node.run_info = {"rate": args.rate, "seed": args.seed}
+    log_stage("attack", start_time)
+
+    start_time = time.time()
+    report = sim_node.query_samples(
+        Root(int_to_bytes(0)), args.strategy, threshold=args.threshold
+    )
+    record = sim_node.metric_record(report)
+    record["num_nodes"] = graph.num_nodes()
+    record["peak_rss_mb"] = peak_rss_mb()
+    log_stage(
+        f"query_samples obtained {record['obtained_samples']} samples with {record['requests']} requests",
+        start_time,
+    )
+
+    with ResultSink(args.output) as sink:
+        sink.write(record)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+import argparse
+import asyncio
+import logging
+import selectors
+import time
+from typing import List, Set
+import numpy as np
+
+from attack import SybilAttack
+from graphs import graph_init, NUM_NODES_RANDOM, DEGREE
+from node import DATA_COLUMN_SIDECAR_SUBNET_COUNT, NodeId, Root, SampleId
+from results import ResultSink
+import seeding
+from simulator import SimulatedNode
+from utils import int_to_bytes
+
+# Latency aware sampling. Requests for all columns are in flight at the same
+# time and answers arrive after a per node latency, on a simulated clock: an
+# asyncio event loop whose time only advances to the next scheduled timer, so
+# a run takes as long as the bookkeeping and not as long as the latencies.
+
+LATENCY_OUTPUT_FILE = "./data/latency_results"
+
+
+class VirtualClockSelector(selectors.BaseSelector):
+    """
+    Selector that never waits on file descriptors. Waiting for a timeout
+    advances the clock instead of sleeping.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self._map = {}
+
+    def register(self, fileobj, events, data=None):
+        fd = fileobj if isinstance(fileobj, int) else fileobj.fileno()
+        key = selectors.SelectorKey(fileobj, fd, events, data)
+        self._map[fileobj] = key
+        return key
+
+    def unregister(self, fileobj):
+        return self._map.pop(fileobj)
+
+    def select(self, timeout=None):
+        if timeout is None:
+            # nothing is scheduled and nothing is ready to run
+            raise RuntimeError("simulation deadlocked, no pending timers")
+        self.now += max(timeout, 0.0)
+        return []
+
+    def get_map(self):
+        return self._map
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    def __init__(self):
+        self._clock = VirtualClockSelector()
+        super().__init__(selector=self._clock)
+
+    def time(self) -> float:
+        return self._clock.now
+
+
+class LatencyModel:
+    """
+    Per node request latencies. Every node gets a median latency drawn once
+    from a lognormal distribution around median, single requests add a
+    lognormal jitter on top. Requests slower than timeout count as failed.
+    """
+
+    def __init__(
+        self,
+        median: float = 0.1,
+        spread: float = 0.5,
+        jitter: float = 0.2,
+        timeout: float = 1.0,
+        seed: int = None,
+    ):
+        self.median = median
+        self.spread = spread
+        self.jitter = jitter
+        self.timeout = timeout
+        # node medians are drawn in vertex order from their own stream, so a
+        # node has the same median no matter in which order nodes are asked
+        if seed is None:
+            self.node_rng, self.rng = np.random.default_rng(), np.random.default_rng()
+        else:
+            self.node_rng = seeding.generator(seed, "latency", 0)
+            self.rng = seeding.generator(seed, "latency", 1)
+        self.node_medians = np.empty(0)
+
+    def node_median(self, vertex: int) -> float:
+        if vertex >= len(self.node_medians):
+            more = max(vertex + 1, 2 * len(self.node_medians)) - len(self.node_medians)
+            self.node_medians = np.concatenate(
+                [self.node_medians, self.median * self.node_rng.lognormal(0.0, self.spread, more)]
+            )
+        return float(self.node_medians[vertex])
+
+    def sample(self, vertex: int) -> float:
+        return self.node_median(vertex) * float(self.rng.lognormal(0.0, self.jitter))
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return float("nan")
+    return float(np.percentile(values, q))
+
+
+class _Unbounded:
+    # stands in for the semaphore when in flight requests are not limited
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+
+class LatencySampler:
+    """
+    query_samples for all columns at once. Each column keeps up to fanout
+    requests in flight and is done with the first answer, at most
+    max_inflight requests are outstanding over all columns (no limit if
+    None). Candidates are requested in order of their score for the "high"
+    and "low" strategies and in random order otherwise.
+    """
+
+    def __init__(
+        self,
+        sim_node: SimulatedNode,
+        latency: LatencyModel,
+        fanout: int = 1,
+        max_inflight: int = None,
+    ):
+        if fanout < 1:
+            raise ValueError("fanout must be at least one request per column")
+
+        self.sim_node = sim_node
+        self.latency = latency
+        self.fanout = fanout
+        self.max_inflight = max_inflight
+
+    def order_candidates(self, filtered_nodes: Set, querying_strategy: str) -> List:
+        # ties are broken by vertex, like query_samples orders its candidates,
+        # so the order doesn't depend on the set order of the filtered nodes
+        to_vertex = self.sim_node.to_vertex
+        if querying_strategy == "high":
+            ordered = sorted(filtered_nodes, key=lambda a: (-a[1], to_vertex(a[0])))
+        elif querying_strategy == "low":
+            ordered = sorted(filtered_nodes, key=lambda a: (a[1], to_vertex(a[0])))
+        else:
+            ordered = sorted(filtered_nodes, key=lambda a: to_vertex(a[0]))
+            self.sim_node.rng.shuffle(ordered)
+        return [node for node, _ in ordered]
+
+    async def _request(self, node, block_root: Root, sample: SampleId) -> bool:
+        sim_node = self.sim_node
+        vertex = sim_node.to_vertex(node)
+
+        async with self._slots:
+            self.requests += 1
+            sim_node.rl.on_request_score_update(sim_node.dht, block_root, node, sample)
+
+            delay = self.latency.sample(vertex)
+            if not sim_node.attack.should_respond_request(vertex, sample, block_root) or delay > self.latency.timeout:
+                # withheld and slow answers both end in a timeout
+                await asyncio.sleep(self.latency.timeout)
+                self.timeouts += 1
+                return False
+
+            await asyncio.sleep(delay)
+
+        sim_node.rl.on_response_score_update(sim_node.dht, block_root, node, sample)
+        self.latencies.append(delay)
+        return True
+
+    async def _sample_column(self, block_root: Root, sample: SampleId, candidates: List):
+        loop = asyncio.get_running_loop()
+        candidates = iter(candidates)
+        in_flight = set()
+
+        while True:
+            while len(in_flight) < self.fanout:
+                node = next(candidates, None)
+                if node is None:
+                    break
+                task = loop.create_task(self._request(node, block_root, sample))
+                self._tasks.append(task)
+                in_flight.add(task)
+
+            if not in_flight:
+                return None
+
+            done, in_flight = await asyncio.wait(
+                in_flight, return_when=asyncio.FIRST_COMPLETED
+            )
+            if any(task.result() for task in done):
+                # requests still in flight are answered later and update the
+                # scores, but the column is already obtained
+                return loop.time()
+
+    async def _run(self, block_root: Root, querying_strategy: str, threshold: float):
+        sim_node = self.sim_node
+        self.requests = 0
+        self.timeouts = 0
+        self.latencies: List[float] = []
+        self._tasks: List[asyncio.Task] = []
+        self._slots = (
+            asyncio.Semaphore(self.max_inflight)
+            if self.max_inflight is not None
+            else _Unbounded()
+        )
+
+        sampling_result = {"evicted": set(), "filtered": set(), "malicious": set()}
+        sampling_result["strategy"] = querying_strategy
+        sampling_result["threshold"] = threshold
+
+        # every column is filtered before the first request goes out, the
+        # requests of all columns then run concurrently
+        columns = {}
+        for sample in range(DATA_COLUMN_SIDECAR_SUBNET_COUNT):
+            if sample not in sim_node.dht.sample_mapping:
+                continue
+
+            filtered_nodes = sim_node._filter_nodes(block_root, sample, threshold)
+            all_nodes = sim_node.dht.sample_mapping[sample]
+            filtered_set = set([node[0] for node in filtered_nodes])
+
+            sampling_result["filtered"].update(filtered_set)
+            sampling_result["evicted"].update(all_nodes - filtered_set)
+            sampling_result["filtered"] -= sampling_result["evicted"]
+
+            columns[sample] = self.order_candidates(filtered_nodes, querying_strategy)
+
+        completion = await asyncio.gather(
+            *[
+                self._sample_column(block_root, sample, candidates)
+                for sample, candidates in columns.items()
+            ]
+        )
+        # let the outstanding requests finish so their score updates land
+        await asyncio.gather(*self._tasks)
+
+        completion_times = {}
+        for sample in range(DATA_COLUMN_SIDECAR_SUBNET_COUNT):
+            sampling_result[sample] = False
+        for sample, done_at in zip(columns, completion):
+            if done_at is not None:
+                sampling_result[sample] = True
+                completion_times[sample] = done_at
+
+        sampling_result["completion_times"] = completion_times
+        sampling_result["latencies"] = self.latencies
+        sampling_result["timeouts"] = self.timeouts
+        sampling_result["requests"] = self.requests
+        return sampling_result
+
+    def query_samples(
+        self, block_root: Root, querying_strategy: str = "high", threshold: float = 0.9
+    ):
+        start_time = time.time()
+        loop = VirtualClockLoop()
+        try:
+            sampling_result = loop.run_until_complete(
+                self._run(block_root, querying_strategy, threshold)
+            )
+        finally:
+            loop.close()
+
+        sim_node = self.sim_node
+        if sim_node.backend != "spec":
+            for key in ("evicted", "filtered"):
+                sampling_result[key] = set(
+                    [sim_node.to_node_id(node) for node in sampling_result[key]]
+                )
+
+        sampling_result["malicious"] = set(
+            [NodeId(int_to_bytes(id)) for id in sim_node.attack.get_malicious_nodes()]
+        )
+        sampling_result["wall_time"] = time.time() - start_time
+        return sampling_result
+
+    def metric_record(self, report) -> dict:
+        # the sampling metrics plus the simulated latencies, all in seconds
+        record = self.sim_node.metric_record(report)
+        completion_times = list(report["completion_times"].values())
+        obtained_all = len(completion_times) == DATA_COLUMN_SIDECAR_SUBNET_COUNT
+
+        record.update(
+            {
+                "fanout": self.fanout,
+                "timeouts": report["timeouts"],
+                "time_to_all": max(completion_times) if obtained_all else float("inf"),
+                "column_p50": percentile(completion_times, 50),
+                "column_p99": percentile(completion_times, 99),
+                "latency_p50": percentile(report["latencies"], 50),
+                "latency_p95": percentile(report["latencies"], 95),
+                "latency_p99": percentile(report["latencies"], 99),
+            }
+        )
+        return record
+
+
+def main():
+    parser = argparse.ArgumentParser(description="latency aware sampling on a simulated clock")
+    parser.add_argument("--strategies", nargs="+", default=["high", "low", "random"])
+    parser.add_argument("--fanout", type=int, default=1, help="requests in flight per column")
+    parser.add_argument("--max-inflight", type=int, default=None)
+    parser.add_argument("--median", type=float, default=0.1, help="median latency in seconds")
+    parser.add_argument("--spread", type=float, default=0.5)
+    parser.add_argument("--timeout", type=float, default=1.0)
+    parser.add_argument("--rate", type=float, default=0.3)
+    parser.add_argument("--threshold", type=float, default=0.9)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default=LATENCY_OUTPUT_FILE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(message)s")
+
+    graph = graph_init(NUM_NODES_RANDOM, DEGREE)
+    sim_node = SimulatedNode(graph=graph, seed=args.seed, backend="indexed")
+    sim_node.load_attack(SybilAttack(graph=graph, sybil_rate=args.rate, seed=args.seed))
+    sim_node.run_info = {"rate": args.rate, "seed": args.seed}
+
+    with ResultSink(args.output) as sink:
+        for strategy in args.strategies:
+            sim_node.refresh_scores()
+            # same latencies for every strategy
+            latency = LatencyModel(args.median, args.spread, timeout=args.timeout, seed=args.seed)
+            sampler = LatencySampler(sim_node, latency, args.fanout, args.max_inflight)
+
+            report = sampler.query_samples(Root(int_to_bytes(0)), strategy, args.threshold)
+            record = sampler.metric_record(report)
+            sink.write(record)
+
+            logging.info(
+                f"strategy={strategy} obtained={record['obtained_samples']} "
+                f"requests={record['requests']} timeouts={record['timeouts']} "
+                f"time_to_all={record['time_to_all']:.3f}s "
+                f"p50={record['latency_p50']:.3f}s p99={record['latency_p99']:.3f}s"
+            )
+
+
+if __name__ == "__main__":
+    main()
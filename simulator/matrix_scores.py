@@ -0,0 +1,223 @@
+import argparse
+import logging
+import time
+from typing import Set, Tuple
+import numpy as np
+
+try:
+    import scipy.sparse as sparse
+except ImportError:
+    sparse = None
+
+from custody import CustodyTable
+from graphs import graph_init, NUM_NODES_RANDOM, DEGREE
+from indexed_node import (
+    CLOSURE_BATCH_CELLS,
+    CountingScoreKeeper,
+    IndexedRatedListData,
+    ScoreCache,
+    _ancestor_visits,
+    _propagate_path_scores,
+)
+from attack import SybilAttack
+import node as rl_node
+from node import MAX_TREE_DEPTH, NodeRecord, RatedListData, Root, SampleId
+from simulator import SimulatedNode
+from utils import int_to_bytes
+
+# Scores of the whole indexed tree as sparse matrix products. The ancestor
+# relation of the tree (the transitive closure of its parent -> child links)
+# is a sparse 0/1 matrix R with R[a, n] = 1 if a is an ancestor of n. The
+# distinct (node, sample) pairs requested from and replied by every node are
+# vectors r and q, so the contacted and replied counts of all ancestors are
+# R @ r and R @ q, and the node scores follow from the level-wise max
+# propagation of compute_node_scores. Uses scipy.sparse if it is installed
+# and an equivalent numpy scatter add otherwise.
+#
+# The counts are those of the current tree. While the tree does not change
+# they equal the incrementally kept ones, after churn the score keepers still
+# hold the ancestors of the time of each request.
+
+
+def ancestor_columns(rated_list_data: IndexedRatedListData, nodes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # the columns of R for the given nodes as (rows, cols) coordinates. Column
+    # n is the ancestor closure of n, so closures the score updates already
+    # cached are reused and the missing ones are computed in one batch and
+    # cached for them.
+    adjacency = rated_list_data.freeze()
+    closures = adjacency.closures
+
+    missing = np.array([node for node in nodes.tolist() if node not in closures], dtype=np.int64)
+    # the visited mask of a batch is bounded to CLOSURE_BATCH_CELLS bools
+    batch = max(1, CLOSURE_BATCH_CELLS // max(1, adjacency.num_nodes))
+    for start in range(0, len(missing), batch):
+        chunk = missing[start : start + batch]
+        sources, ancestors = np.nonzero(_ancestor_visits(adjacency, chunk))
+        bounds = np.searchsorted(sources, np.arange(len(chunk) + 1))
+        for i, node in enumerate(chunk.tolist()):
+            closures[node] = ancestors[bounds[i] : bounds[i + 1]].astype(np.int64)
+
+    columns = [closures[node] for node in nodes.tolist()]
+    rows = np.concatenate(columns) if columns else np.empty(0, dtype=np.int64)
+    cols = np.repeat(nodes, [len(column) for column in columns])
+    return rows, cols
+
+
+def _matvec(rows: np.ndarray, cols: np.ndarray, vector: np.ndarray) -> np.ndarray:
+    if sparse is not None:
+        matrix = sparse.csr_matrix(
+            (np.ones(len(rows)), (rows, cols)), shape=(len(vector), len(vector))
+        )
+        return matrix @ vector
+    return np.bincount(rows, weights=vector[cols], minlength=len(vector))
+
+
+def outcomes(score_keeper) -> Tuple[Set, Set]:
+    # the distinct (node, sample) pairs requested and replied
+    if isinstance(score_keeper, CountingScoreKeeper):
+        return score_keeper.requested, score_keeper.responded
+
+    # every request is in the set of each of its ancestors
+    return (
+        set().union(*score_keeper.descendants_contacted.values()),
+        set().union(*score_keeper.descendants_replied.values()),
+    )
+
+
+def outcome_vectors(rated_list_data: IndexedRatedListData, block_root: Root) -> Tuple[np.ndarray, np.ndarray]:
+    # number of distinct samples requested from and replied by every node
+    num_nodes = len(rated_list_data.node_ids)
+    score_keeper = rated_list_data.scores.get(block_root)
+    if score_keeper is None:
+        return np.zeros(num_nodes), np.zeros(num_nodes)
+
+    requested, replied = outcomes(score_keeper)
+    return (
+        np.bincount(np.fromiter((node for node, _ in requested), dtype=np.int64), minlength=num_nodes).astype(np.float64),
+        np.bincount(np.fromiter((node for node, _ in replied), dtype=np.int64), minlength=num_nodes).astype(np.float64),
+    )
+
+
+def descendant_scores(rated_list_data: IndexedRatedListData, block_root: Root) -> np.ndarray:
+    # compute_descendant_score of every node
+    requested, replied = outcome_vectors(rated_list_data, block_root)
+    # only the columns of nodes that were requested contribute
+    rows, cols = ancestor_columns(rated_list_data, np.flatnonzero(requested))
+    contacted = _matvec(rows, cols, requested)
+    return np.divide(_matvec(rows, cols, replied), contacted, out=np.ones(len(contacted)), where=contacted > 0)
+
+
+def node_scores(rated_list_data: IndexedRatedListData, block_root: Root) -> np.ndarray:
+    # compute_node_score of every node
+    adjacency = rated_list_data.freeze()
+    num_nodes = adjacency.num_nodes
+    cache = ScoreCache(
+        adjacency,
+        rated_list_data.scores.get(block_root),
+        descendant_scores(rated_list_data, block_root),
+        np.zeros((MAX_TREE_DEPTH, num_nodes)),
+        np.zeros(num_nodes),
+    )
+    _propagate_path_scores(rated_list_data, cache)
+    return cache.node_scores
+
+
+def spec_rated_list(rated_list_data: IndexedRatedListData, block_root: Root) -> RatedListData:
+    # the spec RatedListData of the current tree, with the requests and
+    # replies of block_root replayed through the spec score updates so the
+    # ancestors are those of the current tree as well
+    present = rated_list_data.present
+    node_id = rated_list_data.to_node_id
+
+    nodes = {}
+    for node in range(len(present)):
+        if present[node]:
+            nodes[node_id(node)] = NodeRecord(
+                node_id(node),
+                set(node_id(child) for child in rated_list_data.children[node] if present[child]),
+                set(node_id(parent) for parent in rated_list_data.parents[node] if present[parent]),
+            )
+    sample_mapping = {
+        SampleId(sample): set(node_id(node) for node in members if present[node])
+        for sample, members in rated_list_data.sample_mapping.items()
+    }
+    data = RatedListData(node_id(rated_list_data.own_id), sample_mapping, nodes, {})
+
+    score_keeper = rated_list_data.scores.get(block_root)
+    if score_keeper is not None:
+        requested, replied = outcomes(score_keeper)
+        # nodes that left the tree have no ancestors to update
+        for update, pairs in (
+            (rl_node.on_request_score_update, requested),
+            (rl_node.on_response_score_update, replied),
+        ):
+            for node, sample in pairs:
+                if present[node]:
+                    update(data, block_root, node_id(node), SampleId(sample))
+    return data
+
+
+def validate(rated_list_data: IndexedRatedListData, block_root: Root, atol: float = 1e-12) -> float:
+    # largest difference to the spec functions of node.py over the nodes of
+    # the tree, raises if it exceeds atol
+    descendant = descendant_scores(rated_list_data, block_root)
+    scores = node_scores(rated_list_data, block_root)
+    reference = spec_rated_list(rated_list_data, block_root)
+
+    error = 0.0
+    for node, present in enumerate(rated_list_data.present):
+        if not present:
+            continue
+        key = rated_list_data.to_node_id(node)
+        error = max(
+            error,
+            abs(descendant[node] - rl_node.compute_descendant_score(reference, block_root, key)),
+            abs(scores[node] - rl_node.compute_node_score(reference, block_root, key)),
+        )
+
+    if error > atol:
+        raise AssertionError(f"matrix scores differ from the reference by {error}")
+    return error
+
+
+def main():
+    parser = argparse.ArgumentParser(description="sparse matrix scores validated against the reference")
+    parser.add_argument("--rate", type=float, default=0.3)
+    parser.add_argument("--blocks", type=int, default=3)
+    parser.add_argument("--score-mode", default="sets", choices=["sets", "counts"])
+    parser.add_argument("--nodes", type=int, default=NUM_NODES_RANDOM)
+    parser.add_argument("--degree", type=int, default=DEGREE)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(message)s")
+
+    graph = graph_init(args.nodes, args.degree)
+    sim_node = SimulatedNode(
+        graph=graph,
+        seed=args.seed,
+        backend="indexed",
+        score_mode=args.score_mode,
+        custody=CustodyTable.for_graph(graph),
+    )
+    sim_node.load_attack(SybilAttack(graph=graph.copy(), sybil_rate=args.rate, seed=args.seed))
+    logging.info(
+        f"scipy.sparse {'available' if sparse is not None else 'missing, using numpy'}"
+    )
+
+    block_root = Root(int_to_bytes(0))
+    for block in range(args.blocks):
+        sim_node.query_samples(block_root, "high")
+
+        start_time = time.perf_counter()
+        node_scores(sim_node.dht, block_root)
+        score_time = time.perf_counter() - start_time
+
+        error = validate(sim_node.dht, block_root)
+        logging.info(
+            f"block {block}: scores {score_time*1000:.1f}ms, max error {error}"
+        )
+
+
+if __name__ == "__main__":
+    main()
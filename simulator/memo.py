@@ -0,0 +1,141 @@
+import json
+import os
+from hashlib import sha256
+from typing import Dict, Optional
+
+from node import MAX_CHILDREN, MAX_TREE_DEPTH
+
+# Content addressed on-disk cache of query results. A result is stored under
+# the hash of everything it depends on: the graph, the attack and its
+# parameters, the query parameters, the spec constants, the source of the
+# generated spec and of the simulator modules that produce the results, and
+# the seed. Changing any of them gives a new key, stale results are never
+# returned but linger until they are evicted.
+# The cache keeps at most max_bytes of results, the least recently used ones
+# are evicted first.
+
+RESULT_CACHE_DIR = "./data/result_cache"
+RESULT_CACHE_BYTES = 256 << 20
+
+# the modules whose code the results depend on
+SOURCE_MODULES = (
+    "node",
+    "indexed_node",
+    "simulator",
+    "scorestate",
+    "attack",
+    "custody",
+    "graphs",
+    "seeding",
+    "utils",
+    "sweep",
+)
+
+_source_hash: str = None
+
+
+def source_hash() -> str:
+    global _source_hash
+    if _source_hash is None:
+        digest = sha256()
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for module in SOURCE_MODULES:
+            with open(os.path.join(directory, module + ".py"), "rb") as file:
+                digest.update(sha256(file.read()).digest())
+        _source_hash = digest.hexdigest()
+    return _source_hash
+
+
+def config_key(
+    graph_hash: str,
+    attack: str,
+    attack_params: Dict,
+    threshold: float,
+    strategy: str,
+    seed: int,
+    **params,
+) -> str:
+    # params are further options the result depends on, e.g. the backend
+    config = {
+        "graph": graph_hash,
+        "attack": attack,
+        "attack_params": attack_params,
+        "threshold": threshold,
+        "strategy": strategy,
+        "seed": seed,
+        "params": params,
+        "max_tree_depth": MAX_TREE_DEPTH,
+        "max_children": MAX_CHILDREN,
+        "source": source_hash(),
+    }
+    return sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    One json file per result, named by its key. Reads refresh the file's
+    modification time, which orders the files for LRU eviction. Entries are
+    written to a temporary file and renamed, so processes sharing the
+    directory never read half a result.
+    """
+
+    def __init__(self, directory: str = RESULT_CACHE_DIR, max_bytes: int = RESULT_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self.size = sum(entry.stat().st_size for entry in self._entries())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def _entries(self):
+        for shard in os.scandir(self.directory):
+            if shard.is_dir():
+                for entry in os.scandir(shard.path):
+                    if entry.name.endswith(".json"):
+                        yield entry
+
+    def get(self, key: str) -> Optional[Dict]:
+        path = self._path(key)
+        try:
+            with open(path) as file:
+                record = json.load(file)
+            os.utime(path)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return record
+
+    def put(self, key: str, record: Dict):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(record, file)
+        size = os.path.getsize(tmp_path)
+        if os.path.isfile(path):
+            size -= os.path.getsize(path)
+        os.replace(tmp_path, path)
+
+        self.size += size
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        # oldest entries first until the cache is back at 90% of its bound,
+        # so a full cache is not scanned again on every put
+        entries = sorted(self._entries(), key=lambda entry: entry.stat().st_mtime)
+        self.size = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if self.size <= 0.9 * self.max_bytes:
+                break
+            size = entry.stat().st_size
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+            self.size -= size
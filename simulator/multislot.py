@@ -0,0 +1,86 @@
+import argparse
+import logging
+import resource
+import time
+from typing import Dict, List
+
+from attack import SybilAttack
+from graphs import graph_init, NUM_NODES_RANDOM, DEGREE
+from node import Root
+from results import ResultSink
+from simulator import SimulatedNode
+from utils import int_to_bytes
+
+SLOTS_OUTPUT_FILE = "./data/slot_results"
+
+
+def run_slots(
+    sim_node: SimulatedNode,
+    num_slots: int,
+    querying_strategy: str = "high",
+    threshold: float = 0.9,
+    first_slot: int = 0,
+    sink: ResultSink = None,
+) -> List[Dict]:
+    # samples one block per slot, the block root of a slot is the slot number
+    records = []
+
+    for slot in range(first_slot, first_slot + num_slots):
+        block_root = Root(int_to_bytes(slot))
+        report = sim_node.query_samples(
+            block_root, querying_strategy, is_rated_list=True, threshold=threshold
+        )
+
+        record = sim_node.metric_record(report)
+        record["slot"] = slot
+        # number of block roots whose scores are still held in memory
+        record["score_blocks"] = len(sim_node.dht.scores)
+        records.append(record)
+
+        if sink is not None:
+            sink.write(record)
+
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="sample a stream of blocks over many slots")
+    parser.add_argument("--slots", type=int, default=1000)
+    parser.add_argument("--window", type=int, default=32, help="block roots to keep scores for")
+    parser.add_argument("--eviction", default="window", choices=["window", "lru"])
+    parser.add_argument("--aggregate", type=int, default=1, help="blocks to aggregate scores over")
+    parser.add_argument("--rate", type=float, default=0.3)
+    parser.add_argument("--threshold", type=float, default=0.9)
+    parser.add_argument("--strategy", default="high")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default=SLOTS_OUTPUT_FILE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(message)s")
+
+    graph = graph_init(NUM_NODES_RANDOM, DEGREE)
+    sim_node = SimulatedNode(
+        graph=graph,
+        seed=args.seed,
+        backend="indexed",
+        score_mode="counts",
+        max_blocks=args.window,
+        eviction=args.eviction,
+        aggregate_blocks=args.aggregate,
+    )
+    sim_node.load_attack(SybilAttack(graph=graph, sybil_rate=args.rate, seed=args.seed))
+    sim_node.run_info = {"rate": args.rate, "seed": args.seed}
+
+    start_time = time.time()
+    with ResultSink(args.output) as sink:
+        run_slots(sim_node, args.slots, args.strategy, args.threshold, sink=sink)
+
+    logging.info(f"sampled {args.slots} slots in {time.time()-start_time}s")
+    logging.info(
+        f"peak rss={resource.getrusage(resource.RUSAGE_SELF).ru_maxrss} kB, "
+        f"score blocks held={len(sim_node.dht.scores)}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+import argparse
+import logging
+import multiprocessing as mp
+import os
+import time
+from multiprocessing import shared_memory
+from typing import Dict, Iterable, List, Sequence, Tuple
+import numpy as np
+import rustworkx as rx
+
+from attack import AttackVec, FixedAttack, SybilAttack
+from custody import CustodyTable
+from graphs import edge_array, edge_tuples, graph_init, NUM_NODES_RANDOM, DEGREE
+from node import DATA_COLUMN_SIDECAR_SUBNET_COUNT, Root
+from results import ResultSink
+import seeding
+from simulator import SimulatedNode
+from utils import int_to_bytes
+
+# Rated lists of many nodes of the same network. The parts every node shares
+# (the attacked graph, the custody table and the set of malicious vertices)
+# are computed once and placed in shared memory, the workers build and query
+# the trees of their nodes on top of it.
+
+NETWORK_OUTPUT_FILE = "./data/network_results"
+
+
+class SharedArrays:
+    """
+    Numpy arrays packed into one shared memory block. Workers attach to the
+    block by the picklable layout instead of receiving copies.
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        self.layout = {}
+        offset = 0
+        for name, array in arrays.items():
+            # keep every array 8 byte aligned
+            offset += -offset % 8
+            self.layout[name] = (offset, array.shape, array.dtype.str)
+            offset += array.nbytes
+
+        self.shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        self.arrays = self._views(self.shm, self.layout)
+        for name, array in arrays.items():
+            self.arrays[name][...] = array
+
+    @staticmethod
+    def _views(shm: shared_memory.SharedMemory, layout: Dict) -> Dict[str, np.ndarray]:
+        return {
+            name: np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf, offset=offset)
+            for name, (offset, shape, dtype) in layout.items()
+        }
+
+    def handle(self) -> Tuple[str, Dict]:
+        return self.shm.name, self.layout
+
+    @classmethod
+    def attach(cls, handle: Tuple[str, Dict]):
+        name, layout = handle
+        shared = cls.__new__(cls)
+        shared.layout = layout
+        shared.shm = shared_memory.SharedMemory(name=name)
+        shared.arrays = cls._views(shared.shm, layout)
+        return shared
+
+    def close(self, unlink: bool = False):
+        self.arrays = {}
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def graph_from_edges(num_nodes: int, edges: np.ndarray) -> rx.PyGraph:
+    # vertex payloads are the vertex indices, like the graph files have
+    graph = rx.PyGraph()
+    graph.add_nodes_from(range(num_nodes))
+    graph.add_edges_from_no_data(edge_tuples(edges))
+    return graph
+
+
+class NetworkContext:
+    """
+    Everything the rated lists of a network have in common
+    """
+
+    def __init__(self, graph: rx.PyGraph, custody: CustodyTable, attack: FixedAttack, options: Dict):
+        self.graph = graph
+        self.custody = custody
+        self.attack = attack
+        self.options = options
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {
+            "edges": edge_array(self.graph),
+            "custody": self.custody.columns,
+            "malicious": self.attack.malicious_mask,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], options: Dict):
+        malicious_mask = arrays["malicious"]
+        graph = graph_from_edges(len(malicious_mask), arrays["edges"])
+        custody = CustodyTable(arrays["custody"], options["custody_subnet_count"])
+        return cls(graph, custody, FixedAttack(graph, malicious_mask), options)
+
+    def evaluate(self, vertex: int) -> Dict:
+        # builds the rated list of one node, samples one block and returns
+        # the metric record of the query
+        options = self.options
+        seed = options["seed"]
+        sim_node = SimulatedNode(
+            graph=self.graph,
+            binding_vertex=vertex,
+            backend=options["backend"],
+            score_mode=options["score_mode"],
+            custody=self.custody,
+            seed=seed,
+            # every node gets its own stream of the run, keyed by its vertex
+            rng=None if seed is None else seeding.generator(seed, "node", vertex),
+        )
+        sim_node.load_attack(self.attack)
+        sim_node.run_info = {"rate": options["rate"], "seed": -1 if seed is None else seed}
+
+        report = sim_node.query_samples(
+            Root(int_to_bytes(0)),
+            options["querying_strategy"],
+            threshold=options["threshold"],
+        )
+
+        record = sim_node.metric_record(report)
+        record["vertex"] = vertex
+        record["is_malicious"] = not self.attack.should_respond(vertex)
+        return record
+
+
+# per worker state, attached to the shared memory block once
+_shared: SharedArrays = None
+_context: NetworkContext = None
+
+
+def _init_worker(handle: Tuple[str, Dict], options: Dict):
+    global _shared, _context
+    _shared = SharedArrays.attach(handle)
+    _context = NetworkContext.from_arrays(_shared.arrays, options)
+
+
+def _evaluate(vertex: int) -> Dict:
+    return _context.evaluate(vertex)
+
+
+class NetworkSimulation:
+    """
+    Rated lists for many (by default all honest) vertices of one graph under
+    one attack. The attack is set up once, every node sees the same attacked
+    graph and the same malicious vertices.
+    """
+
+    def __init__(
+        self,
+        graph: rx.PyGraph,
+        attack: AttackVec,
+        backend: str = "indexed",
+        score_mode: str = "sets",
+        custody: CustodyTable = None,
+        seed: int = None,
+    ):
+        # the attack may add edges, the caller's graph is left as it was
+        graph = graph.copy()
+        attack.graph = graph
+        attack.setup_attack()
+
+        malicious_mask = np.zeros(max(graph.node_indices(), default=-1) + 1, dtype=bool)
+        malicious_mask[list(attack.get_malicious_nodes())] = True
+
+        if custody is None:
+            custody = CustodyTable.for_graph(graph)
+
+        self.rate = len(attack.get_malicious_nodes()) / graph.num_nodes()
+        self.context = NetworkContext(
+            graph,
+            custody,
+            FixedAttack(graph, malicious_mask),
+            {
+                "backend": backend,
+                "score_mode": score_mode,
+                "custody_subnet_count": custody.custody_subnet_count,
+                "seed": seed,
+                "rate": self.rate,
+            },
+        )
+
+    def honest_vertices(self) -> List[int]:
+        return np.flatnonzero(~self.context.attack.malicious_mask).tolist()
+
+    def run(
+        self,
+        vertices: Sequence[int] = None,
+        querying_strategy: str = "high",
+        threshold: float = 0.9,
+        workers: int = None,
+        sink: ResultSink = None,
+    ) -> List[Dict]:
+        if vertices is None:
+            vertices = self.honest_vertices()
+        workers = workers or os.cpu_count()
+        self.context.options.update(querying_strategy=querying_strategy, threshold=threshold)
+
+        if workers == 1:
+            return self._collect(map(self.context.evaluate, vertices), sink)
+
+        shared = SharedArrays(self.context.arrays())
+        try:
+            with mp.Pool(
+                workers,
+                initializer=_init_worker,
+                initargs=(shared.handle(), self.context.options),
+            ) as pool:
+                chunksize = max(1, len(vertices) // (4 * workers))
+                return self._collect(
+                    pool.imap_unordered(_evaluate, vertices, chunksize=chunksize), sink
+                )
+        finally:
+            shared.close(unlink=True)
+
+    def _collect(self, records: Iterable[Dict], sink: ResultSink) -> List[Dict]:
+        collected = []
+        for record in records:
+            collected.append(record)
+            if sink is not None:
+                sink.write(record)
+        return collected
+
+
+def completion_rate(records: List[Dict]) -> float:
+    # fraction of the honest nodes that obtained every sample
+    honest = [record for record in records if not record["is_malicious"]]
+    if not honest:
+        return float("nan")
+    complete = [
+        record
+        for record in honest
+        if record["obtained_samples"] == DATA_COLUMN_SIDECAR_SUBNET_COUNT
+    ]
+    return len(complete) / len(honest)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="rated lists of many nodes of one network")
+    parser.add_argument("--rate", type=float, default=0.3)
+    parser.add_argument("--threshold", type=float, default=0.9)
+    parser.add_argument("--strategy", default="high")
+    parser.add_argument("--sample", type=int, default=None, help="honest nodes to evaluate, all if unset")
+    parser.add_argument("--workers", type=int, default=None, help="defaults to all cores")
+    parser.add_argument("--backend", default="indexed", choices=["spec", "indexed"])
+    parser.add_argument("--score-mode", default="sets", choices=["sets", "counts"])
+    parser.add_argument("--nodes", type=int, default=NUM_NODES_RANDOM)
+    parser.add_argument("--degree", type=int, default=DEGREE)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default=NETWORK_OUTPUT_FILE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(message)s")
+
+    graph = graph_init(args.nodes, args.degree)
+    network = NetworkSimulation(
+        graph,
+        SybilAttack(graph=graph, sybil_rate=args.rate, seed=args.seed),
+        backend=args.backend,
+        score_mode=args.score_mode,
+        seed=args.seed,
+    )
+
+    vertices = network.honest_vertices()
+    if args.sample is not None:
+        rng = seeding.generator(args.seed, "sample")
+        vertices = rng.choice(vertices, min(args.sample, len(vertices)), replace=False).tolist()
+
+    start_time = time.time()
+    with ResultSink(args.output) as sink:
+        records = network.run(vertices, args.strategy, args.threshold, args.workers, sink)
+
+    logging.info(f"evaluated {len(records)} nodes in {time.time()-start_time}s")
+    logging.info(f"honest nodes with all samples: {completion_rate(records)}")
+
+
+if __name__ == "__main__":
+    main()
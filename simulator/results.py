@@ -0,0 +1,111 @@
+import os
+from typing import Dict, List
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+class ResultSink:
+    """
+    Buffered columnar sink for metric records. Records are appended in memory
+    and written out in batches, either as row groups of a parquet file (path
+    ending in .parquet, needs pyarrow) or as numbered .npz parts of an append
+    log directory otherwise. The keys of the first record (or of the parts
+    already in the directory) are the columns, every record must have them.
+    """
+
+    def __init__(self, path: str, batch_size: int = 1024):
+        self.path = path
+        self.batch_size = batch_size
+        self.buffer: List[Dict] = []
+        self.written = 0
+        self.columns: List[str] = None
+        self._writer = None
+
+        if self.is_parquet:
+            if pq is None:
+                raise ImportError("writing parquet results requires pyarrow")
+        else:
+            os.makedirs(path, exist_ok=True)
+            parts = sorted(f for f in os.listdir(path) if f.endswith(".npz"))
+            self._part = len(parts)
+            if parts:
+                # appended parts keep the columns of the existing ones
+                with np.load(os.path.join(path, parts[0])) as data:
+                    self.columns = list(data.files)
+
+    @property
+    def is_parquet(self) -> bool:
+        return self.path.endswith(".parquet")
+
+    def write(self, record: Dict):
+        if self.columns is None:
+            self.columns = list(record)
+        elif record.keys() != set(self.columns):
+            raise ValueError(_column_mismatch(self.columns, record.keys()))
+
+        self.buffer.append(record)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+
+        if self.is_parquet:
+            table = pa.Table.from_pydict(
+                {key: [record[key] for record in self.buffer] for key in self.columns}
+            )
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, table.schema)
+            self._writer.write_table(table)
+        else:
+            columns = {key: np.asarray([record[key] for record in self.buffer]) for key in self.columns}
+            np.savez(os.path.join(self.path, f"part-{self._part:05d}.npz"), **columns)
+            self._part += 1
+
+        self.written += len(self.buffer)
+        self.buffer = []
+
+    def close(self):
+        self.flush()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _column_mismatch(columns: List[str], keys) -> str:
+    missing = sorted(set(columns) - set(keys))
+    extra = sorted(set(keys) - set(columns))
+    return f"record columns differ from the sink's, missing {missing}, extra {extra}"
+
+
+def load_results(path: str) -> Dict[str, np.ndarray]:
+    # all records of a sink as one array per column
+    if path.endswith(".parquet"):
+        if pq is None:
+            raise ImportError("reading parquet results requires pyarrow")
+        table = pq.read_table(path)
+        return {name: table.column(name).to_numpy() for name in table.column_names}
+
+    parts = sorted(f for f in os.listdir(path) if f.endswith(".npz"))
+    columns: Dict[str, List[np.ndarray]] = {}
+    for part in parts:
+        with np.load(os.path.join(path, part)) as data:
+            if columns and set(data.files) != set(columns):
+                raise ValueError(f"{part}: " + _column_mismatch(list(columns), data.files))
+            for key in data.files:
+                columns.setdefault(key, []).append(data[key])
+
+    return {key: np.concatenate(arrays) for key, arrays in columns.items()}
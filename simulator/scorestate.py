@@ -0,0 +1,238 @@
+from typing import Dict, Iterable, List, Callable, Optional
+from collections import OrderedDict
+import copy
+import numpy as np
+
+from node import ScoreKeeper, Root
+from indexed_node import (
+    IndexedRatedListData,
+    IndexedScoreKeeper,
+    CountingScoreKeeper,
+    _invalidate_scores,
+)
+
+# Per block score state: copy-on-write forks and a bounded store for runs
+# over many slots. Forking only copies the per ancestor dicts; the (large)
+# sets of contacted/replied descendants are shared until one of the branches
+# adds to them.
+
+EVICTION_POLICIES = ("window", "lru")
+
+
+class ScoreStore(OrderedDict):
+    """
+    Drop-in replacement for RatedListData.scores that keeps at most
+    max_blocks score keepers. With the "window" policy the oldest block root
+    is evicted first (block roots arrive in slot order), with "lru" the least
+    recently read or written one.
+    """
+
+    def __init__(
+        self,
+        max_blocks: int,
+        policy: str = "window",
+        on_evict: Callable[[Root], None] = None,
+    ):
+        super().__init__()
+        if max_blocks < 1:
+            raise ValueError("a score store must keep at least one block")
+        if policy not in EVICTION_POLICIES:
+            raise ValueError(f"unknown eviction policy {policy}")
+
+        self.max_blocks = max_blocks
+        self.policy = policy
+        self.on_evict = on_evict
+
+    def __getitem__(self, block_root):
+        value = super().__getitem__(block_root)
+        if self.policy == "lru":
+            self.move_to_end(block_root)
+        return value
+
+    def __setitem__(self, block_root, score_keeper):
+        super().__setitem__(block_root, score_keeper)
+        self.move_to_end(block_root)
+
+        while len(self) > self.max_blocks:
+            evicted, _ = self.popitem(last=False)
+            if self.on_evict is not None:
+                self.on_evict(evicted)
+
+    def __reduce__(self):
+        # keep the configuration when pickled, but not the callback
+        return (
+            type(self),
+            (self.max_blocks, self.policy),
+            None,
+            None,
+            iter(self.items()),
+        )
+
+    def empty_like(self) -> "ScoreStore":
+        return ScoreStore(self.max_blocks, self.policy, self.on_evict)
+
+    def recent(self, num_blocks: int) -> List[Root]:
+        # most recently stored (or used, for lru) block roots, newest last
+        return list(self.keys())[-num_blocks:]
+
+
+def aggregate_score_keepers(score_keepers: List[CountingScoreKeeper]) -> CountingScoreKeeper:
+    # one keeper whose descendant scores are replied/contacted summed over
+    # all the given blocks
+    size = max(len(keeper.descendants_contacted) for keeper in score_keepers)
+    aggregate = CountingScoreKeeper.empty(size)
+    for keeper in score_keepers:
+        aggregate.descendants_contacted[: len(keeper.descendants_contacted)] += keeper.descendants_contacted
+        aggregate.descendants_replied[: len(keeper.descendants_replied)] += keeper.descendants_replied
+    return aggregate
+
+
+class AggregateView:
+    """
+    Rated list view whose scores for one block root are summed over that
+    block and some older ones. The older blocks are summed once, the current
+    block's counters are synced on every use and only the ancestors whose
+    counters changed are updated, so the view's score cache is refreshed
+    incrementally as well. Stale once the tree, the older blocks or the score
+    state as a whole change.
+    """
+
+    def __init__(
+        self,
+        rated_list_data: IndexedRatedListData,
+        block_root: Root,
+        current: Optional[CountingScoreKeeper],
+        older: List[CountingScoreKeeper],
+    ):
+        self.scores = rated_list_data.scores
+        self.adjacency = rated_list_data.freeze()
+        self.block_root = block_root
+        self.current = current
+        self.older = [(keeper, keeper.version) for keeper in older]
+
+        keepers = older + ([current] if current is not None else [])
+        aggregate = aggregate_score_keepers(keepers)
+        self.base = CountingScoreKeeper.empty(len(aggregate.descendants_contacted))
+        if older:
+            older_sum = aggregate_score_keepers(older)
+            self.base.descendants_contacted[: len(older_sum.descendants_contacted)] = older_sum.descendants_contacted
+            self.base.descendants_replied[: len(older_sum.descendants_replied)] = older_sum.descendants_replied
+        if current is not None:
+            self.seen_contacted = current.descendants_contacted.copy()
+            self.seen_replied = current.descendants_replied.copy()
+
+        self.view = copy.copy(rated_list_data)
+        self.view.scores = {block_root: aggregate}
+        self.view.score_caches = {}
+
+    def matches(
+        self,
+        rated_list_data: IndexedRatedListData,
+        current: Optional[CountingScoreKeeper],
+        older: List[CountingScoreKeeper],
+    ) -> bool:
+        return (
+            self.scores is rated_list_data.scores
+            and self.adjacency is rated_list_data.freeze()
+            and self.current is current
+            and (current is None or len(current.descendants_contacted) == len(self.seen_contacted))
+            and len(older) == len(self.older)
+            and all(
+                keeper is seen and keeper.version == version
+                for keeper, (seen, version) in zip(older, self.older)
+            )
+        )
+
+    def sync(self) -> IndexedRatedListData:
+        if self.current is not None:
+            contacted = self.current.descendants_contacted
+            replied = self.current.descendants_replied
+            changed = np.flatnonzero((contacted != self.seen_contacted) | (replied != self.seen_replied))
+            if len(changed) > 0:
+                aggregate = self.view.scores[self.block_root]
+                aggregate.descendants_contacted[changed] = self.base.descendants_contacted[changed] + contacted[changed]
+                aggregate.descendants_replied[changed] = self.base.descendants_replied[changed] + replied[changed]
+                self.seen_contacted[changed] = contacted[changed]
+                self.seen_replied[changed] = replied[changed]
+                aggregate.version += 1
+                _invalidate_scores(self.view, self.block_root, changed)
+        return self.view
+
+
+class CowSet:
+    """
+    Set shared between score state branches, copied on the first add
+    """
+
+    __slots__ = ("items", "shared")
+
+    def __init__(self, items: Iterable = (), shared: bool = False):
+        self.items = items if isinstance(items, set) else set(items)
+        self.shared = shared
+
+    def add(self, item):
+        if self.shared:
+            self.items = set(self.items)
+            self.shared = False
+        self.items.add(item)
+
+    def share(self) -> "CowSet":
+        self.shared = True
+        return CowSet(self.items, shared=True)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, item):
+        return item in self.items
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __eq__(self, other):
+        if isinstance(other, CowSet):
+            other = other.items
+        return self.items == other
+
+    def __repr__(self):
+        return f"CowSet({self.items!r})"
+
+
+def _as_cow(value) -> CowSet:
+    return value if isinstance(value, CowSet) else CowSet(value)
+
+
+def _fork_sets(sets: Dict) -> Dict:
+    # values become shared in both the original and the fork
+    forked = {}
+    for key, value in sets.items():
+        value = sets[key] = _as_cow(value)
+        forked[key] = value.share()
+    return forked
+
+
+def fork_score_keeper(score_keeper):
+    if isinstance(score_keeper, CountingScoreKeeper):
+        # the counters are one small array per block, copying them is cheaper
+        # than tracking writes
+        score_keeper.requested = _as_cow(score_keeper.requested)
+        score_keeper.responded = _as_cow(score_keeper.responded)
+        return CountingScoreKeeper(
+            np.copy(score_keeper.descendants_contacted),
+            np.copy(score_keeper.descendants_replied),
+            score_keeper.requested.share(),
+            score_keeper.responded.share(),
+            score_keeper.version,
+        )
+
+    return type(score_keeper)(
+        _fork_sets(score_keeper.descendants_contacted),
+        _fork_sets(score_keeper.descendants_replied),
+    )
+
+
+def fork_scores(scores: Dict[Root, ScoreKeeper]) -> Dict[Root, ScoreKeeper]:
+    forked = scores.empty_like() if isinstance(scores, ScoreStore) else {}
+    for block_root, keeper in scores.items():
+        forked[block_root] = fork_score_keeper(keeper)
+    return forked
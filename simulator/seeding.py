@@ -0,0 +1,62 @@
+import os
+import sys
+from typing import Dict, Optional
+import numpy as np
+
+# Per run random streams. The seed of a run is the root of a SeedSequence
+# tree with one child per component (spawned in COMPONENTS order), and keyed
+# streams below a component for its instances, e.g. the rated list of every
+# vertex of a network. Draws of one component never shift the streams of
+# another, so identical seeds give identical runs in any process and in any
+# order of evaluation. Sets of the spec's Bytes32 node ids iterate in an
+# order that depends on the hash seed of the process, the simulator takes
+# their nodes in vertex order wherever the order matters. Entry points that
+# compare or cache runs across processes also pin the hash seed.
+
+COMPONENTS = ("graph", "node", "attack", "latency", "churn", "sample")
+HASH_SEED = "0"
+
+_children: Dict[int, Dict[str, np.random.SeedSequence]] = {}
+
+
+def component_sequence(seed: int, component: str, *key: int) -> np.random.SeedSequence:
+    if component not in COMPONENTS:
+        raise ValueError(f"unknown random stream component {component}")
+
+    children = _children.get(seed)
+    if children is None:
+        children = dict(zip(COMPONENTS, np.random.SeedSequence(seed).spawn(len(COMPONENTS))))
+        _children[seed] = children
+
+    sequence = children[component]
+    if key:
+        # the same sequence spawn() would give as the key-th child
+        sequence = np.random.SeedSequence(
+            sequence.entropy, spawn_key=sequence.spawn_key + tuple(int(k) for k in key)
+        )
+    return sequence
+
+
+def generator(seed: int, component: str, *key: int) -> np.random.Generator:
+    return np.random.default_rng(component_sequence(seed, component, *key))
+
+
+def derive_seed(seed: int, component: str, *key: int) -> int:
+    # integer seed for libraries that take one (rustworkx, random.Random)
+    return int(component_sequence(seed, component, *key).generate_state(1, np.uint64)[0] >> 1)
+
+
+def hash_seed() -> Optional[str]:
+    # PYTHONHASHSEED of the process, None if it is random
+    if not sys.flags.hash_randomization:
+        return "0"
+    value = os.environ.get("PYTHONHASHSEED")
+    return None if value in (None, "", "random") else value
+
+
+def pin_hash_seed():
+    # runs the script again with PYTHONHASHSEED set if the hash seed of this
+    # process is random. Worker processes inherit it.
+    if hash_seed() is None:
+        os.environ["PYTHONHASHSEED"] = HASH_SEED
+        os.execv(sys.executable, [sys.executable] + sys.argv)
@@ -1,14 +1,25 @@
 import rustworkx as rx
 import random as rn
-import queue
+import os
+import copy
 from dataclasses import dataclass
 from collections import deque
-from typing import Tuple, List
+from typing import Tuple, List, Dict
 import logging
+import time
+import numpy as np
 
 # Project specific
 from attack import AttackVec
 import node as rl_node
+import indexed_node
+import instrument
+from custody import CustodyTable
+from graphs import average_degree as graph_average_degree
+from results import ResultSink
+import seeding
+import snapshots
+from scorestate import fork_scores, ScoreStore, AggregateView
 from utils import int_to_bytes, bytes_to_int
 from node import (
     DATA_COLUMN_SIDECAR_SUBNET_COUNT,
@@ -29,6 +40,72 @@ class RequestQueueItem:
     block_root: Root
 
 
+class RequestBuffer:
+    """
+    Preallocated ring buffer of pending sample requests. The simulator is
+    single threaded, so unlike queue.Queue there is no locking, and requests
+    are drained as one batch together with the array of their graph vertices.
+    """
+
+    def __init__(self, capacity: int = 256):
+        self.items: List[RequestQueueItem] = [None] * capacity
+        self.vertices = np.empty(capacity, dtype=np.int64)
+        self.head = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def empty(self) -> bool:
+        return self.size == 0
+
+    def put(self, item: RequestQueueItem, vertice: int):
+        capacity = len(self.items)
+        if self.size == capacity:
+            self._grow()
+            capacity = len(self.items)
+
+        tail = (self.head + self.size) % capacity
+        self.items[tail] = item
+        self.vertices[tail] = vertice
+        self.size += 1
+
+    def _grow(self):
+        items, vertices = self.pending()
+        capacity = 2 * len(self.items)
+        self.items = items + [None] * (capacity - len(items))
+        self.vertices = np.empty(capacity, dtype=np.int64)
+        self.vertices[: len(vertices)] = vertices
+        self.head = 0
+
+    def pending(self) -> Tuple[List[RequestQueueItem], np.ndarray]:
+        # pending requests in request order, without removing them
+        end = self.head + self.size
+        capacity = len(self.items)
+        if end <= capacity:
+            return self.items[self.head : end], self.vertices[self.head : end].copy()
+
+        end -= capacity
+        return (
+            self.items[self.head :] + self.items[:end],
+            np.concatenate((self.vertices[self.head :], self.vertices[:end])),
+        )
+
+    def drain(self) -> Tuple[List[RequestQueueItem], np.ndarray]:
+        items, vertices = self.pending()
+        for i in range(self.size):
+            self.items[(self.head + i) % len(self.items)] = None
+        self.head = 0
+        self.size = 0
+        return items, vertices
+
+
+@dataclass
+class ScoreCheckpoint:
+    scores: Dict[Root, object]
+    pending_requests: List[RequestQueueItem]
+
+
 class SimulatedNode:
     def print_debug(self, *args):
         if self.debug:
@@ -39,33 +116,161 @@ class SimulatedNode:
         graph: rx.PyGraph,
         binding_vertex: int = None,
         debug: bool = False,
+        backend: str = "spec",
+        score_mode: str = "sets",
+        custody: CustodyTable = None,
+        sink: ResultSink = None,
+        seed: int = None,
+        rng: np.random.Generator = None,
+        snapshot_dir: str = None,
+        max_blocks: int = None,
+        eviction: str = "window",
+        aggregate_blocks: int = 1,
+        profile: bool = False,
+        construction: str = "eager",
+        min_candidates: int = 4,
     ):
         self.debug = debug
         self.graph = graph
-        self.request_queue = queue.Queue()
+        self.backend = backend
+        # print_report also writes a metric record to the sink if one is set,
+        # run_info holds the run parameters (rate, seed) stored along with it
+        self.sink = sink
+        self.run_info = {}
+        self.request_queue = RequestBuffer()
+        # with lazy construction only the root is asked for its peers up
+        # front, query_samples expands the tree further while a sample has
+        # fewer than min_candidates filtered nodes
+        if construction not in ("eager", "lazy"):
+            raise ValueError(f"unknown tree construction {construction}")
+        if construction == "lazy" and snapshot_dir is not None:
+            raise ValueError("snapshots hold complete trees, use eager construction")
+        self.construction = construction
+        self.min_candidates = min_candidates
+        self.expansion_queue = deque()
+        self.expanded = set()
+        self.get_peers_calls = 0
+        # ancestor index of the spec tree, the indexed backend keeps its own
+        # with the adjacency
+        self._spec_ancestry = None
+        # the nodes of each sample column in vertex order, see _ordered_mapping
+        self._ordered_columns = {}
+        # scores of at most max_blocks block roots are kept (all if None), and
+        # filtering can use the scores summed over the last aggregate_blocks
+        self.max_blocks = max_blocks
+        self.eviction = eviction
+        self.aggregate_blocks = aggregate_blocks
+        # the aggregated view of the block being sampled, see _scoring_view
+        self._aggregate_view = None
+        if aggregate_blocks > 1 and (backend, score_mode) != ("indexed", "counts"):
+            raise ValueError("score aggregation needs the indexed backend in counts mode")
+        # with a seed (or a stream of the caller) the peer shuffling and
+        # vertex choice draw from the node's own stream of the run, otherwise
+        # from the global random module as before
+        self.seed = seed
+        if rng is not None:
+            self.rng = rng
+        elif seed is not None:
+            self.rng = seeding.generator(seed, "node")
+        else:
+            self.rng = rn
+        # counters and phase timings are collected in one profile per process,
+        # shared with every other node while it is enabled
+        self.profile = (
+            instrument.enable([rl_node, indexed_node]) if profile else instrument.active()
+        )
 
         # calculate average degree of the graph
-        sum = 0
-        for node in self.graph.nodes():
-            sum = sum + self.graph.degree(self.graph[node])
-
-        self.print_debug("Average Degree:", sum / len(self.graph.nodes()))
+        if self.debug:
+            self.print_debug("Average Degree:", graph_average_degree(self.graph))
 
         # map rated list node to one of the graph vertices
         if binding_vertex is None:
-            binding_vertex = rn.choice(self.graph.node_indices())
+            binding_vertex = int(self.rng.choice(list(self.graph.node_indices())))
 
-        self.dht = RatedListData(NodeId(int_to_bytes(binding_vertex)), {}, {}, {})
-        self.dht.nodes[self.dht.own_id] = NodeRecord(self.dht.own_id, set(), set())
+        if backend == "indexed":
+            # same spec functions over dense integer indices and CSR adjacency
+            if custody is None:
+                custody = CustodyTable.for_graph(self.graph)
+
+            self.rl = indexed_node
+            self.dht = indexed_node.IndexedRatedListData.for_root(
+                binding_vertex, score_mode, custody
+            )
+        elif backend == "spec":
+            if score_mode != "sets":
+                raise ValueError("the spec backend only supports the sets score mode")
+
+            self.rl = rl_node
+            self.dht = RatedListData(NodeId(int_to_bytes(binding_vertex)), {}, {}, {})
+            self.dht.nodes[self.dht.own_id] = NodeRecord(self.dht.own_id, set(), set())
+        else:
+            raise ValueError(f"unknown rated list backend {backend}")
+
+        self.dht.scores = self._new_scores()
 
         self.print_debug(
             "mapped rated list node to graph vertice " + str(binding_vertex)
         )
 
-        self._construct_tree()
+        with instrument.phase("construct_tree"):
+            if construction == "lazy":
+                self.expansion_queue.append((self.dht.own_id, 0))
+                self.expand_tree(lambda: True)
+            elif snapshot_dir is None:
+                self._construct_tree()
+            else:
+                # the tree only depends on the graph, the root, the tree depth
+                # and the seed, so it is stored once and restored afterwards
+                path = snapshots.snapshot_path(snapshot_dir, graph, binding_vertex, seed)
+                if os.path.isfile(path):
+                    snapshots.load_snapshot(self.dht, path)
+                    self.print_debug("restored the rated list from " + path)
+                else:
+                    self._construct_tree()
+                    snapshots.save_snapshot(self.dht, path)
 
         self.print_debug("constructed the rated list")
 
+    def to_key(self, vertex: int):
+        # the key the rated list backend uses for a graph vertex
+        if self.backend == "indexed":
+            return self.dht.intern(vertex)
+        return NodeId(int_to_bytes(vertex))
+
+    def to_vertex(self, key) -> int:
+        if self.backend == "indexed":
+            return self.dht.node_ids[key]
+        return bytes_to_int(key)
+
+    def to_node_id(self, key) -> NodeId:
+        if self.backend == "indexed":
+            return self.dht.to_node_id(key)
+        return key
+
+    def children(self, key):
+        if self.backend == "indexed":
+            return self.dht.children[key]
+        return self.dht.nodes[key].children
+
+    def children_in_order(self, key) -> list:
+        return sorted(self.children(key), key=self.to_vertex)
+
+    def parents(self, key):
+        if self.backend == "indexed":
+            return self.dht.parents[key]
+        return self.dht.nodes[key].parents
+
+    def in_tree(self, key) -> bool:
+        if self.backend == "indexed":
+            return key < len(self.dht.present) and self.dht.present[key]
+        return key in self.dht.nodes
+
+    def tree_size(self) -> int:
+        if self.backend == "indexed":
+            return int(sum(self.dht.present))
+        return len(self.dht.nodes)
+
     def load_attack(self, attack: AttackVec):
         self.attack = attack
 
@@ -75,54 +280,201 @@ class SimulatedNode:
 
     def refresh_scores(self):
         # flush scores for new attack
-        self.dht.scores = {}
+        self.dht.scores = self._new_scores()
+        if self.backend == "indexed":
+            self.dht.score_caches = {}
+            self._aggregate_view = None
 
-        self.request_queue = queue.Queue()
+        self.request_queue = RequestBuffer()
+        # adaptive attacks start over with the scores
+        self.attack.reset()
 
         self.print_debug("refreshed scores")
 
+    def _new_scores(self):
+        if self.max_blocks is None:
+            return {}
+        return ScoreStore(self.max_blocks, self.eviction, self._evict_block)
+
+    def _evict_block(self, block_root: Root):
+        if self.backend == "indexed":
+            self.dht.score_caches.pop(block_root, None)
+
+    def _scoring_view(self, block_root: Root):
+        # rated list whose scores for block_root are the aggregate over the
+        # most recent blocks, only used for filtering
+        if self.aggregate_blocks <= 1:
+            return self.dht
+
+        roots = [root for root in self.dht.scores.keys() if root != block_root]
+        roots = roots[max(0, len(roots) - (self.aggregate_blocks - 1)) :]
+        older = [self.dht.scores.get(root) for root in roots]
+        older = [keeper for keeper in older if keeper is not None]
+        current = self.dht.scores.get(block_root)
+        if current is None and not older:
+            return self.dht
+
+        # the view is kept while only the block's own counters change, they
+        # are synced into it on every call
+        view = self._aggregate_view
+        if view is None or view.block_root != block_root or not view.matches(self.dht, current, older):
+            view = AggregateView(self.dht, block_root, current, older)
+            self._aggregate_view = view
+        return view.sync()
+
+    def checkpoint(self) -> ScoreCheckpoint:
+        # copy-on-write snapshot of the score state, the descendant sets are
+        # only copied once either side adds to them
+        return ScoreCheckpoint(
+            fork_scores(self.dht.scores), self.request_queue.pending()[0]
+        )
+
+    def restore(self, checkpoint: ScoreCheckpoint):
+        # the checkpoint itself is left untouched and can be restored again
+        self.dht.scores = fork_scores(checkpoint.scores)
+        if isinstance(self.dht.scores, ScoreStore):
+            self.dht.scores.on_evict = self._evict_block
+        if self.backend == "indexed":
+            self.dht.score_caches = {}
+            self._aggregate_view = None
+
+        self.request_queue = RequestBuffer()
+        for request in checkpoint.pending_requests:
+            self.request_queue.put(request, self.to_vertex(request.node_id))
+
+        self.print_debug("restored scores from checkpoint")
+
+    def fork(self) -> "SimulatedNode":
+        # a branch that shares the graph, the rated list tree and the attack
+        # but has its own score state, and its own state of adaptive attacks.
+        # Branches must not modify the tree, except with lazy construction:
+        # sampling expands the tree there, so every branch gets its own copy
+        # of the tree and of the expansion state.
+        branch = copy.copy(self)
+        if self.construction == "lazy":
+            # the score state is replaced by restore below, the custody
+            # table is read only
+            shared = [
+                self.dht.scores,
+                getattr(self.dht, "score_caches", None),
+                getattr(self.dht, "custody", None),
+            ]
+            branch.dht = copy.deepcopy(self.dht, {id(obj): obj for obj in shared if obj is not None})
+            branch.expansion_queue = deque(self.expansion_queue)
+            branch.expanded = set(self.expanded)
+            branch._spec_ancestry = None
+            branch._ordered_columns = {}
+        else:
+            branch.dht = copy.copy(self.dht)
+        branch.run_info = dict(self.run_info)
+        if self.rng is not rn:
+            branch.rng = copy.deepcopy(self.rng)
+        if not self.attack.is_static:
+            branch.attack = self.attack.fork()
+
+        branch.restore(self.checkpoint())
+        return branch
+
     def request_sample(self, node_id: NodeId, block_root: Root, sample: SampleId):
         self.print_debug("Requesting samples from", node_id)
+        instrument.count("requests")
 
-        rl_node.on_request_score_update(self.dht, block_root, node_id, sample)
+        self.rl.on_request_score_update(self.dht, block_root, node_id, sample)
         self.request_queue.put(
-            RequestQueueItem(node_id=node_id, sample_id=sample, block_root=block_root)
+            RequestQueueItem(node_id=node_id, sample_id=sample, block_root=block_root),
+            self.to_vertex(node_id),
         )
 
+    def request_samples(self, node_ids: List[NodeId], block_root: Root, sample: SampleId):
+        # request_sample for several nodes, with the score updates in bulk
+        self.print_debug("Requesting samples from", node_ids)
+        instrument.count("requests", len(node_ids))
+
+        if self.backend == "indexed":
+            indexed_node.on_request_score_updates(
+                self.dht, block_root, node_ids, [sample] * len(node_ids)
+            )
+        else:
+            for node_id in node_ids:
+                self.rl.on_request_score_update(self.dht, block_root, node_id, sample)
+
+        for node_id in node_ids:
+            self.request_queue.put(
+                RequestQueueItem(node_id=node_id, sample_id=sample, block_root=block_root),
+                self.to_vertex(node_id),
+            )
+
     def get_peers(self, node_id: NodeId):
+        self.get_peers_calls += 1
+        self._spec_ancestry = None
+        self._ordered_columns = {}
         peers = []
 
-        random_neighbors = list(self.graph.neighbors(bytes_to_int(node_id)))
+        # the neighbour order of the graph is not stable, the shuffle starts
+        # from the sorted peers
+        random_neighbors = sorted(self.graph.neighbors(self.to_vertex(node_id)))
 
-        rn.shuffle(random_neighbors)
+        self.rng.shuffle(random_neighbors)
 
         for i, peer_id in enumerate(random_neighbors):
             # if i >= MAX_CHILDREN:
             #     break
 
-            peer_id_bytes = NodeId(int_to_bytes(peer_id))
-            peers.append(peer_id_bytes)
-            rl_node.add_samples_on_entry(self.dht, peer_id_bytes)
-        rl_node.on_get_peers_response(self.dht, node_id, peers)
+            peer_key = self.to_key(peer_id)
+            peers.append(peer_key)
+            self.rl.add_samples_on_entry(self.dht, peer_key)
+        self.rl.on_get_peers_response(self.dht, node_id, peers)
 
+    @instrument.timed("request_processing")
     def process_requests(self) -> List[Tuple[RequestQueueItem, bool]]:
-        request_status = []
-
-        while not self.request_queue.empty():
-            request: RequestQueueItem = self.request_queue.get()
-
-            if not self.attack.should_respond(bytes_to_int(request.node_id)):
-                self.print_debug("Rejected sample request", request)
-                request_status.append((request, False))
-                continue
+        requests, vertices = self.request_queue.drain()
+        if not requests:
+            return []
+
+        # the whole batch is answered at once, and the score updates of the
+        # successful requests are applied in bulk
+        if self.attack.is_static:
+            responded = self.attack.should_respond_batch(vertices).tolist()
+        else:
+            # adaptive behaviours get the requests of each block root in order
+            answers = np.empty(len(requests), dtype=bool)
+            positions = {}
+            for position, request in enumerate(requests):
+                positions.setdefault(request.block_root, []).append(position)
+            for block_root, batch in positions.items():
+                answers[batch] = self.attack.should_respond_requests(
+                    vertices[batch],
+                    np.array([requests[position].sample_id for position in batch], dtype=np.int64),
+                    block_root,
+                )
+            responded = answers.tolist()
+        request_status = list(zip(requests, responded))
 
-            rl_node.on_response_score_update(
-                self.dht,
-                block_root=request.block_root,
-                node_id=request.node_id,
-                sample_id=request.sample_id,
-            )
-            request_status.append((request, True))
+        replies = [request for request, ok in request_status if ok]
+        if self.debug:
+            for request, ok in request_status:
+                if not ok:
+                    self.print_debug("Rejected sample request", request)
+
+        if self.backend == "indexed" and replies:
+            # a batch spans a single block root when it comes from query_samples
+            block_roots = set(request.block_root for request in replies)
+            for block_root in block_roots:
+                batch = [request for request in replies if request.block_root == block_root]
+                indexed_node.on_response_score_updates(
+                    self.dht,
+                    block_root,
+                    [request.node_id for request in batch],
+                    [request.sample_id for request in batch],
+                )
+        else:
+            for request in replies:
+                self.rl.on_response_score_update(
+                    self.dht,
+                    block_root=request.block_root,
+                    node_id=request.node_id,
+                    sample_id=request.sample_id,
+                )
 
         return request_status
 
@@ -141,42 +493,176 @@ class SimulatedNode:
 
             self.get_peers(current_node_id)
 
-            for child_id in self.dht.nodes[current_node_id].children:
+            # children are queued in vertex order, the set order of spec node
+            # ids depends on the hash seed and differs from the indexed backend
+            for child_id in self.children_in_order(current_node_id):
                 # no point adding to the list if we are not gonna use the item
                 if (current_level + 1) < MAX_TREE_DEPTH:
                     queue.append((child_id, current_level + 1))
 
-    def is_ancestor(self, grand_child: NodeId, check_ancestor: NodeId) -> bool:
-        # all nodes are children(grand or great grand
-        # until tree depth) of root node
-        if check_ancestor == self.dht.own_id:
-            return True
+    def expand_tree(self, done) -> int:
+        # continues the BFS of _construct_tree from where it stopped until
+        # done() holds, every node is asked for its peers at most once
+        expanded = 0
+        while self.expansion_queue:
+            node_id, level = self.expansion_queue.popleft()
+            if level >= MAX_TREE_DEPTH or node_id in self.expanded:
+                continue
 
-        if check_ancestor == grand_child:
-            return True
+            self.expanded.add(node_id)
+            self.get_peers(node_id)
+            expanded += 1
+
+            if (level + 1) < MAX_TREE_DEPTH:
+                for child_id in self.children_in_order(node_id):
+                    if child_id not in self.expanded:
+                        self.expansion_queue.append((child_id, level + 1))
+
+            if done():
+                break
+
+        return expanded
+
+    def _ordered_mapping(self, samples) -> Dict:
+        # sample mapping with the nodes of each column in vertex order, kept
+        # until the tree changes. filter_nodes evicts the children of nodes it
+        # visited before, so both backends filter in this order to give the
+        # same result in any process.
+        mapping = self.dht.sample_mapping
+        missing = [
+            sample for sample in samples
+            if sample not in self._ordered_columns and sample in mapping
+        ]
+        if self.backend == "indexed" and missing:
+            vertices = np.asarray(self.dht.node_ids, dtype=np.int64)
+            for sample in missing:
+                nodes = np.fromiter(mapping[sample], dtype=np.int64, count=len(mapping[sample]))
+                self._ordered_columns[sample] = nodes[np.argsort(vertices[nodes])].tolist()
+        else:
+            for sample in missing:
+                self._ordered_columns[sample] = sorted(mapping[sample], key=self.to_vertex)
+        return self._ordered_columns
+
+    def _ordered_view(self, block_root: Root, samples):
+        # the scoring view with the ordered sample mapping. The view shares
+        # the tree, the scores and (frozen beforehand) the adjacency and score
+        # caches of the indexed backend.
+        view = self._scoring_view(block_root)
+        if self.backend == "indexed":
+            view.freeze()
+        ordered = copy.copy(view)
+        ordered.sample_mapping = self._ordered_mapping(samples)
+        return ordered
+
+    def _filter_nodes(self, block_root: Root, sample: SampleId, threshold: float):
+        with instrument.phase("filtering"):
+            return self.rl.filter_nodes(
+                self._ordered_view(block_root, [sample]), block_root, sample, threshold
+            )
 
-        if check_ancestor in self.dht.nodes[grand_child].parents:
-            return True
+    def _expand_for_sample(self, block_root: Root, sample: SampleId, threshold: float, is_rated_list: bool):
+        # expands the lazy tree until min_candidates nodes serve the sample
+        # (and pass the filter, for the rated list) or the tree is complete.
+        # Returns the last filtered nodes, if any.
+        filtered_nodes = None
+        while True:
+            serving = len(self.dht.sample_mapping.get(sample, ()))
+            candidates = serving
+            if is_rated_list and serving > 0:
+                filtered_nodes = self._filter_nodes(block_root, sample, threshold)
+                candidates = len(filtered_nodes)
+
+            if candidates >= self.min_candidates or not self.expansion_queue:
+                return filtered_nodes
+
+            wanted = serving + self.min_candidates - candidates
+            with instrument.phase("lazy_expansion"):
+                self.expand_tree(
+                    lambda: len(self.dht.sample_mapping.get(sample, ())) >= wanted
+                )
 
-        # assuming the grand_child is at the last
-        # level check grand parents(level 1)
-        for parent in self.dht.nodes[grand_child].parents:
-            if check_ancestor in self.dht.nodes[parent].parents:
-                return True
+    def _filter_columns(self, block_root: Root, threshold: float):
+        # filtered nodes of every sample, computed from the scores before any
+        # of the block's requests are issued
+        samples = range(DATA_COLUMN_SIDECAR_SUBNET_COUNT)
+        if self.construction == "lazy":
+            for sample in samples:
+                self._expand_for_sample(block_root, sample, threshold, True)
+
+        view = self._ordered_view(block_root, samples)
+        with instrument.phase("filtering"):
+            if self.backend == "indexed":
+                return indexed_node.filter_columns(view, block_root, samples, threshold)
+            return {
+                sample: self.rl.filter_nodes(view, block_root, sample, threshold)
+                for sample in samples
+                if sample in self.dht.sample_mapping
+            }
+
+    def tree_changed(self):
+        # called after the tree was modified other than through get_peers
+        self._spec_ancestry = None
+        self._ordered_columns = {}
+
+    def ancestor_index(self) -> indexed_node.AncestorIndex:
+        # ancestor bitsets of the current tree, over the dense keys of the
+        # indexed backend or over the spec's node ids in insertion order
+        if self.backend == "indexed":
+            return indexed_node.ancestor_index(self.dht)
+
+        if self._spec_ancestry is None:
+            keys = list(self.dht.nodes)
+            position = {key: i for i, key in enumerate(keys)}
+            # the spec keeps links to deleted parents and children
+            links = [
+                (
+                    set(position[p] for p in self.dht.nodes[key].parents if p in position),
+                    set(position[c] for c in self.dht.nodes[key].children if c in position),
+                )
+                for key in keys
+            ]
+            adjacency = indexed_node.CSRAdjacency.from_sets(
+                [parents for parents, _ in links], [children for _, children in links]
+            )
+            self._spec_ancestry = (keys, position, indexed_node.AncestorIndex.from_adjacency(adjacency))
+        return self._spec_ancestry[2]
+
+    def _ancestry_key(self, key) -> int:
+        if self.backend == "indexed":
+            return key
+        return self._spec_ancestry[1][key]
+
+    def is_ancestor(self, grand_child: NodeId, check_ancestor: NodeId) -> bool:
+        # all nodes are descendants of the root node
+        if check_ancestor == self.dht.own_id or check_ancestor == grand_child:
+            return True
 
-            # if our assumption is wrong the parents are the root node itself
-            if parent == self.dht.own_id:
-                return False
+        index = self.ancestor_index()
+        return index.is_ancestor(self._ancestry_key(grand_child), self._ancestry_key(check_ancestor))
 
-        return False
+    def subtree(self, keys) -> list:
+        # the given nodes and everything below them in the tree, e.g. the
+        # nodes to evict along with a poisoned subtree
+        index = self.ancestor_index()
+        mask = index.subtree_mask([self._ancestry_key(key) for key in keys])
+        if self.backend == "indexed":
+            mask &= np.asarray(self.dht.present[: len(mask)], dtype=bool)
+            return np.flatnonzero(mask).tolist()
+        return [self._spec_ancestry[0][i] for i in np.flatnonzero(mask).tolist()]
 
+    @instrument.timed("query_samples")
     def query_samples(
         self,
         block_root: Root,
         querying_strategy="high",
         is_rated_list: bool = True,
         threshold: float = 0.9,
+        batch_filter: bool = False,
     ):
+        # with batch_filter all samples are filtered in one pass before the
+        # first request, instead of each sample seeing the score updates of
+        # the requests for the samples before it
+        start_time = time.time()
         sampling_result = {"evicted": set(), "filtered": set(), "malicious": set()}
         count = 0
 
@@ -187,26 +673,34 @@ class SimulatedNode:
 
         sampling_result["threshold"] = threshold
 
+        batched = None
+        if batch_filter and is_rated_list:
+            batched = self._filter_columns(block_root, threshold)
+
         # using a random block root just for initial testing
         for sample in range(DATA_COLUMN_SIDECAR_SUBNET_COUNT):
+            filtered_nodes = None
+            if batched is not None:
+                filtered_nodes = batched.get(sample)
+            elif self.construction == "lazy":
+                filtered_nodes = self._expand_for_sample(
+                    block_root, sample, threshold, is_rated_list
+                )
+
             # NOTE: technically all samples must be in the mapping.
             # we just need enough nodes in the network
             if sample not in self.dht.sample_mapping:
                 self.print_debug("No record of nodes that serve sample: " + str(sample))
                 continue
 
-            filtered_nodes = set()
-
             if not is_rated_list:
                 # force random strategy
                 querying_strategy = "no filtering"
                 filtered_nodes = set(
                     [(id, 1.0) for id in self.dht.sample_mapping[sample]]
                 )
-            else:
-                filtered_nodes = rl_node.filter_nodes(
-                    self.dht, block_root, sample, threshold
-                )
+            elif filtered_nodes is None:
+                filtered_nodes = self._filter_nodes(block_root, sample, threshold)
 
             all_nodes = self.dht.sample_mapping[sample]
             filtered_set = set([node[0] for node in filtered_nodes])
@@ -217,10 +711,15 @@ class SimulatedNode:
             # remove nodes that were filtered before but were evicted later
             sampling_result["filtered"] -= sampling_result["evicted"]
 
+            # candidates are requested in vertex order, the set order of the
+            # filtered nodes differs between the backends (and for spec node
+            # ids with the hash seed of the process)
+            candidates = sorted(filtered_nodes, key=lambda a: self.to_vertex(a[0]))
+
             if querying_strategy == "all":
-                for node, _ in filtered_nodes:
-                    count += 1
-                    self.request_sample(node, block_root, sample)
+                nodes = [node for node, _ in candidates]
+                count += len(nodes)
+                self.request_samples(nodes, block_root, sample)
 
                 result = self.process_requests()
 
@@ -233,6 +732,7 @@ class SimulatedNode:
                     ):
                         sampling_result[sample] = True
             else:
+                filtered_nodes = candidates
                 if querying_strategy == "high":
                     # sort the list in descending order
                     sorted(filtered_nodes, key=lambda a: a[1], reverse=True)
@@ -240,108 +740,154 @@ class SimulatedNode:
                     # sort the list in ascending order
                     sorted(filtered_nodes, key=lambda a: a[1], reverse=False)
                 else:
-                    rn.shuffle(list(filtered_nodes))
-
-                for node, _ in filtered_nodes:
-                    count += 1
-                    self.request_sample(node, block_root, sample)
-
-                    # since we make only request the result would contain only one item
-                    result = self.process_requests()[0]
-
-                    # if the request was successful break out of the loop
-                    if (
-                        result[0].node_id == node
-                        and result[0].sample_id == sample
-                        and result[0].block_root == block_root
-                        and result[1]
-                    ):
+                    self.rng.shuffle(list(filtered_nodes))
+
+                if self.attack.is_static:
+                    # answers don't depend on earlier requests, so the nodes
+                    # up to the first one that answers are requested in one
+                    # batch. The resulting scores are the same as requesting
+                    # them one by one.
+                    nodes = [node for node, _ in filtered_nodes]
+                    answers = self.attack.should_respond_batch(
+                        np.array([self.to_vertex(node) for node in nodes], dtype=np.int64)
+                    )
+                    requested = int(np.argmax(answers)) + 1 if answers.any() else len(nodes)
+
+                    count += requested
+                    self.request_samples(nodes[:requested], block_root, sample)
+
+                    result = self.process_requests()
+                    if result and result[-1][1]:
                         sampling_result[sample] = True
-                        break
+                else:
+                    for node, _ in filtered_nodes:
+                        count += 1
+                        self.request_sample(node, block_root, sample)
+
+                        # since we make only request the result would contain only one item
+                        result = self.process_requests()[0]
+
+                        # if the request was successful break out of the loop
+                        if (
+                            result[0].node_id == node
+                            and result[0].sample_id == sample
+                            and result[0].block_root == block_root
+                            and result[1]
+                        ):
+                            sampling_result[sample] = True
+                            break
+
+            if sampling_result.get(sample) and "first_sample_time" not in sampling_result:
+                sampling_result["first_sample_time"] = time.time() - start_time
 
             if sample not in sampling_result:
-                self.print_debug(
-                    f"sampleId={sample} was not found in the network sample_mapping={self.dht.sample_mapping[sample]}"
-                )
-                self.print_debug(
-                    f"total honest nodes selected for sampleId={sample} nodes={self.dht.sample_mapping[sample]-(all_nodes-filtered_nodes)}"
-                )
+                # the messages are only formatted when debugging, they are
+                # expensive for large sample mappings
+                if self.debug:
+                    self.print_debug(
+                        f"sampleId={sample} was not found in the network sample_mapping={self.dht.sample_mapping[sample]}"
+                    )
+                    self.print_debug(
+                        f"total honest nodes selected for sampleId={sample} nodes={self.dht.sample_mapping[sample]-(all_nodes-filtered_set)}"
+                    )
                 sampling_result[sample] = False
 
+        if self.backend != "spec":
+            # reports are always expressed in spec NodeIds
+            for key in ("evicted", "filtered"):
+                sampling_result[key] = set(
+                    [self.to_node_id(node) for node in sampling_result[key]]
+                )
+
         malicious_nodes = self.attack.get_malicious_nodes()
         sampling_result["malicious"] = set(
             [NodeId(int_to_bytes(id)) for id in malicious_nodes]
         )
 
         sampling_result["requests"] = count
+        sampling_result["wall_time"] = time.time() - start_time
 
         return sampling_result
 
-    def print_report(self, report):
+    def report_metrics(self, report) -> dict:
         # Positive Outcome of rated list:
         #     to evict malicious nodes
         # False Positive: evicting honest nodes
         # True Positive: evicting malicious nodes
         # False Negative: NOT evicting malicious nodes
         # True Negative: NOT evicting honest nodes
+        obtained_samples = 0
+        for sample in range(DATA_COLUMN_SIDECAR_SUBNET_COUNT):
+            if sample in report:
+                if report[sample]:
+                    obtained_samples += 1
+
+        return {
+            "threshold": float(report["threshold"]),
+            "strategy": report["strategy"],
+            "evicted": len(report["evicted"]),
+            "malicious": len(report["malicious"]),
+            "filtered": len(report["filtered"]),
+            "false_positives": len(report["evicted"] - report["malicious"]),
+            "true_positives": len(report["evicted"] & report["malicious"]),
+            "true_negatives": len(report["filtered"] - report["malicious"]),
+            "false_negatives": len(report["filtered"] & report["malicious"]),
+            "obtained_samples": obtained_samples,
+            "requests": report["requests"],
+        }
+
+    @instrument.timed("reporting")
+    def metric_record(self, report) -> dict:
+        # flat record of one query for the result sink
+        record = {
+            "attack": type(self.attack).__name__,
+            "rate": self.run_info.get(
+                "rate", len(report["malicious"]) / self.graph.num_nodes()
+            ),
+            "seed": self.run_info.get("seed", -1),
+        }
+        record.update(self.report_metrics(report))
+        record["wall_time"] = report.get("wall_time", 0.0)
+        return record
+
+    @instrument.timed("reporting")
+    def print_report(self, report):
+        metrics = self.report_metrics(report)
+
+        if self.sink is not None:
+            self.sink.write(self.metric_record(report))
 
         logging.info("\n\n\n")
 
         logging.info(f"Threshold: {report['threshold']}")
-        logging.info(f"Sampling Strategy: {report['strategy']}")
-        logging.info(f"Evicted Nodes: {len(report['evicted'])}")
-        logging.info(f"Malicious Nodes: {len(report['malicious'])}")
-        logging.info(f"Filtered Nodes: {len(report['filtered'])}")
-
-        false_positives = set()
-        for node in report["evicted"]:
-            if node not in report["malicious"]:
-                false_positives.add(node)
-
-        true_positives = set()
-        for node in report["evicted"]:
-            if node in report["malicious"]:
-                true_positives.add(node)
-
-        true_negatives = set()
-        for node in report["filtered"]:
-            if node not in report["malicious"]:
-                true_negatives.add(node)
-
-        false_negatives = set()
-        for node in report["filtered"]:
-            if node in report["malicious"]:
-                false_negatives.add(node)
-
-        if (
-            self.dht.own_id not in report["evicted"]
-            or self.dht.own_id not in report["filtered"]
-        ):
-            report["filtered"].add(self.dht.own_id)
+        logging.info(f"Sampling Strategy: {metrics['strategy']}")
+        logging.info(f"Evicted Nodes: {metrics['evicted']}")
+        logging.info(f"Malicious Nodes: {metrics['malicious']}")
+        logging.info(f"Filtered Nodes: {metrics['filtered']}")
+
+        own_id = self.to_node_id(self.dht.own_id)
+        if own_id not in report["evicted"] or own_id not in report["filtered"]:
+            report["filtered"].add(own_id)
 
-        if (len(true_positives) + len(false_negatives)) != len(report["malicious"]):
+        if (metrics["true_positives"] + metrics["false_negatives"]) != metrics["malicious"]:
             logging.info(f"number of malicious nodes doesn't match TP + FN")
             # raise Exception("number of malicious nodes doesn't match TP + FN")
 
-        if (len(false_positives) + len(true_negatives)) != (
-            self.graph.num_nodes() - len(report["malicious"])
+        if (metrics["false_positives"] + metrics["true_negatives"]) != (
+            self.graph.num_nodes() - metrics["malicious"]
         ):
             logging.info(f"number of honest nodes doesn't match TN + FP")
             # raise Exception("number of honest nodes doesn't match TN + FP")
 
         logging.info(
-            f"False Positive Rate: {len(false_positives)/(len(false_positives) + len(true_negatives))}"
+            f"False Positive Rate: {metrics['false_positives']/(metrics['false_positives'] + metrics['true_negatives'])}"
         )
         logging.info(
-            f"False Negative Rate: {len(false_negatives)/(len(false_negatives) + len(true_positives))}"
+            f"False Negative Rate: {metrics['false_negatives']/(metrics['false_negatives'] + metrics['true_positives'])}"
         )
 
-        count = 0
-        for sample in range(DATA_COLUMN_SIDECAR_SUBNET_COUNT):
-            if sample in report:
-                if report[sample]:
-                    count += 1
-
-        logging.info(f"Obtained Samples: {count}/{DATA_COLUMN_SIDECAR_SUBNET_COUNT}")
+        logging.info(
+            f"Obtained Samples: {metrics['obtained_samples']}/{DATA_COLUMN_SIDECAR_SUBNET_COUNT}"
+        )
 
-        logging.info(f"total requests = {report['requests']}")
+        logging.info(f"total requests = {metrics['requests']}")
@@ -0,0 +1,100 @@
+import os
+from hashlib import sha256
+import numpy as np
+import rustworkx as rx
+
+import indexed_node
+from graphs import graph_hash
+from node import MAX_TREE_DEPTH, NodeId, NodeRecord, SampleId
+from utils import bytes_to_int, int_to_bytes
+
+# Snapshots of a constructed rated list tree (nodes, parent links and sample
+# mapping) expressed in graph vertices, so they can be restored into either
+# rated list backend without running _construct_tree again.
+
+
+def snapshot_path(
+    snapshot_dir: str, graph: rx.PyGraph, binding_vertex: int, seed: int = None
+) -> str:
+    key = f"{graph_hash(graph)}-{binding_vertex}-{MAX_TREE_DEPTH}-{seed}"
+    return os.path.join(snapshot_dir, sha256(key.encode()).hexdigest()[:32] + ".npz")
+
+
+def save_snapshot(dht, path: str):
+    if isinstance(dht, indexed_node.IndexedRatedListData):
+        # interned order is kept so a restored tree has the same indices
+        vertices = list(dht.node_ids)
+        present = [vertices[i] for i in range(len(vertices)) if dht.present[i]]
+        own = vertices[dht.own_id]
+        links = [
+            (vertices[parent], vertices[child])
+            for child in range(len(vertices))
+            for parent in dht.parents[child]
+        ]
+        samples = [
+            (sample, vertices[node])
+            for sample, nodes in dht.sample_mapping.items()
+            for node in nodes
+        ]
+    else:
+        vertices = [bytes_to_int(node_id) for node_id in dht.nodes]
+        present = vertices
+        own = bytes_to_int(dht.own_id)
+        links = [
+            (bytes_to_int(parent), bytes_to_int(node_id))
+            for node_id, record in dht.nodes.items()
+            for parent in record.parents
+        ]
+        samples = [
+            (int(sample), bytes_to_int(node_id))
+            for sample, nodes in dht.sample_mapping.items()
+            for node_id in nodes
+        ]
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    # write to a temporary file first so parallel runs never read half a tree
+    tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez(
+        tmp_path,
+        own=np.int64(own),
+        vertices=np.array(vertices, dtype=np.int64),
+        present=np.array(present, dtype=np.int64),
+        links=np.array(links, dtype=np.int64).reshape(-1, 2),
+        samples=np.array(samples, dtype=np.int64).reshape(-1, 2),
+    )
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(dht, path: str):
+    # restores the tree into an empty rated list rooted at the same vertex
+    with np.load(path) as data:
+        own = int(data["own"])
+        vertices = data["vertices"].tolist()
+        present = data["present"].tolist()
+        links = data["links"].tolist()
+        samples = data["samples"].tolist()
+
+    if isinstance(dht, indexed_node.IndexedRatedListData):
+        assert dht.node_ids[dht.own_id] == own, "snapshot of a different root"
+        for vertex in vertices:
+            dht.intern(vertex)
+        for vertex in present:
+            dht.present[dht.index[vertex]] = True
+        for parent, child in links:
+            dht.parents[dht.index[child]].add(dht.index[parent])
+            dht.children[dht.index[parent]].add(dht.index[child])
+        for sample, vertex in samples:
+            dht.sample_mapping.setdefault(sample, set()).add(dht.index[vertex])
+        dht.adjacency = None
+        return
+
+    assert bytes_to_int(dht.own_id) == own, "snapshot of a different root"
+    node_ids = {vertex: NodeId(int_to_bytes(vertex)) for vertex in vertices}
+    for vertex, node_id in node_ids.items():
+        if node_id not in dht.nodes:
+            dht.nodes[node_id] = NodeRecord(node_id, set(), set())
+    for parent, child in links:
+        dht.nodes[node_ids[child]].parents.add(node_ids[parent])
+        dht.nodes[node_ids[parent]].children.add(node_ids[child])
+    for sample, vertex in samples:
+        dht.sample_mapping.setdefault(SampleId(sample), set()).add(node_ids[vertex])
@@ -0,0 +1,272 @@
+import argparse
+import logging
+import multiprocessing as mp
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Sequence, Iterable, Tuple
+import numpy as np
+import rustworkx as rx
+
+from attack import ADAPTIVE_ATTACKS, SybilAttack, ThresholdAttack
+from graphs import graph_hash, graph_init, NUM_NODES_RANDOM, DEGREE
+import instrument
+from memo import ResultCache, config_key, RESULT_CACHE_BYTES
+from node import Root
+from results import ResultSink
+import seeding
+from simulator import SimulatedNode
+from utils import int_to_bytes
+
+SWEEP_OUTPUT_FILE = "./data/sweep_results"
+
+
+@dataclass(frozen=True)
+class SweepPoint:
+    rate: float
+    threshold: float
+    strategy: str
+    is_rated_list: bool
+    seed: int
+
+
+def sybil_grid(
+    seeds: Sequence[int],
+    rates: Iterable[float] = np.arange(0.1, 1.0, 0.1),
+    thresholds: Iterable[float] = np.arange(0.9, 0.0, -0.1),
+    strategies: Sequence[str] = ("high", "low", "random"),
+) -> List[SweepPoint]:
+    # same grid as sybil_poisoning_test, ordered so that consecutive points
+    # share the (seed, rate) a worker builds its simulated node for
+    return [
+        SweepPoint(round(float(rate), 2), round(float(threshold), 2), strategy, is_rated_list, seed)
+        for seed in seeds
+        for rate in rates
+        for threshold in thresholds
+        for strategy in strategies
+        for is_rated_list in (True, False)
+    ]
+
+
+# per worker state. The graph is handed over once when the worker starts
+# (inherited as is with the fork start method) instead of every worker
+# parsing the graph file again.
+_graph: rx.PyGraph = None
+_options: Dict = {}
+_sim_node_key = None
+_sim_node: SimulatedNode = None
+_behaviour: str = None
+
+
+def _init_worker(graph: rx.PyGraph, options: Dict, behaviour: str = None):
+    global _graph, _options, _sim_node_key, _sim_node, _behaviour
+    _graph = graph
+    _options = options
+    _sim_node_key = None
+    _sim_node = None
+    _behaviour = behaviour
+
+
+def _get_sim_node(rate: float, seed: int) -> SimulatedNode:
+    # the tree is only rebuilt when a worker moves on to another (seed, rate)
+    global _sim_node_key, _sim_node
+
+    if _sim_node_key != (seed, rate):
+        # the sybil attack adds edges, keep the shared graph untouched
+        graph = _graph.copy()
+        _sim_node = SimulatedNode(graph=graph, seed=seed, **_options)
+        attack = SybilAttack(graph=graph, sybil_rate=rate, seed=seed)
+        if _behaviour is not None:
+            # the sybils answer adaptively instead of withholding everything
+            attack = ADAPTIVE_ATTACKS[_behaviour](attack, seed=seed)
+        _sim_node.load_attack(attack)
+        _sim_node.run_info = {"rate": rate, "seed": seed}
+        _sim_node_key = (seed, rate)
+
+    return _sim_node
+
+
+def run_point(point: SweepPoint) -> Dict:
+    sim_node = _get_sim_node(point.rate, point.seed)
+    block_root = Root(int_to_bytes(0))
+
+    sim_node.refresh_scores()
+    if isinstance(sim_node.attack, ThresholdAttack):
+        # the sybils game the threshold the point filters with
+        sim_node.attack.threshold = point.threshold
+    report = sim_node.query_samples(
+        block_root,
+        point.strategy,
+        is_rated_list=point.is_rated_list,
+        threshold=point.threshold,
+    )
+
+    record = sim_node.metric_record(report)
+    record["is_rated_list"] = point.is_rated_list
+    return record
+
+
+def run_point_profiled(point: SweepPoint) -> Tuple[Dict, Dict]:
+    # the record together with what the worker's profile collected for it
+    record = run_point(point)
+    return record, instrument.active().take().to_json()
+
+
+def _run_keyed(run_and_point) -> Tuple[SweepPoint, object]:
+    # results arrive out of order, the point tells which cache key they get
+    run, point = run_and_point
+    return point, run(point)
+
+
+def point_key(graph_key: str, point: SweepPoint, options: Dict, behaviour: str = None) -> str:
+    # the cache key of a sweep point, options that do not change the result
+    # are left out
+    return config_key(
+        graph_key,
+        "SybilAttack" if behaviour is None else ADAPTIVE_ATTACKS[behaviour].__name__,
+        {"sybil_rate": point.rate},
+        point.threshold,
+        point.strategy,
+        point.seed,
+        is_rated_list=point.is_rated_list,
+        backend=options.get("backend", "spec"),
+        score_mode=options.get("score_mode", "sets"),
+    )
+
+
+def run_sweep(
+    graph: rx.PyGraph,
+    points: Sequence[SweepPoint],
+    output: str = SWEEP_OUTPUT_FILE,
+    workers: int = None,
+    profile_path: str = None,
+    cache: ResultCache = None,
+    behaviour: str = None,
+    **options,
+) -> int:
+    workers = workers or os.cpu_count()
+
+    # points with a cached result are written straight away, only the others
+    # are run and their results added to the cache
+    cached = []
+    keys = {}
+    if cache is not None:
+        graph_key = graph_hash(graph)
+        remaining = []
+        for point in points:
+            keys[point] = point_key(graph_key, point, options, behaviour)
+            record = cache.get(keys[point])
+            if record is None:
+                remaining.append(point)
+            else:
+                cached.append(record)
+        points = remaining
+        logging.info(f"{len(cached)} cached results, running {len(points)} points")
+
+    # one chunk per (seed, rate) so each chunk constructs its tree once
+    chunksize = max(1, len(points) // max(1, len(set((p.seed, p.rate) for p in points))))
+
+    # with a profile path every worker profiles its points, the profiles are
+    # merged here and written out at the end
+    run = run_point
+    profile = None
+    if profile_path is not None:
+        options["profile"] = True
+        run = run_point_profiled
+        profile = instrument.Profile()
+
+    store = None
+    work = points
+    if cache is not None:
+        work = [(run, point) for point in points]
+        run = _run_keyed
+
+        def store(point: SweepPoint, record: Dict):
+            cache.put(keys[point], record)
+
+    if workers == 1:
+        _init_worker(graph, options, behaviour)
+        count = _write_records(map(run, work), output, profile, cached, store)
+        if profile is not None:
+            instrument.disable()
+    else:
+        with mp.Pool(workers, initializer=_init_worker, initargs=(graph, options, behaviour)) as pool:
+            count = _write_records(
+                pool.imap_unordered(run, work, chunksize=chunksize), output, profile, cached, store
+            )
+
+    if profile is not None:
+        profile.dump(profile_path)
+    return count
+
+
+def _write_records(
+    records: Iterable,
+    output: str,
+    profile: instrument.Profile = None,
+    cached: Sequence[Dict] = (),
+    store=None,
+) -> int:
+    # results are streamed into one combined result sink as they arrive
+    with ResultSink(output) as sink:
+        for record in cached:
+            sink.write(record)
+        for record in records:
+            if store is not None:
+                point, record = record
+            if profile is not None:
+                record, point_profile = record
+                profile.merge(instrument.Profile.from_json(point_profile))
+            if store is not None:
+                store(point, record)
+            sink.write(record)
+    return sink.written
+
+
+def main():
+    # results of the same seed must not depend on the process they ran in
+    seeding.pin_hash_seed()
+
+    parser = argparse.ArgumentParser(description="parallel sybil poisoning sweep")
+    parser.add_argument("--seeds", type=int, default=1, help="number of seeds per grid point")
+    parser.add_argument("--workers", type=int, default=None, help="defaults to all cores")
+    parser.add_argument("--output", default=SWEEP_OUTPUT_FILE)
+    parser.add_argument("--backend", default="spec", choices=["spec", "indexed"])
+    parser.add_argument("--score-mode", default="sets", choices=["sets", "counts"])
+    parser.add_argument("--nodes", type=int, default=NUM_NODES_RANDOM)
+    parser.add_argument("--degree", type=int, default=DEGREE)
+    parser.add_argument("--graph-seed", type=int, default=None)
+    parser.add_argument("--snapshots", default=None, help="directory of cached rated list trees")
+    parser.add_argument(
+        "--profile", default=None, help="write counters and phase timings (.json or collapsed stacks)"
+    )
+    parser.add_argument("--cache", default=None, help="directory of cached results, reused across sweeps")
+    parser.add_argument("--cache-size", type=int, default=RESULT_CACHE_BYTES >> 20, help="in MB")
+    parser.add_argument(
+        "--behaviour", default=None, choices=sorted(ADAPTIVE_ATTACKS), help="adaptive sybils, static if unset"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(message)s")
+
+    graph = graph_init(args.nodes, args.degree, args.graph_seed)
+    points = sybil_grid(range(1, args.seeds + 1))
+
+    start_time = time.time()
+    count = run_sweep(
+        graph,
+        points,
+        output=args.output,
+        workers=args.workers,
+        backend=args.backend,
+        score_mode=args.score_mode,
+        snapshot_dir=args.snapshots,
+        profile_path=args.profile,
+        cache=None if args.cache is None else ResultCache(args.cache, args.cache_size << 20),
+        behaviour=args.behaviour,
+    )
+    logging.info(f"wrote {count} results to {args.output} in {time.time()-start_time}s")
+
+
+if __name__ == "__main__":
+    main()
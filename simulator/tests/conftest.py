@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+import rustworkx as rx
+
+# the simulator modules import each other as top level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def graph() -> rx.PyGraph:
+    # small G(n, p) graph with the vertex indices as payloads, like the graph
+    # files have. Built here so the tests leave no graph cache behind.
+    random_graph = rx.undirected_gnp_random_graph(400, 20 / 400, seed=1)
+    graph = rx.PyGraph()
+    graph.add_nodes_from(range(random_graph.num_nodes()))
+    graph.add_edges_from_no_data(random_graph.edge_list())
+    return graph
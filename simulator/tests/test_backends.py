@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+import indexed_node
+from attack import SybilAttack
+from node import DATA_COLUMN_SIDECAR_SUBNET_COUNT, Root
+from simulator import SimulatedNode
+from utils import int_to_bytes
+
+
+def run_report(graph, backend: str, strategy: str, seed: int = 3, **options) -> dict:
+    sim_node = SimulatedNode(graph=graph, seed=seed, backend=backend, **options)
+    sim_node.load_attack(SybilAttack(graph=graph.copy(), sybil_rate=0.4, seed=seed))
+    for block in range(2):
+        report = sim_node.query_samples(Root(int_to_bytes(block)), strategy)
+    return sim_node.report_metrics(report)
+
+
+@pytest.mark.parametrize("strategy", ["high", "random", "all"])
+def test_indexed_backend_reports_match_spec(graph, strategy):
+    expected = run_report(graph, "spec", strategy)
+    assert run_report(graph, "indexed", strategy) == expected
+    assert run_report(graph, "indexed", strategy, score_mode="counts") == expected
+
+
+@pytest.mark.parametrize("backend", ["spec", "indexed"])
+def test_debug_report_of_missed_samples(graph, backend):
+    # with most nodes withholding some samples are missed, their debug
+    # messages are formatted too
+    sim_node = SimulatedNode(graph=graph, seed=3, backend=backend, debug=True)
+    sim_node.load_attack(SybilAttack(graph=graph.copy(), sybil_rate=0.9, seed=3))
+    report = sim_node.query_samples(Root(int_to_bytes(0)), "high")
+    assert not all(report.get(sample, True) for sample in range(DATA_COLUMN_SIDECAR_SUBNET_COUNT))
+
+
+def test_lazy_construction_reports_match_spec(graph):
+    expected = run_report(graph, "spec", "high", construction="lazy")
+    assert run_report(graph, "indexed", "high", construction="lazy") == expected
+
+
+@pytest.mark.parametrize("score_mode", ["sets", "counts"])
+def test_filter_columns_matches_filter_nodes(graph, score_mode):
+    sim_node = SimulatedNode(graph=graph, seed=3, backend="indexed", score_mode=score_mode)
+    sim_node.load_attack(SybilAttack(graph=graph.copy(), sybil_rate=0.4, seed=3))
+    block_root = Root(int_to_bytes(0))
+    sim_node.query_samples(block_root, "high")
+
+    samples = range(DATA_COLUMN_SIDECAR_SUBNET_COUNT)
+    # thresholds that split the scores of the tree, and the default one
+    scores = indexed_node.compute_node_scores(sim_node.dht, block_root)
+    thresholds = [float(np.quantile(scores, q)) for q in (0.1, 0.5, 0.9)] + [0.9]
+    # the unordered tree and the vertex ordered view query_samples filters
+    for view in (sim_node.dht, sim_node._ordered_view(block_root, samples)):
+        evicted = 0
+        for threshold in thresholds:
+            batched = indexed_node.filter_columns(view, block_root, samples, threshold)
+            for sample in samples:
+                if sample not in view.sample_mapping:
+                    continue
+                expected = indexed_node.filter_nodes(view, block_root, sample, threshold)
+                assert batched[sample] == expected
+                evicted += len(view.sample_mapping[sample]) - len(expected)
+        assert evicted > 0
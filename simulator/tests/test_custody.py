@@ -0,0 +1,45 @@
+import random
+
+import pytest
+
+import node as rl_node
+from custody import UINT256_MAX, CustodyTable, compute_custody_columns
+from node import DATA_COLUMN_SIDECAR_SUBNET_COUNT, MIN_CUSTODY_COUNT, NodeId, get_custody_columns
+from utils import int_to_bytes
+
+# random 256 bit ids, and ids right below UINT256_MAX whose candidate ids wrap
+# around to 1
+_rng = random.Random(1)
+NODE_IDS = [_rng.getrandbits(256) for _ in range(50)] + [UINT256_MAX - i for i in range(8)]
+
+
+@pytest.fixture(autouse=True)
+def spec_wraparound(monkeypatch):
+    # get_custody_columns wraps around with current_id = NodeId(0), which
+    # remerkleable rejects as Bytes32 takes bytes. Read it as the uint256 the
+    # loop counts with, so ids near UINT256_MAX can be compared as well.
+    monkeypatch.setattr(rl_node, "NodeId", rl_node.uint256)
+
+
+def spec_columns(node_id: int, custody_subnet_count: int) -> list:
+    columns = get_custody_columns(NodeId(int_to_bytes(node_id)), custody_subnet_count)
+    return [int(column) for column in columns]
+
+
+@pytest.mark.parametrize(
+    "custody_subnet_count",
+    [int(MIN_CUSTODY_COUNT), 8, 64, int(DATA_COLUMN_SIDECAR_SUBNET_COUNT)],
+)
+def test_custody_columns_match_the_spec(custody_subnet_count):
+    # the larger counts need more candidates than subnets, repeated subnets
+    # go through the spec loop
+    columns = compute_custody_columns(NODE_IDS, custody_subnet_count)
+    for node_id, row in zip(NODE_IDS, columns):
+        assert row.tolist() == spec_columns(node_id, custody_subnet_count)
+
+
+def test_custody_table_matches_the_spec():
+    table = CustodyTable.for_vertices(100)
+    # vertices past the end of the table fall back to the spec
+    for vertex in list(range(100)) + [100, 1000]:
+        assert table.get(vertex) == spec_columns(vertex, MIN_CUSTODY_COUNT)
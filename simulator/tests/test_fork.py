@@ -0,0 +1,37 @@
+import pytest
+
+from attack import SybilAttack
+from node import Root
+from simulator import SimulatedNode
+from utils import int_to_bytes
+
+
+def tree_state(sim_node: SimulatedNode):
+    dht = sim_node.dht
+    if sim_node.backend == "spec":
+        keys = dht.nodes.keys()
+    else:
+        keys = [key for key, present in enumerate(dht.present) if present]
+    return (
+        sorted(sim_node.to_vertex(key) for key in keys),
+        {sample: len(nodes) for sample, nodes in dht.sample_mapping.items()},
+        [(sim_node.to_vertex(key), level) for key, level in sim_node.expansion_queue],
+        len(sim_node.expanded),
+        sim_node.get_peers_calls,
+    )
+
+
+@pytest.mark.parametrize("backend", ["spec", "indexed"])
+def test_lazy_branches_expand_their_own_tree(graph, backend):
+    sim_node = SimulatedNode(graph=graph, seed=3, backend=backend, construction="lazy")
+    sim_node.load_attack(SybilAttack(graph=graph.copy(), sybil_rate=0.4, seed=3))
+    sampled, untouched = sim_node.fork(), sim_node.fork()
+    before = tree_state(untouched)
+
+    sampled_report = sampled.report_metrics(sampled.query_samples(Root(int_to_bytes(0)), "high"))
+
+    assert tree_state(sampled) != before
+    assert tree_state(untouched) == before
+    assert tree_state(sim_node) == before
+    # the untouched branch still samples from the unexpanded tree
+    assert untouched.report_metrics(untouched.query_samples(Root(int_to_bytes(0)), "high")) == sampled_report
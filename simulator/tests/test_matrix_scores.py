@@ -0,0 +1,40 @@
+import pytest
+
+import matrix_scores
+from attack import SybilAttack
+from custody import CustodyTable
+from node import Root
+from simulator import SimulatedNode
+from utils import int_to_bytes
+
+try:
+    import scipy.sparse
+except ImportError:
+    scipy = None
+
+
+requires_scipy = pytest.mark.skipif(scipy is None, reason="scipy is not installed")
+
+
+# the scipy.sparse products and the numpy scatter add used without scipy
+@pytest.mark.parametrize("use_scipy", [pytest.param(True, marks=requires_scipy), False])
+@pytest.mark.parametrize("score_mode", ["sets", "counts"])
+def test_matrix_scores_match_the_spec(graph, monkeypatch, score_mode, use_scipy):
+    if not use_scipy:
+        monkeypatch.setattr(matrix_scores, "sparse", None)
+
+    sim_node = SimulatedNode(
+        graph=graph,
+        seed=3,
+        backend="indexed",
+        score_mode=score_mode,
+        custody=CustodyTable.for_graph(graph),
+    )
+    sim_node.load_attack(SybilAttack(graph=graph.copy(), sybil_rate=0.3, seed=3))
+
+    block_root = Root(int_to_bytes(0))
+    for block in range(3):
+        sim_node.query_samples(block_root, "high")
+        # raises if any score differs from compute_descendant_score or
+        # compute_node_score of node.py by more than atol
+        assert matrix_scores.validate(sim_node.dht, block_root) <= 1e-12
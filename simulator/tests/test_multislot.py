@@ -0,0 +1,48 @@
+import copy
+
+from attack import SybilAttack
+from multislot import run_slots
+from scorestate import aggregate_score_keepers
+from simulator import SimulatedNode
+
+
+class FreshViewNode(SimulatedNode):
+    # builds the aggregated view from scratch on every call
+    def _scoring_view(self, block_root):
+        roots = [root for root in self.dht.scores.keys() if root != block_root]
+        roots = roots[max(0, len(roots) - (self.aggregate_blocks - 1)) :] + [block_root]
+        keepers = [self.dht.scores.get(root) for root in roots]
+        keepers = [keeper for keeper in keepers if keeper is not None]
+        if not keepers:
+            return self.dht
+
+        view = copy.copy(self.dht)
+        view.scores = {block_root: aggregate_score_keepers(keepers)}
+        view.score_caches = {}
+        return view
+
+
+def slot_records(graph, node_class) -> list:
+    sim_node = node_class(
+        graph=graph,
+        seed=3,
+        backend="indexed",
+        score_mode="counts",
+        max_blocks=4,
+        aggregate_blocks=3,
+    )
+    sim_node.load_attack(SybilAttack(graph=graph.copy(), sybil_rate=0.4, seed=3))
+
+    records = run_slots(sim_node, 3)
+    checkpoint = sim_node.checkpoint()
+    records += run_slots(sim_node, 2, first_slot=3)
+    # the restored keepers have the same sizes as the ones they replace
+    sim_node.restore(checkpoint)
+    records += run_slots(sim_node, 3, first_slot=3)
+    for record in records:
+        del record["wall_time"]
+    return records
+
+
+def test_reused_aggregate_view_matches_a_fresh_one(graph):
+    assert slot_records(graph, SimulatedNode) == slot_records(graph, FreshViewNode)
@@ -0,0 +1,56 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+SIMULATOR_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# one query in a fresh process, synchronous or with simulated latencies,
+# printed as json
+REPORT_SCRIPT = """
+import json, sys
+import rustworkx as rx
+from attack import SybilAttack
+from latency import LatencyModel, LatencySampler
+from node import Root
+from simulator import SimulatedNode
+from utils import int_to_bytes
+
+random_graph = rx.undirected_gnp_random_graph(400, 20 / 400, seed=1)
+graph = rx.PyGraph()
+graph.add_nodes_from(range(random_graph.num_nodes()))
+graph.add_edges_from_no_data(random_graph.edge_list())
+
+sim_node = SimulatedNode(graph=graph, seed=5, backend=sys.argv[1])
+sim_node.load_attack(SybilAttack(graph=graph.copy(), sybil_rate=0.4, seed=5))
+if sys.argv[2] == "latency":
+    sampler = LatencySampler(sim_node, LatencyModel(seed=5), fanout=2)
+    report = sampler.query_samples(Root(int_to_bytes(0)), "high", 0.9)
+    metrics = sim_node.report_metrics(report)
+    metrics["completion_times"] = sorted(report["completion_times"].items())
+else:
+    report = sim_node.query_samples(Root(int_to_bytes(0)), "random")
+    metrics = sim_node.report_metrics(report)
+print(json.dumps(metrics, sort_keys=True))
+"""
+
+
+def report_in_process(backend: str, mode: str, hash_seed: str) -> dict:
+    env = dict(os.environ, PYTHONHASHSEED=hash_seed, PYTHONPATH=SIMULATOR_DIR)
+    output = subprocess.run(
+        [sys.executable, "-c", REPORT_SCRIPT, backend, mode],
+        cwd=SIMULATOR_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+@pytest.mark.parametrize("mode", ["sync", "latency"])
+@pytest.mark.parametrize("backend", ["spec", "indexed"])
+def test_reports_do_not_depend_on_the_hash_seed(backend, mode):
+    assert report_in_process(backend, mode, "1") == report_in_process(backend, mode, "2")